@@ -1,47 +1,94 @@
 import os
+import time
 import numpy as np
 from PIL import Image
 import json
 from tqdm import tqdm
 from skimage.transform import resize
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-def process_single_image(img_path, target_size, reverse_label_map, verbose=False):
-    try:
-        if verbose:
-            print(f"Processing image: {img_path}")
-        with Image.open(img_path) as img:
-            img_array = np.array(img.convert('L'), dtype=np.uint8)
-        
-        # Resize image
-        img_array = resize(img_array, target_size, anti_aliasing=True)
-        img_array = (img_array * 255).astype(np.uint8)  # Scale to 0-255 range
-        
-        # Extract label (index) from filename
-        filename = os.path.basename(img_path)
-        label_index = int(filename.split('_')[1].split('.')[0])
-        if verbose:
-            print(f"Extracted label index '{label_index}' from filename '{filename}'")
-
-        # Check if label index exists in reverse_label_map
-        if label_index not in reverse_label_map:
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.data.shards import SPLITS, has_shards, load_npz_split, open_split
+
+def load_image(img_path, target_size):
+    with Image.open(img_path) as img:
+        img_array = np.array(img.convert('L'), dtype=np.uint8)
+
+    # Resize image
+    img_array = resize(img_array, target_size, anti_aliasing=True)
+    return (img_array * 255).astype(np.uint8)  # Scale to 0-255 range
+
+def label_from_filename(img_path):
+    # Files are saved as "<index>_<label index>.png" by make_dataset
+    filename = os.path.basename(img_path)
+    return int(filename.split('_')[1].split('.')[0])
+
+def image_sort_key(filename):
+    # Numeric order of the "<index>_" prefix, so runs always see the same image order
+    prefix = filename.split('_')[0]
+    return (0, int(prefix), filename) if prefix.isdigit() else (1, 0, filename)
+
+def process_chunk(images_file, start, img_paths, target_size, verbose=False):
+    # Runs in a worker process: decodes and resizes a run of images and writes each one in
+    # place at its own row of the memory-mapped output, so nothing is sent back but indices
+    images = np.load(images_file, mmap_mode='r+')
+    failed = []
+    for offset, img_path in enumerate(img_paths):
+        try:
+            images[start + offset] = load_image(img_path, target_size)
+        except Exception as e:
             if verbose:
-                print(f"Warning: Label index '{label_index}' not found in reverse_label_map.")
-            return None, None
-        
-        # Get the corresponding label name
-        label = reverse_label_map[label_index]
-        if verbose:
-            print(f"Mapped label index '{label_index}' to label '{label}'")
-
-        return img_array, label_index
-    except Exception as e:
-        if verbose:
-            print(f"Error processing image {img_path}: {e}")
-        return None, None
-
-def preprocess_data(raw_dir, processed_dir, target_size=(224, 224), max_images=20000, verbose=False):
+                print(f"Error processing image {img_path}: {e}")
+            failed.append(start + offset)
+    images.flush()
+    del images
+    return len(img_paths), failed
+
+def drop_failed_rows(images_file, failed, chunk_size=1024):
+    # Rewrites the array without the rows that failed to decode, a chunk at a time
+    images = np.load(images_file, mmap_mode='r')
+    keep = np.setdiff1d(np.arange(len(images)), failed)
+    compacted_file = f"{images_file}.compact"
+    compacted = np.lib.format.open_memmap(compacted_file, mode='w+', dtype=images.dtype, shape=(len(keep),) + images.shape[1:])
+    for start in range(0, len(keep), chunk_size):
+        compacted[start:start + chunk_size] = images[keep[start:start + chunk_size]]
+    compacted.flush()
+    del compacted, images
+    os.replace(compacted_file, images_file)
+    return keep
+
+def preprocess_split(image_paths, labels, images_file, labels_file, target_size, num_workers, chunk_size, desc, verbose=False):
+    # Preallocated uint8 array on disk; workers fill rows in place, so memory use stays flat
+    # however many images there are. Written under a temporary name until complete.
+    partial_file = f"{images_file}.partial"
+    images = np.lib.format.open_memmap(partial_file, mode='w+', dtype=np.uint8, shape=(len(image_paths),) + tuple(target_size))
+    del images
+
+    start_time = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(process_chunk, partial_file, start, image_paths[start:start + chunk_size], target_size, verbose)
+            for start in range(0, len(image_paths), chunk_size)
+        ]
+        with tqdm(total=len(image_paths), desc=desc) as progress:
+            for future in as_completed(futures):
+                processed, chunk_failed = future.result()
+                failed.extend(chunk_failed)
+                progress.update(processed)
+    elapsed = time.perf_counter() - start_time
+
+    if failed:
+        print(f"{len(failed)} images could not be processed and were dropped.")
+        labels = labels[drop_failed_rows(partial_file, sorted(failed))]
+    os.replace(partial_file, images_file)
+    np.save(labels_file, labels)
+
+    rate = len(image_paths) / elapsed if elapsed > 0 else 0.0
+    print(f"{desc}: {len(labels)} images in {elapsed:.1f}s ({rate:.1f} images/s, {num_workers} processes)")
+    return len(labels), rate
+
+def preprocess_data(raw_dir, processed_dir, target_size=(224, 224), max_images=20000, verbose=False, num_workers=None, chunk_size=256):
     os.makedirs(processed_dir, exist_ok=True)
+    num_workers = num_workers or os.cpu_count() or 1
 
     # Load label names
     label_names_file = os.path.join(raw_dir, 'label_names.txt')
@@ -56,6 +103,9 @@ def preprocess_data(raw_dir, processed_dir, target_size=(224, 224), max_images=2
     if verbose:
         print(f"Created reverse_label_map: {reverse_label_map}")
 
+    sizes = {}
+    rates = {}
+
     # Process train and test data
     for split in ['train', 'test']:
         split_dir = os.path.join(raw_dir, split)
@@ -66,59 +116,46 @@ def preprocess_data(raw_dir, processed_dir, target_size=(224, 224), max_images=2
 
         if verbose:
             print(f"Processing {split} data in {split_dir}")
-        
-        # Initialize empty lists for images and labels
-        images = []
-        labels = []
-        
-        # Paths for processed files
-        images_file = os.path.join(processed_dir, f'{split}_images.npz')
-        labels_file = os.path.join(processed_dir, f'{split}_labels.npz')
 
-        # Flags to determine what needs processing
-        process_images = not os.path.exists(images_file)
-        process_labels = not os.path.exists(labels_file)
+        # Paths for processed files
+        images_file = os.path.join(processed_dir, f'{split}_images.npy')
+        labels_file = os.path.join(processed_dir, f'{split}_labels.npy')
 
-        if not process_images and not process_labels:
+        if os.path.exists(images_file) and os.path.exists(labels_file):
             if verbose:
                 print(f"Both processed files for {split} data already exist. Skipping...")
+            sizes[split] = "Already processed"
             continue
 
-        image_paths = [os.path.join(split_dir, filename) for filename in os.listdir(split_dir)[:max_images]]
+        # Sorted, so row i is the same image on every run
+        filenames = sorted(os.listdir(split_dir), key=image_sort_key)[:max_images]
+        image_paths = []
+        labels = []
+        for filename in filenames:
+            try:
+                label_index = label_from_filename(filename)
+            except (IndexError, ValueError):
+                label_index = None
+            if label_index not in reverse_label_map:
+                if verbose:
+                    print(f"Warning: no known label index in filename '{filename}'. Skipping...")
+                continue
+            image_paths.append(os.path.join(split_dir, filename))
+            labels.append(label_index)
         if verbose:
             print(f"Processing up to {max_images} images for {split} split")
 
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(process_single_image, img_path, target_size, reverse_label_map, verbose): img_path for img_path in image_paths}
-            for future in tqdm(as_completed(futures), total=len(futures), desc=f"Processing {split} images"):
-                img_array, label_index = future.result()
-                if img_array is not None and label_index is not None:
-                    if process_images:
-                        images.append(img_array)
-                    if process_labels:
-                        labels.append(label_index)
+        if not image_paths:
+            if verbose:
+                print(f"No images to save for {split}.")
+            continue
 
+        sizes[split], rates[split] = preprocess_split(
+            image_paths, np.array(labels, dtype=np.int64), images_file, labels_file,
+            target_size, num_workers, chunk_size, f"Processing {split} images", verbose,
+        )
         if verbose:
-            print(f"Finished processing {split} images. Collected {len(images)} images and {len(labels)} labels.")
-        
-        # Save processed data only for missing files
-        if process_images:
-            if images:
-                np.savez_compressed(images_file, images=np.array(images))
-                if verbose:
-                    print(f"Saved images to {images_file}")
-            else:
-                if verbose:
-                    print(f"No images to save for {split}.")
-
-        if process_labels:
-            if labels:
-                np.savez_compressed(labels_file, labels=np.array(labels))
-                if verbose:
-                    print(f"Saved labels to {labels_file}")
-            else:
-                if verbose:
-                    print(f"No labels to save for {split}.")
+            print(f"Saved images to {images_file} and labels to {labels_file}")
 
     # Save label map if it doesn't exist
     label_map_file = os.path.join(processed_dir, 'label_map.json')
@@ -133,10 +170,20 @@ def preprocess_data(raw_dir, processed_dir, target_size=(224, 224), max_images=2
         print(f"Processed data saved in {processed_dir}")
 
     return {
-        "train_size": len(images) if process_images else "Already processed",
+        "train_size": sizes.get('train', 0),
+        "test_size": sizes.get('test', 0),
+        "images_per_sec": rates,
         "num_classes": len(label_map)
     }
 
+def inspect_npy_file(file_path):
+    print(f"Inspecting file: {file_path}")
+    array = np.load(file_path, mmap_mode='r')
+    print(f"  Shape: {array.shape}")
+    print(f"  Data type: {array.dtype}")
+    print(f"  Number of elements: {array.size}")
+    print()
+
 def inspect_npz_file(file_path):
     print(f"Inspecting file: {file_path}")
     with np.load(file_path) as data:
@@ -150,61 +197,27 @@ def inspect_npz_file(file_path):
 
 
 
-def load_data(processed_dir, verbose=False):    # Convert processed_dir to an absolute path
+def load_data(processed_dir, verbose=False):
+    # {'train': split, 'val': split, 'test': split}, each split indexable as (image, label)
+    # with images() and labels(). Sharded splits are memory-mapped; X_/y_<split>.npz files
+    # from older runs (python -m src.data.shards converts them) are loaded into memory.
+    # Convert processed_dir to an absolute path
     processed_dir = os.path.abspath(processed_dir)
     if verbose:
         print(f"Using processed directory: {processed_dir}")
 
     try:
-        # Define paths to each processed data file
-        train_images_path = os.path.join(processed_dir, 'X_train.npz')
-        train_labels_path = os.path.join(processed_dir, 'y_train.npz')
-        val_images_path = os.path.join(processed_dir, 'X_val.npz')
-        val_labels_path = os.path.join(processed_dir, 'y_val.npz')
-        test_images_path = os.path.join(processed_dir, 'X_test.npz')
-        test_labels_path = os.path.join(processed_dir, 'y_test.npz')
-
-        if verbose:
-            print(f"Looking for training images at: {train_images_path}")
-            print(f"Looking for training labels at: {train_labels_path}")
-            print(f"Looking for validation images at: {val_images_path}")
-            print(f"Looking for validation labels at: {val_labels_path}")
-            print(f"Looking for test images at: {test_images_path}")
-            print(f"Looking for test labels at: {test_labels_path}")
-
-        # Initialize a data dictionary to hold all loaded datasets
         data = {}
-
-        # Load training data if both image and label files exist
-        if os.path.exists(train_images_path) and os.path.exists(train_labels_path):
-            data['X_train'] = np.load(train_images_path)['images']
-            data['y_train'] = np.load(train_labels_path)['labels']
-            if verbose:
-                print(f"Training data loaded: {data['X_train'].shape}, {data['y_train'].shape}")
-        else:
-            print("Training data files not found in processed_dir.")
-            return None
-
-        # Load validation data if both image and label files exist
-        if os.path.exists(val_images_path) and os.path.exists(val_labels_path):
-            data['X_val'] = np.load(val_images_path)['images']
-            data['y_val'] = np.load(val_labels_path)['labels']
-            if verbose:
-                print(f"Validation data loaded: {data['X_val'].shape}, {data['y_val'].shape}")
-        else:
-            print("Validation data files not found in processed_dir.")
-            return None
-
-        # Load test data if both image and label files exist
-        if os.path.exists(test_images_path) and os.path.exists(test_labels_path):
-            data['X_test'] = np.load(test_images_path)['images']
-            data['y_test'] = np.load(test_labels_path)['labels']
+        for split in SPLITS:
+            if has_shards(processed_dir, split):
+                data[split] = open_split(processed_dir, split)
+            else:
+                data[split] = load_npz_split(processed_dir, split)
+            if data[split] is None:
+                print(f"No shards or npz files for {split} in processed_dir.")
+                return None
             if verbose:
-                print(f"Test data loaded: {data['X_test'].shape}, {data['y_test'].shape}")
-        else:
-            print("Test data files not found in processed_dir.")
-            return None
-
+                print(f"{split} data loaded: {len(data[split])} images")
         return data
 
     except FileNotFoundError as fnf_error:
@@ -217,11 +230,12 @@ def load_data(processed_dir, verbose=False):    # Convert processed_dir to an ab
 
 
 if __name__ == "__main__":
+    # Run from the SketchClassifier directory: python -m src.data.preprocess
     # Set verbose to True or False based on preference
     results = preprocess_data("data/raw", "data/processed", max_images=20000, verbose=True)
     print(f"Preprocessing completed. Processed {results['train_size']} images across {results['num_classes']} classes.")
     
-    # Inspect the saved npz files
-    print("\nInspecting processed .npz files:")
-    inspect_npz_file("data/processed/train_images.npz")
-    inspect_npz_file("data/processed/test_labels.npz")
+    # Inspect the saved npy files
+    print("\nInspecting processed .npy files:")
+    inspect_npy_file("data/processed/train_images.npy")
+    inspect_npy_file("data/processed/test_labels.npy")
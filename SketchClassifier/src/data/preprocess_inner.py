@@ -2,25 +2,31 @@ import os
 import numpy as np
 from sklearn.model_selection import train_test_split, StratifiedShuffleSplit
 import logging
+from src.data.shards import shard_dir, write_shards
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-def prepare_train_val_test_data(processed_dir, test_size=0.2, random_state=42):
-    train_images_file = os.path.join(processed_dir, 'train_images.npz')
-    train_labels_file = os.path.join(processed_dir, 'train_labels.npz')
-    test_images_file = os.path.join(processed_dir, 'test_images.npz')
-    test_labels_file = os.path.join(processed_dir, 'test_labels.npz')
-    
-    if not all(os.path.exists(file) for file in [train_images_file, train_labels_file, test_images_file, test_labels_file]):
+def load_processed_array(processed_dir, name, key):
+    # preprocess_data writes memory-mapped .npy files; older runs left compressed .npz ones
+    npy_file = os.path.join(processed_dir, f'{name}.npy')
+    if os.path.exists(npy_file):
+        return np.load(npy_file, mmap_mode='r')
+    npz_file = os.path.join(processed_dir, f'{name}.npz')
+    if os.path.exists(npz_file):
+        with np.load(npz_file) as data:
+            return data[key]
+    return None
+
+def prepare_train_val_test_data(processed_dir, test_size=0.2, random_state=42, shard_size=8192):
+    train_images = load_processed_array(processed_dir, 'train_images', 'images')
+    train_labels = load_processed_array(processed_dir, 'train_labels', 'labels')
+    test_images = load_processed_array(processed_dir, 'test_images', 'images')
+    test_labels = load_processed_array(processed_dir, 'test_labels', 'labels')
+
+    if any(array is None for array in [train_images, train_labels, test_images, test_labels]):
         logging.error("Processed data files not found.")
         raise FileNotFoundError("Processed data files not found.")
-    
-    # Load the data
-    train_images = np.load(train_images_file)['images']
-    train_labels = np.load(train_labels_file)['labels']
-    test_images = np.load(test_images_file)['images']
-    test_labels = np.load(test_labels_file)['labels']
 
     logging.info(f"Loaded {train_images.shape[0]} train images and {train_labels.shape[0]} train labels")
     logging.info(f"Loaded {test_images.shape[0]} test images and {test_labels.shape[0]} test labels")
@@ -30,28 +36,25 @@ def prepare_train_val_test_data(processed_dir, test_size=0.2, random_state=42):
         logging.error("One of the datasets is empty.")
         raise ValueError("One of the datasets is empty.")
 
-    # Normalize the images
-    train_images = train_images.astype(np.float32) / 255.0
-    test_images = test_images.astype(np.float32) / 255.0
+    # Shards store the uint8 pixels rather than float pixel/255, a quarter of the size;
+    # SketchDataset turns them into the same model input the npz files gave
+    train_labels = np.asarray(train_labels)
 
-    # Split the train set into train and validation sets
+    # Split the train set into train and validation sets; only the labels are needed for this
     stratified_split = StratifiedShuffleSplit(n_splits=1, test_size=test_size, random_state=random_state)
+    train_index, val_index = next(stratified_split.split(np.zeros(len(train_labels)), train_labels))
 
-    for train_index, val_index in stratified_split.split(train_images, train_labels):
-        X_train, X_val = train_images[train_index], train_images[val_index]
-        y_train, y_val = train_labels[train_index], train_labels[val_index]
+    # Sorted so the shards are written with sequential reads of the source array
+    train_index, val_index = np.sort(train_index), np.sort(val_index)
 
     logging.info("Saving final datasets...")
-    np.savez_compressed(os.path.join(processed_dir, 'X_train.npz'), images=X_train)
-    np.savez_compressed(os.path.join(processed_dir, 'y_train.npz'), labels=y_train)
-    np.savez_compressed(os.path.join(processed_dir, 'X_val.npz'), images=X_val)
-    np.savez_compressed(os.path.join(processed_dir, 'y_val.npz'), labels=y_val)
-    np.savez_compressed(os.path.join(processed_dir, 'X_test.npz'), images=test_images)
-    np.savez_compressed(os.path.join(processed_dir, 'y_test.npz'), labels=test_labels)
+    write_shards(shard_dir(processed_dir, 'train'), train_images, train_labels, indices=train_index, shard_size=shard_size)
+    write_shards(shard_dir(processed_dir, 'val'), train_images, train_labels, indices=val_index, shard_size=shard_size)
+    write_shards(shard_dir(processed_dir, 'test'), test_images, test_labels, shard_size=shard_size)
 
     logging.info("Training, validation, and test data preparation completed.")
     return {
-        "train_size": len(X_train),
-        "val_size": len(X_val),
-        "test_size": len(test_images)
+        "train_size": len(train_index),
+        "val_size": len(val_index),
+        "test_size": len(test_labels)
     }
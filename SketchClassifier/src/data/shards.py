@@ -0,0 +1,174 @@
+import os
+import json
+import bisect
+import argparse
+import numpy as np
+
+# A split on disk is a directory of uncompressed .npy shards plus a small manifest:
+#
+#   <processed_dir>/shards/<split>/manifest.json
+#   <processed_dir>/shards/<split>/images_00000.npy   uint8 (n, H, W)
+#   <processed_dir>/shards/<split>/labels_00000.npy   int64 (n,)
+#
+# Shards are opened with mmap, so opening a split costs a JSON read and every DataLoader
+# worker reads the same pages from the page cache instead of holding its own copy.
+MANIFEST = 'manifest.json'
+FORMAT = 'sketch-shards-v1'
+SPLITS = ['train', 'val', 'test']
+
+def shard_dir(processed_dir, split):
+    return os.path.join(processed_dir, 'shards', split)
+
+def has_shards(processed_dir, split):
+    return os.path.exists(os.path.join(shard_dir(processed_dir, split), MANIFEST))
+
+def to_uint8(images):
+    # Older pipelines stored images normalized to float [0, 1]; shards always hold 0-255
+    if np.issubdtype(images.dtype, np.floating):
+        return np.clip(np.rint(images * 255.0), 0, 255).astype(np.uint8)
+    return images.astype(np.uint8, copy=False)
+
+def write_shards(out_dir, images, labels, indices=None, shard_size=8192, copy_chunk=1024):
+    # images/labels may be memory-mapped; rows (all, or `indices` in the given order) are
+    # copied copy_chunk at a time, so only one chunk is ever in memory
+    os.makedirs(out_dir, exist_ok=True)
+    indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+    shards = []
+    for shard_index, shard_start in enumerate(range(0, len(indices), shard_size)):
+        shard_rows = indices[shard_start:shard_start + shard_size]
+        images_name = f'images_{shard_index:05d}.npy'
+        labels_name = f'labels_{shard_index:05d}.npy'
+        shard_images = np.lib.format.open_memmap(
+            os.path.join(out_dir, images_name), mode='w+', dtype=np.uint8, shape=(len(shard_rows),) + images.shape[1:]
+        )
+        for start in range(0, len(shard_rows), copy_chunk):
+            shard_images[start:start + copy_chunk] = to_uint8(images[shard_rows[start:start + copy_chunk]])
+        shard_images.flush()
+        del shard_images
+        np.save(os.path.join(out_dir, labels_name), np.asarray(labels[shard_rows], dtype=np.int64))
+        shards.append({'images': images_name, 'labels': labels_name, 'count': int(len(shard_rows))})
+
+    manifest = {
+        'format': FORMAT,
+        'count': int(len(indices)),
+        'image_shape': list(images.shape[1:]),
+        'dtype': 'uint8',
+        'shards': shards,
+    }
+    # Written last, so a directory without a manifest is an incomplete write
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+class ShardedSplit:
+    # Read-only view of one split. Shards are mapped lazily on first access in each
+    # process and never pickled, so DataLoader workers open their own maps.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT:
+            raise ValueError(f"{path} is not a {FORMAT} directory.")
+        counts = [shard['count'] for shard in self.manifest['shards']]
+        self.offsets = np.cumsum([0] + counts).tolist()
+        self._images = None
+        self._labels = None
+
+    def __len__(self):
+        return self.manifest['count']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        state['_labels'] = None
+        return state
+
+    def _open(self):
+        shards = self.manifest['shards']
+        self._images = [np.load(os.path.join(self.path, shard['images']), mmap_mode='r') for shard in shards]
+        self._labels = [np.load(os.path.join(self.path, shard['labels']), mmap_mode='r') for shard in shards]
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            self._open()
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard = bisect.bisect_right(self.offsets, idx) - 1
+        row = idx - self.offsets[shard]
+        return self._images[shard][row], int(self._labels[shard][row])
+
+    def images(self):
+        # One memory-mapped array per shard
+        if self._images is None:
+            self._open()
+        return self._images
+
+    def labels(self):
+        # Labels are small, so they are returned as one in-memory array
+        if self._labels is None:
+            self._open()
+        return np.concatenate([np.asarray(labels) for labels in self._labels]) if self._labels else np.empty(0, dtype=np.int64)
+
+class ArraySplit:
+    # Same interface as ShardedSplit over in-memory arrays, e.g. X_/y_<split>.npz from
+    # older runs
+    def __init__(self, images, labels):
+        self._images = images
+        self._labels = np.asarray(labels, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __getitem__(self, idx):
+        return self._images[idx], int(self._labels[idx])
+
+    def images(self):
+        return [self._images]
+
+    def labels(self):
+        return self._labels
+
+def open_split(processed_dir, split):
+    return ShardedSplit(shard_dir(processed_dir, split))
+
+def load_npz_split(processed_dir, split):
+    # X_<split>.npz / y_<split>.npz decompressed into memory, or None if either is missing.
+    # Pixels are converted to 0-255 uint8 like the shards, so both layouts read the same.
+    images_file = os.path.join(processed_dir, f'X_{split}.npz')
+    labels_file = os.path.join(processed_dir, f'y_{split}.npz')
+    if not (os.path.exists(images_file) and os.path.exists(labels_file)):
+        return None
+    with np.load(images_file) as data:
+        images = to_uint8(data['images'])
+    with np.load(labels_file) as data:
+        labels = data['labels']
+    return ArraySplit(images, labels)
+
+def convert_npz(processed_dir, shard_size=8192, verbose=False):
+    # Converts X_<split>.npz / y_<split>.npz from older runs into shards. Each npz array has
+    # to be decompressed into memory once, one split at a time.
+    converted = {}
+    for split in SPLITS:
+        if has_shards(processed_dir, split):
+            if verbose:
+                print(f"Shards for {split} already exist. Skipping...")
+            continue
+        arrays = load_npz_split(processed_dir, split)
+        if arrays is None:
+            if verbose:
+                print(f"No npz files for {split}. Skipping...")
+            continue
+        manifest = write_shards(shard_dir(processed_dir, split), arrays.images()[0], arrays.labels(), shard_size=shard_size)
+        del arrays
+        converted[split] = manifest['count']
+        print(f"Converted {split}: {manifest['count']} images into {len(manifest['shards'])} shards")
+    return converted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert X_/y_<split>.npz files into memory-mapped .npy shards")
+    parser.add_argument("processed_dir", nargs="?", default="data/processed")
+    parser.add_argument("--shard-size", type=int, default=8192, help="images per shard")
+    args = parser.parse_args()
+    convert_npz(args.processed_dir, shard_size=args.shard_size, verbose=True)
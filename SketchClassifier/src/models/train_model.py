@@ -10,20 +10,34 @@ from torch.utils.data import DataLoader, Dataset
 from torchvision import transforms
 from PIL import Image
 from src.models import load_model
+from src.data.shards import ShardedSplit, has_shards, shard_dir
 
 # Custom Dataset Class
 class SketchDataset(Dataset):
-    def __init__(self, data_path, label_path, transform=None):
-        self.data = np.load(data_path)['images']
-        self.labels = np.load(label_path)['labels']
+    # data_path is a shard directory (label_path=None), read through mmap so DataLoader
+    # workers share the page cache; or an images .npz with its labels .npz, which is
+    # decompressed into memory
+    def __init__(self, data_path, label_path=None, transform=None):
+        if label_path is None:
+            self.shards = ShardedSplit(data_path)
+        else:
+            self.shards = None
+            self.data = np.load(data_path)['images']
+            self.labels = np.load(label_path)['labels']
         self.transform = transform
 
     def __len__(self):
-        return len(self.labels)
+        return len(self.shards) if self.shards is not None else len(self.labels)
 
     def __getitem__(self, idx):
-        image = self.data[idx]
-        label = int(self.labels[idx])
+        if self.shards is not None:
+            image, label = self.shards[idx]
+            # Shards hold 0-255 pixels; the npz files held pixel/255, which the cast below
+            # floors to 0 or 1. Keep feeding the model exactly that.
+            image = image // 255
+        else:
+            image = self.data[idx]
+            label = int(self.labels[idx])
         image = Image.fromarray(image.astype('uint8'), mode='L')
         if self.transform:
             image = self.transform(image)
@@ -31,6 +45,16 @@ class SketchDataset(Dataset):
             image = transforms.ToTensor()(image)
         return image, label
 
+def open_dataset(processed_dir, split, transform=None):
+    # Shards from prepare_train_val_test_data; X_/y_ npz files from older runs still work
+    if has_shards(processed_dir, split):
+        return SketchDataset(shard_dir(processed_dir, split), transform=transform)
+    return SketchDataset(
+        os.path.join(processed_dir, f'X_{split}.npz'),
+        os.path.join(processed_dir, f'y_{split}.npz'),
+        transform=transform
+    )
+
 def train_model(config):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -51,15 +75,13 @@ def train_model(config):
     ])
 
     # Create datasets
-    train_dataset = SketchDataset(
-        os.path.join(config["data"]["processed_dir"], 'X_train.npz'),
-        os.path.join(config["data"]["processed_dir"], 'y_train.npz'),
+    train_dataset = open_dataset(
+        config["data"]["processed_dir"], 'train',
         #transform=train_transforms
     )
 
-    val_dataset = SketchDataset(
-        os.path.join(config["data"]["processed_dir"], 'X_val.npz'),
-        os.path.join(config["data"]["processed_dir"], 'y_val.npz'),
+    val_dataset = open_dataset(
+        config["data"]["processed_dir"], 'val',
         #transform=val_transforms
     )
 
@@ -0,0 +1,86 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from src.data.preprocess import load_data
+from src.data.shards import SPLITS, ArraySplit, ShardedSplit, convert_npz, has_shards, shard_dir, to_uint8, write_shards
+
+
+@pytest.fixture
+def split(tmp_path):
+    images = np.arange(10 * 4 * 4, dtype=np.uint8).reshape(10, 4, 4)
+    labels = np.arange(100, 110)
+    manifest = write_shards(str(tmp_path / 'train'), images, labels, shard_size=4, copy_chunk=3)
+    return ShardedSplit(str(tmp_path / 'train')), images, labels, manifest
+
+
+def test_write_shards_splits_rows_across_files(split):
+    _, _, _, manifest = split
+    assert manifest['count'] == 10
+    assert [shard['count'] for shard in manifest['shards']] == [4, 4, 2]
+
+
+def test_indexing_crosses_shard_boundaries(split):
+    sharded, images, labels, _ = split
+    assert len(sharded) == 10
+    for idx in range(10):
+        image, label = sharded[idx]
+        assert np.array_equal(image, images[idx])
+        assert label == labels[idx]
+    image, label = sharded[-1]
+    assert np.array_equal(image, images[9]) and label == 109
+    with pytest.raises(IndexError):
+        sharded[10]
+
+
+def test_images_and_labels(split):
+    sharded, images, labels, _ = split
+    assert np.array_equal(np.concatenate(sharded.images()), images)
+    assert np.array_equal(sharded.labels(), labels)
+
+
+def test_pickled_split_reopens_its_maps(split):
+    sharded, images, _, _ = split
+    sharded[0]
+    copy = pickle.loads(pickle.dumps(sharded))
+    assert copy._images is None
+    assert np.array_equal(copy[5][0], images[5])
+
+
+def test_write_shards_follows_indices(tmp_path):
+    images = np.arange(5 * 2 * 2, dtype=np.uint8).reshape(5, 2, 2)
+    labels = np.arange(5)
+    write_shards(str(tmp_path / 'val'), images, labels, indices=[4, 0, 2])
+    sharded = ShardedSplit(str(tmp_path / 'val'))
+    assert [sharded[i][1] for i in range(3)] == [4, 0, 2]
+
+
+def test_to_uint8_scales_normalized_floats():
+    assert to_uint8(np.array([0.0, 0.5, 1.0], dtype=np.float32)).tolist() == [0, 128, 255]
+
+
+def test_load_data_returns_the_same_splits_for_npz_and_shards(tmp_path):
+    rng = np.random.default_rng(0)
+    for split in SPLITS:
+        np.savez_compressed(tmp_path / f'X_{split}.npz', images=rng.random((3, 4, 4)).astype(np.float32))
+        np.savez_compressed(tmp_path / f'y_{split}.npz', labels=np.arange(3))
+
+    from_npz = load_data(str(tmp_path))
+    assert set(from_npz) == set(SPLITS)
+    assert all(isinstance(from_npz[split], ArraySplit) for split in SPLITS)
+
+    convert_npz(str(tmp_path))
+    assert all(has_shards(str(tmp_path), split) for split in SPLITS)
+    from_shards = load_data(str(tmp_path))
+    assert all(isinstance(from_shards[split], ShardedSplit) for split in SPLITS)
+
+    for split in SPLITS:
+        assert np.array_equal(from_npz[split].labels(), from_shards[split].labels())
+        for idx in range(3):
+            assert np.array_equal(from_npz[split][idx][0], from_shards[split][idx][0])
+
+
+def test_load_data_without_a_split_returns_none(tmp_path):
+    write_shards(shard_dir(str(tmp_path), 'train'), np.zeros((1, 2, 2), np.uint8), np.zeros(1))
+    assert load_data(str(tmp_path)) is None
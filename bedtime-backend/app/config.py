@@ -4,3 +4,99 @@ from typing import ClassVar
 class Config(BaseSettings):
     MODEL_PATH: str = "app/artifacts/model.pth"
     NUM_CLASSES: int = 250
+    # How decoded pixels become model input; see app.utils.INPUT_TRANSFORMS. Must match
+    # the transform MODEL_PATH was trained with.
+    INPUT_TRANSFORM: str = "binary"
+
+    # Forward passes run on a zero batch at startup before /readyz reports ready
+    WARMUP_ITERATIONS: int = 2
+    WARMUP_BATCH_SIZE: int = 1
+
+    # Multi-process serving (python -m app.serve); 0 picks a default from the core count.
+    # TORCH_THREADS_PER_WORKER also applies to a plain uvicorn process when set.
+    SERVE_WORKERS: int = 0
+    TORCH_THREADS_PER_WORKER: int = 0
+    SERVE_HOST: str = "0.0.0.0"
+    SERVE_PORT: int = 8080
+
+    # Asynchronous story jobs (/jobs): worker tasks, queue bound and how long results are kept
+    JOB_WORKERS: int = 4
+    JOB_QUEUE_SIZE: int = 256
+    JOB_RESULT_TTL_S: float = 600.0
+    JOB_MAX_STORED: int = 1024
+
+    # Micro-batching in front of the classifier
+    BATCH_MAX_SIZE: int = 8
+    BATCH_MAX_WAIT_MS: float = 5.0
+    BATCH_QUEUE_SIZE: int = 256
+
+    # /infer/sketchclassify/batch limits
+    BATCH_ENDPOINT_MAX_IMAGES: int = 64
+    BATCH_ENDPOINT_DEFAULT_TOP_K: int = 5
+
+    # Threads for CPU-bound request work (image decoding, preprocessing)
+    CPU_WORKERS: int = 4
+
+    # Single-flight: how long a request waits on an identical in-flight computation
+    CLASSIFY_FLIGHT_TIMEOUT_S: float = 30.0
+    STORY_FLIGHT_TIMEOUT_S: float = 300.0
+
+    # Classifier inference engine, one of app.models.engines.ENGINES
+    INFERENCE_ENGINE: str = "eager"
+    ONNX_PATH: str = "app/artifacts/model.onnx"
+    # Sketches for int8_static calibration: a SketchClassifier shard directory (e.g.
+    # data/processed/shards/val) or an npz with an "images" array
+    QUANT_CALIBRATION_PATH: str = ""
+
+    # Classification result cache, keyed by a hash of the uploaded image bytes
+    CLASSIFY_CACHE_MAX_ITEMS: int = 4096
+    CLASSIFY_CACHE_MAX_BYTES: int = 4 * 1024 * 1024
+    CLASSIFY_CACHE_TTL_S: float = 0.0  # 0 disables expiry
+    CLASSIFY_CACHE_DIR: str = ""  # set to share results between workers on disk
+    CLASSIFY_CACHE_DISK_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Story text cache: STORY_VARIANTS stories per (label, prompt version), rotated per request
+    STORY_PROMPT_VERSION: str = "v1"
+    STORY_VARIANTS: int = 3
+    STORY_CACHE_MAX_ITEMS: int = 2048
+    STORY_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    STORY_CACHE_TTL_S: float = 0.0
+    STORY_CACHE_DIR: str = ""
+    STORY_CACHE_DISK_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Pipelined stories: stream the completion and narrate each sentence while the LLM
+    # keeps writing (WAV output only). Sentences shorter than the minimum are merged.
+    STORY_PIPELINE: bool = False
+    STORY_PIPELINE_MIN_CHARS: int = 40
+
+    # Pregenerated narrations built by python -m app.pregenerate; empty disables
+    NARRATION_ARCHIVE_PATH: str = ""
+
+    # Narrated audio cache, keyed by (story text hash, voice id)
+    AUDIO_CACHE_MAX_ITEMS: int = 512
+    AUDIO_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    AUDIO_CACHE_TTL_S: float = 0.0
+    AUDIO_CACHE_DIR: str = ""
+    AUDIO_CACHE_DISK_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # Outbound calls: shared keep-alive pools, per-call timeouts, retries with jittered
+    # backoff, a concurrency cap per upstream and a circuit breaker
+    UPSTREAM_CONNECT_TIMEOUT_S: float = 5.0
+    LLM_TIMEOUT_S: float = 30.0
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_RETRIES: int = 2
+    TTS_TIMEOUT_S: float = 180.0
+    TTS_MAX_CONCURRENCY: int = 8
+    TTS_RETRIES: int = 1
+    RETRY_BACKOFF_S: float = 0.2
+    RETRY_BACKOFF_MAX_S: float = 2.0
+    BREAKER_FAILURES: int = 5
+    BREAKER_RESET_S: float = 30.0
+
+    # Raw audio bodies on the voice cloner hop; false uses the legacy base64-in-JSON form
+    TTS_BINARY: bool = True
+
+    # Default narration format when the client doesn't ask for one (wav, flac or opus);
+    # AUDIO_SAMPLE_RATE=0 keeps the model's native rate
+    AUDIO_FORMAT: str = "wav"
+    AUDIO_SAMPLE_RATE: int = 0
@@ -1,12 +1,83 @@
 # app/main.py
-from fastapi import FastAPI
-from app.routers import infer
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from app.routers import infer, jobs
+from app.services import sketchclassify
+from app.services.upstream import close_clients
+from app.services.metrics import REQUEST_SECONDS, new_request_id, render, request_id_var, stage_timings_var
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load in the background so /healthz answers (and the process counts as alive) while
+    # weights load and warm up; /readyz flips once the classifier can serve
+    app.state.model_loading = asyncio.create_task(asyncio.to_thread(sketchclassify.startup))
+    jobs.job_queue.start()
+    yield
+    await jobs.job_queue.stop()
+    sketchclassify.shutdown()
+    await close_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include routers
 app.include_router(infer.router)
+app.include_router(jobs.router)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Tags the request with an id (the caller's X-Request-ID, or a new one) that is forwarded
+    # to the voice cloner, and logs every stage timing of the request on one line.
+    # For streamed responses the time covers the work up to the first byte.
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    request_id_var.set(request_id)
+    timings = {}
+    stage_timings_var.set(timings)
+
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.labels(endpoint, str(status)).observe(elapsed)
+        if endpoint.startswith(("/infer", "/jobs")):
+            print(json.dumps({
+                "request_id": request_id,
+                "endpoint": endpoint,
+                "status": status,
+                "total_ms": round(elapsed * 1000.0, 2),
+                "stages_ms": {stage: round(ms, 2) for stage, ms in timings.items()},
+            }))
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the FastAPI Project!"}
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and the event loop is responsive
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: the model is loaded, warmed up and the batch scheduler is running
+    loading = app.state.model_loading
+    if loading.done() and loading.exception() is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": str(loading.exception())})
+    if not sketchclassify.is_ready():
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready", "startup_ms": sketchclassify.startup_timings}
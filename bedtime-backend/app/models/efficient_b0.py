@@ -1,11 +1,11 @@
+import time
 import torch
 import torch.nn as nn
-from torchvision.models import efficientnet_b0, EfficientNet_B0_Weights
+from torchvision.models import efficientnet_b0
 
-def load_model(num_classes, model_path="app/artifacts/model.pth"):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    model = efficientnet_b0(weights=EfficientNet_B0_Weights.IMAGENET1K_V1)
+def build_model(num_classes):
+    # Architecture only; no pretrained weights are downloaded since model.pth replaces them all
+    model = efficientnet_b0(weights=None)
     model.features[0][0] = nn.Conv2d(
         in_channels=1, 
         out_channels=model.features[0][0].out_channels,
@@ -15,9 +15,30 @@ def load_model(num_classes, model_path="app/artifacts/model.pth"):
         bias=False
     )
     model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
-    
-    # Load model weights
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.to(device)  
-    model.eval()     
+    return model
+
+def load_model(num_classes, model_path="app/artifacts/model.pth", device=None, timings=None):
+    # timings, if given, collects the wall time of each phase in ms
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    timings = {} if timings is None else timings
+
+    start = time.perf_counter()
+    model = build_model(num_classes)
+    timings["build_model_ms"] = (time.perf_counter() - start) * 1000.0
+
+    # Memory-mapped load: tensors are paged in from the file instead of read into a copy,
+    # and assign=True adopts them as the parameters without a second copy
+    start = time.perf_counter()
+    try:
+        state_dict = torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError:
+        # Checkpoints in the legacy (pre zipfile) format can't be memory-mapped
+        state_dict = torch.load(model_path, map_location="cpu", weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    timings["load_weights_ms"] = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    model.to(device)
+    model.eval()
+    timings["to_device_ms"] = (time.perf_counter() - start) * 1000.0
     return model
@@ -0,0 +1,156 @@
+import json
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+
+from app.utils import input_pixels
+
+ENGINES = ["eager", "torchscript", "compile", "int8_dynamic", "int8_static", "channels_last", "onnx"]
+
+
+class ChannelsLastModel(nn.Module):
+    # Keeps weights and activations in NHWC, which oneDNN convolutions prefer on CPU
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+class OnnxModel:
+    # Callable wrapper so an ONNX Runtime session can stand in for the torch model
+    def __init__(self, onnx_path, num_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        outputs = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def load_array(path, key, limit=None):
+    # `key` ("images" or "labels") from a SketchClassifier shard directory (or its
+    # manifest.json), reading only the shards needed for `limit` rows; or from an npz
+    if os.path.isdir(path):
+        path = os.path.join(path, "manifest.json")
+    if not path.endswith(".json"):
+        return np.load(path)[key][:limit]
+
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    parts = []
+    remaining = manifest["count"] if limit is None else limit
+    for shard in manifest["shards"]:
+        if remaining <= 0:
+            break
+        part = np.load(os.path.join(os.path.dirname(path), shard[key]), mmap_mode="r")[:remaining]
+        parts.append(part)
+        remaining -= len(part)
+    return np.concatenate(parts)
+
+
+def load_images(path, limit=None, transform="binary"):
+    # Held-out images from SketchClassifier's preprocessing: (N, 224, 224), uint8 or float in
+    # [0, 1]. Returned as the model input serving builds (see app.utils.INPUT_TRANSFORMS).
+    images = load_array(path, "images", limit)
+    if np.issubdtype(images.dtype, np.floating):
+        images = np.clip(np.rint(images * 255.0), 0, 255).astype(np.uint8)
+    images = torch.from_numpy(np.ascontiguousarray(input_pixels(images, transform))).float()
+    images /= 255.0
+    return images.unsqueeze(1)
+
+
+def load_calibration_batches(path, batch_size=32, num_batches=8, transform="binary"):
+    images = load_images(path, limit=batch_size * num_batches, transform=transform)
+    return list(torch.split(images, batch_size))
+
+
+def read_text(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def export_onnx(model, onnx_path, example_input):
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    torch.onnx.export(
+        model,
+        example_input,
+        onnx_path,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+    return onnx_path
+
+
+def quantize_static(model, calibration_batches):
+    # FX graph mode post-training quantization with x86 (fbgemm/onednn) kernels
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = "x86"
+    qconfig_mapping = get_default_qconfig_mapping("x86")
+    prepared = prepare_fx(model, qconfig_mapping, example_inputs=(calibration_batches[0],))
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def build_engine(name, model, example_input=None, calibration_batches=None, onnx_path="app/artifacts/model.onnx", num_threads=0, checkpoint_id=None):
+    # model must be the eager fp32 classifier in eval mode on CPU. checkpoint_id identifies
+    # its weights (e.g. the checkpoint's sha256) so a stale ONNX export is never reused.
+    if example_input is None:
+        example_input = torch.zeros(1, 1, 224, 224)
+
+    if name == "eager":
+        return model
+
+    if name == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_input)
+            return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    if name == "compile":
+        return torch.compile(model)
+
+    if name == "int8_dynamic":
+        # Only nn.Linear has dynamic int8 kernels, so this quantizes the classifier head
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    if name == "int8_static":
+        if not calibration_batches:
+            raise ValueError("int8_static needs calibration_batches drawn from real sketches.")
+        return quantize_static(model, calibration_batches)
+
+    if name == "channels_last":
+        return ChannelsLastModel(model).eval()
+
+    if name == "onnx":
+        # Reused only if exported from the same checkpoint, recorded next to the file
+        source_path = onnx_path + ".source"
+        if checkpoint_id is None or not os.path.exists(onnx_path) or read_text(source_path) != checkpoint_id:
+            export_onnx(model, onnx_path, example_input)
+            if checkpoint_id is not None:
+                with open(source_path, "w") as f:
+                    f.write(checkpoint_id)
+        return OnnxModel(onnx_path, num_threads=num_threads)
+
+    raise ValueError(f"Unknown inference engine '{name}'. Choose one of: {', '.join(ENGINES)}")
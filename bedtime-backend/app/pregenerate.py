@@ -0,0 +1,115 @@
+# Pregenerates narrations for every label the classifier can produce and packs them into
+# one memory-mapped archive the backend serves from (NARRATION_ARCHIVE_PATH).
+#
+#   python -m app.pregenerate --output app/artifacts/narrations.bta --variants 3 --concurrency 4
+#
+# Uses the same LLM prompt, voice (AUDIO_FILE_PATH) and voice cloner (TTS_API_URL) as the
+# live path. Re-running with the same output keeps the entries already in the archive and
+# only generates the missing ones, so a run interrupted by upstream errors can be resumed.
+# Regenerate after changing the reference voice or STORY_PROMPT_VERSION: the backend
+# ignores archives built for a different voice, prompt version or audio format.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from app.services.archive import ArchiveWriter, NarrationArchive, entry_key, file_sha256
+from app.services.audio import negotiate_format
+from app.services.sketchclassify import LABELS
+from app.services.storybuilding import AUDIO_FILE_PATH, config, get_voice_id, narrate_story, write_story
+from app.services.upstream import close_clients
+
+
+def load_previous(path, metadata):
+    if not os.path.exists(path):
+        return None
+    try:
+        previous = NarrationArchive(path)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring existing archive {path}: {e}")
+        return None
+    keys = ("voice_sha256", "prompt_version", "format", "sample_rate")
+    if any(previous.metadata.get(k) != metadata[k] for k in keys):
+        print(f"Existing archive {path} was built with different settings; regenerating everything.")
+        return None
+    return previous
+
+
+async def run(args):
+    audio_format = negotiate_format(args.format, args.sample_rate)
+    labels = args.labels.split(",") if args.labels else LABELS
+    metadata = {
+        "voice_sha256": file_sha256(AUDIO_FILE_PATH),
+        "prompt_version": config.STORY_PROMPT_VERSION,
+        "format": audio_format[0],
+        "sample_rate": audio_format[1],
+        "variants": args.variants,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    previous = load_previous(args.output, metadata)
+    if previous is not None:
+        # A run for fewer variants (or a --labels subset) mustn't hide the ones already built
+        metadata["variants"] = max(args.variants, previous.variants)
+    writer = ArchiveWriter(args.output, metadata)
+
+    # Every previous entry is carried over, including labels and variants outside this run
+    if previous is not None:
+        for key, story, audio in previous.entries():
+            writer.add_entry(key, story, bytes(audio))
+    todo = [
+        (label, variant)
+        for label in labels
+        for variant in range(args.variants)
+        if previous is None or entry_key(label, variant) not in previous
+    ]
+    print(f"{len(writer.entries)} entries kept, {len(todo)} to generate.")
+
+    voice_id = await get_voice_id(AUDIO_FILE_PATH)
+    slots = asyncio.Semaphore(args.concurrency)
+    done = 0
+    failed = []
+    start = time.perf_counter()
+
+    async def generate(label, variant):
+        nonlocal done
+        async with slots:
+            try:
+                story = await write_story(label)
+                audio = await narrate_story(story, voice_id, audio_format)
+            except Exception as e:
+                print(f"Failed {label!r} variant {variant}: {e}")
+                failed.append((label, variant))
+                return
+        # Runs on the event loop thread, so writes to the archive never interleave
+        writer.add(label, variant, story, audio)
+        done += 1
+        if done % 25 == 0:
+            rate = done / (time.perf_counter() - start)
+            print(f"{done}/{len(todo)} narrations ({rate:.2f}/s)")
+
+    try:
+        await asyncio.gather(*(generate(label, variant) for label, variant in todo))
+    finally:
+        writer.close()
+        await close_clients()
+
+    print(f"Wrote {len(writer.entries)} entries to {args.output} in {time.perf_counter() - start:.0f}s; "
+          f"{len(failed)} failed (re-run to fill them in).")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pregenerate narrated stories for every classifier label")
+    parser.add_argument("--output", default=config.NARRATION_ARCHIVE_PATH or "app/artifacts/narrations.bta")
+    parser.add_argument("--variants", type=int, default=config.STORY_VARIANTS, help="stories per label")
+    parser.add_argument("--concurrency", type=int, default=4, help="stories generated and narrated at once")
+    parser.add_argument("--format", default=config.AUDIO_FORMAT)
+    parser.add_argument("--sample-rate", type=int, default=config.AUDIO_SAMPLE_RATE)
+    parser.add_argument("--labels", help="comma-separated subset of labels (default: all)")
+    args = parser.parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from app.services.sketchclassify import sketch_classify
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request
+from app.services import sketchclassify
+from app.services.sketchclassify import sketch_classify_async, sketch_classify_batch_async, classify_cache
 from pydantic import BaseModel
-from app.services.storybuilding import generate_story
-from fastapi.responses import FileResponse
+from app.services.storybuilding import generate_story, story_stats, stream_story, config
+from app.services.audio import AUDIO_FORMATS, negotiate_format
+from app.services.metrics import timed
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import base64
 import random  # Import random module
 import os
@@ -12,34 +16,193 @@ router = APIRouter()
 class ImageData(BaseModel):
     image_base64: str
 
-@router.post("/infer/sketchclassify")
-async def infer(image_data: ImageData):
-    try:
-        # Decode the base64 image data
-        image_bytes = base64.b64decode(image_data.image_base64)
-        print("Debug: File size (bytes):", len(image_bytes))  # Check size
+class BatchImageData(BaseModel):
+    images_base64: list[str]
+    top_k: int | None = None
 
-        if not image_bytes:
+async def read_image(request: Request) -> bytes:
+    # Accepts a multipart "file", a raw image/* (or octet-stream) body, or the legacy
+    # {"image_base64": ...} JSON body
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
             raise HTTPException(
                 status_code=400,
-                detail="No image provided or image is empty."
+                detail="Multipart uploads must include the image as 'file'."
+            )
+        image_bytes = await upload.read()
+    elif content_type.startswith("image/") or content_type.startswith("application/octet-stream"):
+        image_bytes = await request.body()
+    else:
+        try:
+            image_data = ImageData.model_validate_json(await request.body())
+        except ValueError:
+            raise HTTPException(
+                status_code=422,
+                detail="Expected a multipart file, a raw image body or JSON with 'image_base64'."
+            )
+        try:
+            # Decode the base64 image data
+            image_bytes = base64.b64decode(image_data.image_base64)
+        except base64.binascii.Error:
+            raise HTTPException(
+                status_code=422,
+                detail="Invalid base64-encoded data."
             )
-        predictions=  sketch_classify(image_bytes)
-        
-        base64_audio = generate_story(predictions)
-        return {"success": True, "audio": base64_audio}
- 
-    except base64.binascii.Error:
+
+    if not image_bytes:
         raise HTTPException(
-            status_code=422,
-            detail="Invalid base64-encoded data."
+            status_code=400,
+            detail="No image provided or image is empty."
         )
+    return image_bytes
+
+async def read_images(request: Request):
+    # Multipart with one or more "file" parts, or JSON {"images_base64": [...], "top_k": k}
+    top_k = request.query_params.get("top_k")
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = [upload for upload in form.getlist("file") if not isinstance(upload, str)]
+        images = [await upload.read() for upload in uploads]
+        if top_k is None:
+            top_k = form.get("top_k")
+    else:
+        try:
+            batch_data = BatchImageData.model_validate_json(await request.body())
+        except ValueError:
+            raise HTTPException(
+                status_code=422,
+                detail="Expected multipart 'file' parts or JSON with 'images_base64'."
+            )
+        try:
+            images = [base64.b64decode(image) for image in batch_data.images_base64]
+        except base64.binascii.Error:
+            raise HTTPException(
+                status_code=422,
+                detail="Invalid base64-encoded data."
+            )
+        if top_k is None:
+            top_k = batch_data.top_k
+
+    if not images or not all(images):
+        raise HTTPException(
+            status_code=400,
+            detail="No images provided or an image is empty."
+        )
+    if len(images) > config.BATCH_ENDPOINT_MAX_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {config.BATCH_ENDPOINT_MAX_IMAGES} images per request."
+        )
+    # Only a missing top_k takes the default; 0 from any source is rejected below
+    if top_k is None:
+        top_k = config.BATCH_ENDPOINT_DEFAULT_TOP_K
+    try:
+        top_k = int(top_k)
+    except (TypeError, ValueError):
+        top_k = 0
+    if not 1 <= top_k <= config.NUM_CLASSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"top_k must be between 1 and {config.NUM_CLASSES}."
+        )
+    return images, top_k
+
+def wants_audio_body(request: Request) -> bool:
+    # Raw audio only when the client asks for it; JSON + base64 stays the default
+    accept = request.headers.get("accept", "")
+    return any(part.strip().startswith("audio/") for part in accept.split(","))
+
+def requested_format(request: Request):
+    # ?format=wav|flac|opus&sample_rate=16000, else the Accept header, else the configured default
+    try:
+        return negotiate_format(
+            request.query_params.get("format"),
+            request.query_params.get("sample_rate"),
+            request.headers.get("accept", ""),
+            default=config.AUDIO_FORMAT,
+            default_rate=config.AUDIO_SAMPLE_RATE,
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+def audio_response(request: Request, audio: bytes, audio_format):
+    if wants_audio_body(request):
+        if not audio:
+            raise HTTPException(
+                status_code=502,
+                detail="Narration failed."
+            )
+        return Response(content=audio, media_type=AUDIO_FORMATS[audio_format[0]])
+    return {"success": True, "audio": base64.b64encode(audio).decode("ascii"), "format": audio_format[0]}
+
+@router.post("/infer/sketchclassify")
+async def infer(request: Request):
+    audio_format = requested_format(request)
+    with timed("decode"):
+        image_bytes = await read_image(request)
+    predictions = await sketch_classify_async(image_bytes)
+    audio = await generate_story(predictions, audio_format)
+    return audio_response(request, audio, audio_format)
+
+@router.post("/infer/sketchclassify/batch")
+async def infer_batch(request: Request):
+    # Classification only: top-k labels for every image on the page, no story
+    with timed("decode"):
+        images, top_k = await read_images(request)
+    return await sketch_classify_batch_async(images, top_k)
+
+@router.post("/infer/sketchclassify/stream")
+async def infer_stream(request: Request):
+    with timed("decode"):
+        image_bytes = await read_image(request)
+    predictions = await sketch_classify_async(image_bytes)
+    return await _stream_response(predictions)
+
+@router.post("/infer/update/stream")
+async def infer_update_stream(data: dict):
+    return await _stream_response(data)
+
+async def _stream_response(predictions: dict):
+    # Relays the voice cloner's sentence-by-sentence WAV stream so playback starts early
+    try:
+        audio_stream, close = await stream_story(predictions)
+    except Exception as e:
+        print(f"Error while starting narration stream: {e}")
+        raise HTTPException(
+            status_code=502,
+            detail=f"Narration failed: {str(e)}"
+        )
+    # The background task frees the upstream even when the body is never iterated
+    return StreamingResponse(audio_stream, media_type="audio/wav", background=BackgroundTask(close))
+
+@router.get("/infer/sketchclassify/stats")
+async def infer_stats():
+    scheduler = sketchclassify.scheduler
+    return {
+        "scheduler": scheduler.stats() if scheduler else None,
+        "cache": classify_cache.stats(),
+        "single_flight": sketchclassify.classify_flight.stats(),
+    }
+
+@router.get("/infer/story/stats")
+async def infer_story_stats():
+    return story_stats()
 
 @router.post("/infer/update")
-async def infer_update(data: dict):
+async def infer_update(request: Request, data: dict):
+    audio_format = requested_format(request)
     try:
         # Pass the data dictionary directly to the generate_story function
-        base64_audio = generate_story(data)
-        return {"success": True, "audio": base64_audio}
+        audio = await generate_story(data, audio_format)
+        return audio_response(request, audio, audio_format)
+    except HTTPException:
+        raise
     except Exception as e:
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+        return {"success": False, "error": str(e)}
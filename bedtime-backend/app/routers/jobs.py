@@ -0,0 +1,163 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import base64
+import json
+
+from app.config import Config
+from app.routers.infer import read_image, requested_format
+from app.services.audio import AUDIO_FORMATS
+from app.services.jobs import PRIORITIES, TERMINAL, JobQueue, JobQueueFull
+from app.services.sketchclassify import sketch_classify_async
+from app.services.storybuilding import generate_story
+
+router = APIRouter()
+
+config = Config()
+
+# Seconds between SSE keep-alive comments while a job is queued or running
+KEEPALIVE_S = 15.0
+
+
+async def run_job(job):
+    if job.kind == "sketch":
+        predictions = await sketch_classify_async(job.payload)
+        job.payload = None  # the upload isn't needed once classified
+    else:
+        predictions = job.payload
+    audio = await generate_story(predictions, job.audio_format)
+    if not audio:
+        raise Exception("Narration failed.")
+    return {"label": predictions.get("prediction"), "confidence": predictions.get("confidence")}, audio
+
+
+job_queue = JobQueue(
+    run_job,
+    workers=config.JOB_WORKERS,
+    max_queue_size=config.JOB_QUEUE_SIZE,
+    ttl=config.JOB_RESULT_TTL_S,
+    max_stored=config.JOB_MAX_STORED,
+)
+
+
+def _priority(request: Request):
+    priority = request.query_params.get("priority", "normal")
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"priority must be one of: {', '.join(PRIORITIES)}"
+        )
+    return priority
+
+
+def _submit(request: Request, kind, payload, priority, audio_format):
+    try:
+        job = job_queue.submit(kind, payload, priority, audio_format)
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "5"}
+        )
+    status_url = request.url_for("job_status", job_id=job.id).path
+    return JSONResponse(
+        status_code=202,
+        content={
+            **job.snapshot(),
+            "status_url": status_url,
+            "events_url": f"{status_url}/events",
+            "audio_url": f"{status_url}/audio",
+        },
+        headers={"Location": status_url},
+    )
+
+
+def _get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Unknown or expired job_id."
+        )
+    return job
+
+
+def _with_audio(job, snapshot, include_audio):
+    if include_audio and job.status == "done":
+        snapshot["audio"] = base64.b64encode(job.audio).decode("ascii")
+    return snapshot
+
+
+@router.post("/jobs/sketch")
+async def submit_sketch(request: Request):
+    # Same image inputs as /infer/sketchclassify; returns 202 with the job id right away
+    audio_format = requested_format(request)
+    priority = _priority(request)
+    image_bytes = await read_image(request)
+    return _submit(request, "sketch", image_bytes, priority, audio_format)
+
+
+@router.post("/jobs/story")
+async def submit_story(request: Request, data: dict):
+    # Same body as /infer/update, e.g. {"prediction": "cat"}
+    audio_format = requested_format(request)
+    priority = _priority(request)
+    if not data.get("prediction"):
+        raise HTTPException(
+            status_code=400,
+            detail="Missing 'prediction'."
+        )
+    return _submit(request, "story", data, priority, audio_format)
+
+
+@router.get("/jobs/stats")
+async def jobs_stats():
+    return job_queue.stats()
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str, include_audio: bool = False):
+    job = _get_job(job_id)
+    return _with_audio(job, job.snapshot(), include_audio)
+
+
+@router.get("/jobs/{job_id}/audio")
+async def job_audio(job_id: str):
+    job = _get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(
+            status_code=502,
+            detail=job.error
+        )
+    if job.status != "done":
+        return JSONResponse(status_code=409, content=job.snapshot())
+    return Response(content=job.audio, media_type=AUDIO_FORMATS[job.audio_format[0]])
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, include_audio: bool = False):
+    # Server-sent events: one "status" event per change, ending after done/failed
+    job = _get_job(job_id)
+    updates = job.subscribe()
+
+    async def events():
+        try:
+            snapshot = job.snapshot()
+            while True:
+                yield f"event: status\ndata: {json.dumps(_with_audio(job, snapshot, include_audio))}\n\n"
+                if snapshot["status"] in TERMINAL:
+                    return
+                while True:
+                    try:
+                        snapshot = await asyncio.wait_for(updates.get(), timeout=KEEPALIVE_S)
+                        break
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+        finally:
+            job.unsubscribe(updates)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
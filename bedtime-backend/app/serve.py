@@ -0,0 +1,126 @@
+# Multi-process serving with one copy of the classifier weights.
+#
+#   SERVE_WORKERS=4 TORCH_THREADS_PER_WORKER=2 python -m app.serve
+#
+# The parent loads the eager model once into shared memory, binds the listening socket
+# and then forks the workers. Each worker inherits the weights (the pages are shared, not
+# copied), pins its own torch thread counts, warms up and serves the app with uvicorn on
+# the shared socket. A worker that dies is forked again from the parent, so a restart
+# doesn't reload weights from disk.
+#
+# Sizing: keep SERVE_WORKERS x TORCH_THREADS_PER_WORKER <= physical cores (leave a core or
+# two for image decoding, CPU_WORKERS threads per worker). Fewer, wider workers give lower
+# latency per request; more, narrower workers give more throughput under concurrency.
+# Defaults: SERVE_WORKERS=0 uses one worker per 2 cores, TORCH_THREADS_PER_WORKER=0
+# splits the cores evenly. Interop threads are pinned to 1 per worker.
+#
+# Only the eager and int8_dynamic engines share memory well: engines that rewrite the
+# weights (channels_last, int8_static, torchscript, compile, onnx) make per-worker copies.
+# On CUDA the parent doesn't preload (CUDA contexts don't survive fork) and each worker
+# loads its own model.
+import os
+import signal
+import socket
+import sys
+import time
+
+import torch
+import uvicorn
+
+from app.config import Config
+
+config = Config()
+
+
+def plan(cores):
+    workers = config.SERVE_WORKERS or max(1, cores // 2)
+    threads = config.TORCH_THREADS_PER_WORKER or max(1, cores // workers)
+    if workers * threads > cores:
+        print(f"Warning: {workers} workers x {threads} threads oversubscribes {cores} cores.")
+    return workers, threads
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index, sock, threads):
+    # Runs in the forked child; never returns
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    print(f"Worker {index} (pid {os.getpid()}) serving with {torch.get_num_threads()} torch threads.")
+
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+    os._exit(0)
+
+
+def fork_worker(index, sock, threads):
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            run_worker(index, sock, threads)
+        except BaseException as e:
+            print(f"Worker {index} failed: {e}")
+            os._exit(1)
+    return pid
+
+
+def main():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers, threads = plan(cores)
+    print(f"Serving with {workers} workers x {threads} torch threads on {cores} cores.")
+
+    # No forward passes in the parent: OpenMP thread pools don't survive fork, and
+    # engine building / warmup happen in each worker after it has pinned its threads
+    from app.services import sketchclassify
+
+    if sketchclassify.device.type == "cpu":
+        start = time.perf_counter()
+        sketchclassify.preload()
+        print(f"Preloaded weights in {(time.perf_counter() - start) * 1000.0:.1f} ms.")
+
+    sock = bind_socket(config.SERVE_HOST, config.SERVE_PORT)
+    children = {fork_worker(i, sock, threads): i for i in range(workers)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) exited with status {status}; restarting.")
+        time.sleep(1.0)
+        children[fork_worker(index, sock, threads)] = index
+
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
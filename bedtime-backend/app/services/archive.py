@@ -0,0 +1,128 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+# Layout of a narration archive:
+#
+#   header   magic, metadata length, entry count, index offset
+#   metadata JSON (voice, format, sample rate, prompt version, variants per label)
+#   blobs    story text and audio of every entry, back to back
+#   index    one fixed-size record per entry: key digest, text offset/length, audio offset/length
+#
+# The whole file is memory-mapped; a lookup is one dict probe and a slice of the map.
+MAGIC = b"BTNARR01"
+HEADER = struct.Struct("<8sQQQ")
+ENTRY = struct.Struct("<32sQQQQ")
+
+
+def entry_key(label: str, variant: int) -> bytes:
+    return hashlib.sha256(f"{label}\0{variant}".encode("utf-8")).digest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArchiveWriter:
+    # Appends entries to a temp file; close() writes the index and moves it into place
+    def __init__(self, path, metadata):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.entries = []
+        meta = json.dumps(metadata).encode("utf-8")
+        self._meta_length = len(meta)
+        self._file = open(self.tmp_path, "wb")
+        self._file.write(HEADER.pack(MAGIC, self._meta_length, 0, 0))
+        self._file.write(meta)
+
+    def _write_blob(self, data: bytes):
+        offset = self._file.tell()
+        self._file.write(data)
+        return offset, len(data)
+
+    def add(self, label: str, variant: int, story: str, audio: bytes):
+        self.add_entry(entry_key(label, variant), story, audio)
+
+    def add_entry(self, key: bytes, story: str, audio: bytes):
+        text_offset, text_length = self._write_blob(story.encode("utf-8"))
+        audio_offset, audio_length = self._write_blob(audio)
+        self.entries.append((key, text_offset, text_length, audio_offset, audio_length))
+
+    def close(self):
+        index_offset = self._file.tell()
+        for entry in self.entries:
+            self._file.write(ENTRY.pack(*entry))
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, self._meta_length, len(self.entries), index_offset))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class NarrationArchive:
+    # Read-only view of a pregenerated archive; pages are shared by every worker process
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, meta_length, count, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a narration archive.")
+        self.metadata = json.loads(self._map[HEADER.size:HEADER.size + meta_length])
+        self._index = {}
+        for i in range(count):
+            key, *offsets = ENTRY.unpack_from(self._map, index_offset + i * ENTRY.size)
+            self._index[key] = offsets
+        self.variants = self.metadata.get("variants", 1)
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, label: str, variant: int):
+        # Returns (story, audio bytes) or None when the entry is missing
+        offsets = self._index.get(entry_key(label, variant))
+        if offsets is None:
+            return None
+        return self._read(offsets)
+
+    def _read(self, offsets):
+        text_offset, text_length, audio_offset, audio_length = offsets
+        story = self._map[text_offset:text_offset + text_length].decode("utf-8")
+        return story, self._map[audio_offset:audio_offset + audio_length]
+
+    def entries(self):
+        # Every (key, story, audio) in the archive; keys are hashed, so labels aren't known
+        for key, offsets in self._index.items():
+            yield (key, *self._read(offsets))
+
+    def __contains__(self, key: bytes):
+        return key in self._index
+
+    def matches(self, audio_format, voice_sha256: str, prompt_version: str) -> bool:
+        name, sample_rate = audio_format
+        return (
+            self.metadata.get("format") == name
+            and self.metadata.get("sample_rate", 0) == sample_rate
+            and self.metadata.get("voice_sha256") == voice_sha256
+            and self.metadata.get("prompt_version") == prompt_version
+        )
+
+
+def open_archive(path):
+    if not path:
+        return None
+    try:
+        archive = NarrationArchive(path)
+    except (OSError, ValueError) as e:
+        print(f"Narration archive not loaded ({path}): {e}")
+        return None
+    print(f"Loaded narration archive {path} with {len(archive)} entries: {archive.metadata}")
+    return archive
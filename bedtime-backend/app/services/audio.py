@@ -0,0 +1,53 @@
+import struct
+
+WAV_HEADER_SIZE = 44
+
+
+def finalize_streamed_wav(data: bytes) -> bytes:
+    # A streamed WAV carries placeholder sizes; patch them once the whole stream is in
+    audio = bytearray(data)
+    struct.pack_into("<I", audio, 4, len(audio) - 8)
+    struct.pack_into("<I", audio, WAV_HEADER_SIZE - 4, len(audio) - WAV_HEADER_SIZE)
+    return bytes(audio)
+
+
+def open_ended_wav_header(segment: bytes) -> bytes:
+    # The segment's own header with the sizes set to "unknown", for streaming
+    header = bytearray(segment[:WAV_HEADER_SIZE])
+    struct.pack_into("<I", header, 4, 0xFFFFFFFF)
+    struct.pack_into("<I", header, WAV_HEADER_SIZE - 4, 0xFFFFFFFF)
+    return bytes(header)
+
+
+def concat_wavs(segments) -> bytes:
+    # Joins 16-bit PCM WAVs that share one format (the voice cloner's 44-byte headers)
+    return finalize_streamed_wav(
+        segments[0][:WAV_HEADER_SIZE] + b"".join(segment[WAV_HEADER_SIZE:] for segment in segments)
+    )
+
+
+# Output formats the voice cloner can encode, with their response media types
+AUDIO_FORMATS = {"wav": "audio/wav", "flac": "audio/flac", "opus": "audio/ogg"}
+MIME_TO_FORMAT = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/flac": "flac",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+}
+
+
+def negotiate_format(name=None, sample_rate=None, accept="", default="wav", default_rate=0):
+    # Explicit format/sample_rate win; otherwise the first audio type in Accept we can produce
+    if not name:
+        for part in accept.split(","):
+            mime = part.split(";")[0].strip().lower()
+            if mime in MIME_TO_FORMAT:
+                name = MIME_TO_FORMAT[mime]
+                break
+    name = (name or default).lower()
+    name = MIME_TO_FORMAT.get(name, name)
+    if name not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio format '{name}'. Choose one of: {', '.join(AUDIO_FORMATS)}")
+    return name, int(sample_rate or default_rate or 0)
@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+import torch
+
+# output is this request's rows of logits, model_ms the wall time of the whole batch
+BatchResult = namedtuple("BatchResult", ["output", "model_ms", "batch_size"])
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class BatchScheduler:
+    # Collects requests and runs them through the model as one batch. A batch is flushed
+    # once it holds max_batch_size images or the oldest request has waited max_wait_ms,
+    # whichever comes first. Multi-image requests are never split across batches.
+    def __init__(self, model, device, max_batch_size=8, max_wait_ms=5.0, max_queue_size=256, on_batch=None):
+        # on_batch(batch_size, queue_depth) is called after every forward pass
+        self.model = model
+        self.on_batch = on_batch
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._model_ms = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, image_tensor) -> Future:
+        # image_tensor is a preprocessed batch of shape (N, C, H, W); the result holds N rows
+        future = Future()
+        try:
+            self._queue.put_nowait((image_tensor, future))
+        except queue.Full:
+            raise QueueFullError(f"Batch queue is full ({self.max_queue_size} pending requests).")
+        return future
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=1.0)
+
+    def stats(self):
+        with self._lock:
+            batches, items, model_ms = self._batches, self._items, self._model_ms
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self._queue.qsize(),
+            "batches": batches,
+            "items": items,
+            "avg_batch_size": items / batches if batches else 0.0,
+            "avg_model_ms": model_ms / batches if batches else 0.0,
+        }
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        size = len(batch[0][0])
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            size += len(batch[-1][0])
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            # Drop requests whose callers have already given up
+            batch = [(tensor, future) for tensor, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                inputs = torch.cat([tensor for tensor, _ in batch]).to(self.device)
+                with torch.no_grad():
+                    outputs = self.model(inputs).cpu()
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            model_ms = (time.perf_counter() - start) * 1000.0
+
+            offset = 0
+            for tensor, future in batch:
+                rows = len(tensor)
+                future.set_result(BatchResult(outputs[offset:offset + rows], model_ms, len(outputs)))
+                offset += rows
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(outputs)
+                self._model_ms += model_ms
+
+            if self.on_batch is not None:
+                self.on_batch(len(outputs), self._queue.qsize())
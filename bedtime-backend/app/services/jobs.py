@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import time
+import uuid
+
+from app.services.metrics import QUEUE_DEPTH, STAGE_ERRORS, request_id_var
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+TERMINAL = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, payload, priority, audio_format):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.audio_format = audio_format
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.prediction = None
+        self.audio = None
+        self.error = None
+        # Carried over from the submitting request so upstream calls keep the same id
+        self.request_id = request_id_var.get()
+        self._subscribers = []
+
+    def snapshot(self):
+        state = {
+            "job_id": self.id,
+            "status": self.status,
+            "kind": self.kind,
+            "priority": self.priority,
+            "format": self.audio_format[0],
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.prediction is not None:
+            state["prediction"] = self.prediction
+        if self.error is not None:
+            state["error"] = self.error
+        if self.status == "done":
+            state["audio_bytes"] = len(self.audio)
+        return state
+
+    def subscribe(self):
+        # A queue that receives every later status snapshot; the caller must unsubscribe
+        updates = asyncio.Queue()
+        self._subscribers.append(updates)
+        return updates
+
+    def unsubscribe(self, updates):
+        if updates in self._subscribers:
+            self._subscribers.remove(updates)
+
+    def update(self, status, **fields):
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        snapshot = self.snapshot()
+        for updates in self._subscribers:
+            updates.put_nowait(snapshot)
+
+
+class JobQueue:
+    # Bounded priority queue of story jobs drained by `workers` asyncio tasks. Finished jobs
+    # (and their audio) are kept for `ttl` seconds, and at most max_stored jobs are kept.
+    def __init__(self, handler, workers=4, max_queue_size=256, ttl=600.0, max_stored=1024):
+        self.handler = handler
+        self.num_workers = workers
+        self.max_queue_size = max_queue_size
+        self.ttl = ttl
+        self.max_stored = max_stored
+        self.jobs = {}
+        self.counters = {"submitted": 0, "done": 0, "failed": 0, "rejected": 0, "expired": 0}
+        self._queue = asyncio.PriorityQueue(maxsize=max_queue_size)
+        self._order = itertools.count()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.num_workers)]
+        self._tasks.append(asyncio.create_task(self._reap()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, kind, payload, priority="normal", audio_format=("wav", 0)):
+        self._expire()
+        if len(self.jobs) >= self.max_stored:
+            self.counters["rejected"] += 1
+            raise JobQueueFull(
+                f"Too many jobs held ({self.max_stored}); finished jobs are kept for {self.ttl:.0f}s, retry later."
+            )
+        job = Job(kind, payload, priority, audio_format)
+        try:
+            # FIFO within a priority level
+            self._queue.put_nowait((PRIORITIES[priority], next(self._order), job))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise JobQueueFull(f"Job queue is full ({self.max_queue_size} queued jobs).")
+        self.jobs[job.id] = job
+        self.counters["submitted"] += 1
+        QUEUE_DEPTH.labels("jobs").set(self._queue.qsize())
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def _work(self, index):
+        while True:
+            _, _, job = await self._queue.get()
+            QUEUE_DEPTH.labels("jobs").set(self._queue.qsize())
+            request_id_var.set(job.request_id)
+            job.update("running", started=time.time())
+            try:
+                prediction, audio = await self.handler(job)
+                job.update("done", prediction=prediction, audio=audio, finished=time.time())
+                self.counters["done"] += 1
+            except asyncio.CancelledError:
+                job.update("failed", error="Server shutting down.", finished=time.time())
+                raise
+            except Exception as e:
+                STAGE_ERRORS.labels("job").inc()
+                print(f"Job {job.id} failed: {e}")
+                job.update("failed", error=getattr(e, "detail", None) or str(e), finished=time.time())
+                self.counters["failed"] += 1
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(self.ttl / 4, 1.0))
+            self._expire()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job.status in TERMINAL and job.finished < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+        self.counters["expired"] += len(expired)
+
+    def stats(self):
+        by_status = {}
+        for job in self.jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "workers": self.num_workers,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self._queue.qsize(),
+            "stored": len(self.jobs),
+            "by_status": by_status,
+            "result_ttl_s": self.ttl,
+            **self.counters,
+        }
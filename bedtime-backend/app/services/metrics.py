@@ -0,0 +1,80 @@
+import contextvars
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# With several worker processes set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates them
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram(
+    "bedtime_request_seconds", "End-to-end HTTP request latency", ["endpoint", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "bedtime_stage_seconds", "Latency of each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter("bedtime_stage_errors_total", "Pipeline stage failures", ["stage"])
+CACHE_REQUESTS = Counter("bedtime_cache_requests_total", "Cache lookups", ["cache", "result"])
+BATCH_SIZE = Histogram(
+    "bedtime_batch_size", "Images per classifier forward pass", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+UPSTREAM_EVENTS = Counter(
+    "bedtime_upstream_events_total", "Retries, circuit opens and fast rejections per upstream", ["upstream", "event"]
+)
+SINGLEFLIGHT_EVENTS = Counter(
+    "bedtime_singleflight_total", "Calls that led or joined a shared in-flight computation", ["flight", "outcome"]
+)
+QUEUE_DEPTH = Gauge("bedtime_queue_depth", "Items waiting in a queue", ["queue"], multiprocess_mode="livesum")
+
+# Set per request by the middleware in app.main and forwarded to the voice cloner
+request_id_var = contextvars.ContextVar("request_id", default="")
+# Stage timings (ms) for the current request, logged as one line when it finishes
+stage_timings_var = contextvars.ContextVar("stage_timings", default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+def request_headers():
+    request_id = request_id_var.get()
+    return {"X-Request-ID": request_id} if request_id else {}
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = stage_timings_var.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000.0
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def observe_batch(batch_size, queue_depth):
+    BATCH_SIZE.observe(batch_size)
+    QUEUE_DEPTH.labels("classify").set(queue_depth)
+
+
+def render():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,84 @@
+import asyncio
+
+from app.services.metrics import SINGLEFLIGHT_EVENTS
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one in-flight computation. The computation
+    # runs in its own task: a waiter that times out or is cancelled doesn't affect the
+    # others, and the task is only cancelled once no one is waiting for it any more.
+    # Every waiter gets the same result or the same exception.
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.timeout = timeout
+        self._calls = {}
+        self.counters = {"leaders": 0, "coalesced": 0, "timeouts": 0, "errors": 0, "abandoned": 0}
+
+    async def do(self, key, fn, timeout=None):
+        # fn is a zero-argument coroutine function; only the first caller's fn runs
+        call, _ = self._enter(key, fn)
+        try:
+            return await self._result(call, timeout)
+        finally:
+            self._leave(call)
+
+    def join(self, key, fn, timeout=None):
+        # Like do(), but returns (leader, result task) at once, so the leader can consume
+        # side outputs of its own fn while it runs. Cancelling the task leaves the flight.
+        call, leader = self._enter(key, fn)
+        result = asyncio.ensure_future(self._result(call, timeout))
+        # A done callback rather than a finally: it also runs if the task is cancelled
+        # before it ever started
+        result.add_done_callback(lambda _: self._leave(call))
+        return leader, result
+
+    def _enter(self, key, fn):
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = {"task": asyncio.ensure_future(fn()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda task: self._finished(key, task))
+            self._count("leaders")
+        else:
+            self._count("coalesced")
+        call["waiters"] += 1
+        return call, leader
+
+    async def _result(self, call, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(call["task"]), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            if call["task"].done():
+                raise
+            self._count("timeouts")
+            raise SingleFlightTimeout(f"{self.name} for this input did not finish in time.")
+
+    def _leave(self, call):
+        call["waiters"] -= 1
+        if call["waiters"] == 0 and not call["task"].done():
+            self._count("abandoned")
+            call["task"].cancel()
+
+    def _finished(self, key, task):
+        call = self._calls.get(key)
+        if call is not None and call["task"] is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._count("errors")
+
+    def _count(self, outcome):
+        self.counters[outcome] += 1
+        SINGLEFLIGHT_EVENTS.labels(self.name, outcome).inc()
+
+    def stats(self):
+        calls = self.counters["leaders"] + self.counters["coalesced"]
+        return {
+            "in_flight": len(self._calls),
+            **self.counters,
+            "coalesced_ratio": self.counters["coalesced"] / calls if calls else 0.0,
+        }
@@ -1,22 +1,156 @@
 import os
+import time
+import asyncio
+import json
 import torch
 import numpy as np
 from app.models.efficient_b0 import load_model
+from app.models.engines import build_engine, load_calibration_batches
 from app.models.dataset import Dataset
-from app.utils import preprocess_image
+from app.utils import INPUT_SIZE, preprocessor
+from app.config import Config
+from app.services.archive import file_sha256
+from app.services.batching import BatchScheduler, QueueFullError
+from app.services.cache import LRUCache, DiskCache, TieredCache, content_key
+from app.services.metrics import STAGE_ERRORS, observe_batch, observe_stage, record_cache
+from app.services.singleflight import SingleFlight, SingleFlightTimeout
 from fastapi import HTTPException
+from concurrent.futures import ThreadPoolExecutor
+
+config = Config()
 
-# Initialize the device and model once at the start
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = load_model(num_classes=250, model_path="app/artifacts/model.pth")
-model.to(device)
-model.eval()  
+
+# Set by startup(); requests arriving before then get a 503
+model = None
+scheduler = None
+startup_timings = {}
+# sha256 of MODEL_PATH, set by startup(); identifies the weights being served
+checkpoint_sha256 = None
+
+# Eager model loaded by a pre-forking parent (app.serve); startup() reuses it if set
+preloaded_model = None
+
+
+def preload():
+    # Loads the eager weights into shared memory so forked workers map the same pages
+    global preloaded_model
+    preloaded_model = load_model(
+        num_classes=config.NUM_CLASSES,
+        model_path=config.MODEL_PATH,
+        device=device,
+        timings=startup_timings,
+    )
+    if device.type == "cpu":
+        preloaded_model.share_memory()
+    return preloaded_model
+
+
+def startup():
+    # Loads the classifier, builds the configured engine, warms it up and starts the
+    # batch scheduler. Called once from the app lifespan, not at import time.
+    global model, scheduler, checkpoint_sha256
+    total_start = time.perf_counter()
+
+    start = time.perf_counter()
+    checkpoint_sha256 = file_sha256(config.MODEL_PATH)
+    startup_timings["checkpoint_hash_ms"] = (time.perf_counter() - start) * 1000.0
+
+    # Without a cap every uvicorn worker starts one intra-op thread per core
+    if config.TORCH_THREADS_PER_WORKER and torch.get_num_threads() != config.TORCH_THREADS_PER_WORKER:
+        torch.set_num_threads(config.TORCH_THREADS_PER_WORKER)
+
+    if preloaded_model is not None:
+        engine = preloaded_model
+    else:
+        engine = load_model(
+            num_classes=config.NUM_CLASSES,
+            model_path=config.MODEL_PATH,
+            device=device,
+            timings=startup_timings,
+        )
+
+    # Swap in the configured inference engine (the optimized engines target CPU)
+    start = time.perf_counter()
+    calibration_batches = None
+    if config.INFERENCE_ENGINE == "int8_static":
+        calibration_batches = load_calibration_batches(config.QUANT_CALIBRATION_PATH, transform=config.INPUT_TRANSFORM)
+    engine = build_engine(
+        config.INFERENCE_ENGINE,
+        engine,
+        calibration_batches=calibration_batches,
+        onnx_path=config.ONNX_PATH,
+        checkpoint_id=checkpoint_sha256,
+    )
+    startup_timings["build_engine_ms"] = (time.perf_counter() - start) * 1000.0
+
+    # First forward passes pay for allocator growth, kernel selection and lazy compilation
+    start = time.perf_counter()
+    warmup(engine, config.WARMUP_ITERATIONS, config.WARMUP_BATCH_SIZE)
+    startup_timings["warmup_ms"] = (time.perf_counter() - start) * 1000.0
+
+    # Concurrent requests share forward passes through the batch scheduler
+    scheduler = BatchScheduler(
+        engine,
+        device,
+        max_batch_size=config.BATCH_MAX_SIZE,
+        max_wait_ms=config.BATCH_MAX_WAIT_MS,
+        max_queue_size=config.BATCH_QUEUE_SIZE,
+        on_batch=observe_batch,
+    )
+    model = engine
+
+    startup_timings["total_ms"] = (time.perf_counter() - total_start) * 1000.0
+    for phase, ms in startup_timings.items():
+        print(f"Startup: {phase[:-3]} took {ms:.1f} ms")
+
+
+def warmup(engine, iterations, batch_size):
+    if iterations <= 0:
+        return
+    inputs = torch.zeros((batch_size, 1, INPUT_SIZE[1], INPUT_SIZE[0]), device=device)
+    with torch.no_grad():
+        for _ in range(iterations):
+            engine(inputs)
 
 
-label_map = {str(i): label for i, label in enumerate(["airplane", "alarm clock", "angel", "ant", "apple", "arm", "armchair", "ashtray", "axe", "backpack", "banana", "barn", "baseball bat", "basket", "bathtub", "bear (animal)", "bed", "bee", "beer-mug", "bell", "bench", "bicycle", "binoculars", "blimp", "book", "bookshelf", "boomerang", "bottle opener", "bowl", "brain", "bread", "bridge", "bulldozer", "bus", "bush", "butterfly", "cabinet", "cactus", "cake", "calculator", "camel", "camera", "candle", "cannon", "canoe", "car (sedan)", "carrot", "castle", "cat", "cell phone", "chair", "chandelier", "church", "cigarette", "cloud", "comb", "computer monitor", "computer-mouse", "couch", "cow", "crab", "crane (machine)", "crocodile", "crown", "cup", "diamond", "dog", "dolphin", "donut", "door", "door handle", "dragon", "duck", "ear", "elephant", "envelope", "eye", "eyeglasses", "face", "fan", "feather", "fire hydrant", "fish", "flashlight", "floor lamp", "flower with stem", "flying bird", "flying saucer", "foot", "fork", "frog", "frying-pan", "giraffe", "grapes", "grenade", "guitar", "hamburger", "hammer", "hand", "harp", "hat", "head", "head-phones", "hedgehog", "helicopter", "helmet", "horse", "hot air balloon", "hot-dog", "hourglass", "house", "human-skeleton", "ice-cream-cone", "ipod", "kangaroo", "key", "keyboard", "knife", "ladder", "laptop", "leaf", "lightbulb", "lighter", "lion", "lobster", "loudspeaker", "mailbox", "megaphone", "mermaid", "microphone", "microscope", "monkey", "moon", "mosquito", "motorbike", "mouse (animal)", "mouth", "mug", "mushroom", "nose", "octopus", "owl", "palm tree", "panda", "paper clip", "parachute", "parking meter", "parrot", "pear", "pen", "penguin", "person sitting", "person walking", "piano", "pickup truck", "pig", "pigeon", "pineapple", "pipe (for smoking)", "pizza", "potted plant", "power outlet", "present", "pretzel", "pumpkin", "purse", "rabbit", "race car", "radio", "rainbow", "revolver", "rifle", "rollerblades", "rooster", "sailboat", "santa claus", "satellite", "satellite dish", "saxophone", "scissors", "scorpion", "screwdriver", "sea turtle", "seagull", "shark", "sheep", "ship", "shoe", "shovel", "skateboard", "skull", "skyscraper", "snail", "snake", "snowboard", "snowman", "socks", "space shuttle", "speed-boat", "spider", "sponge bob", "spoon", "squirrel", "standing bird", "stapler", "strawberry", "streetlight", "submarine", "suitcase", "sun", "suv", "swan", "sword", "syringe", "t-shirt", "table", "tablelamp", "teacup", "teapot", "teddy-bear", "telephone", "tennis-racket", "tent", "tiger", "tire", "toilet", "tomato", "tooth", "toothbrush", "tractor", "traffic light", "train", "tree", "trombone", "trousers", "truck", "trumpet", "tv", "umbrella", "van", "vase", "violin", "walkie talkie", "wheel", "wheelbarrow", "windmill", "zebra"])}
+def shutdown():
+    if scheduler is not None:
+        scheduler.stop()
 
 
-def sketch_classify(image_data: bytes):
+def is_ready():
+    return scheduler is not None
+
+# Identical uploads (redraws, client retries) skip decoding and the forward pass
+classify_cache = TieredCache(
+    LRUCache(
+        max_items=config.CLASSIFY_CACHE_MAX_ITEMS,
+        max_bytes=config.CLASSIFY_CACHE_MAX_BYTES,
+        ttl=config.CLASSIFY_CACHE_TTL_S,
+        name="classify",
+    ),
+    DiskCache(
+        config.CLASSIFY_CACHE_DIR,
+        max_bytes=config.CLASSIFY_CACHE_DISK_MAX_BYTES,
+        ttl=config.CLASSIFY_CACHE_TTL_S,
+    ) if config.CLASSIFY_CACHE_DIR else None,
+)
+
+# Identical uploads that arrive while one is being classified wait for that result
+classify_flight = SingleFlight("classify", timeout=config.CLASSIFY_FLIGHT_TIMEOUT_S)
+
+# Bounded pool for CPU-bound work that must stay off the event loop
+cpu_executor = ThreadPoolExecutor(max_workers=config.CPU_WORKERS, thread_name_prefix="cpu")
+
+
+LABELS = ["airplane", "alarm clock", "angel", "ant", "apple", "arm", "armchair", "ashtray", "axe", "backpack", "banana", "barn", "baseball bat", "basket", "bathtub", "bear (animal)", "bed", "bee", "beer-mug", "bell", "bench", "bicycle", "binoculars", "blimp", "book", "bookshelf", "boomerang", "bottle opener", "bowl", "brain", "bread", "bridge", "bulldozer", "bus", "bush", "butterfly", "cabinet", "cactus", "cake", "calculator", "camel", "camera", "candle", "cannon", "canoe", "car (sedan)", "carrot", "castle", "cat", "cell phone", "chair", "chandelier", "church", "cigarette", "cloud", "comb", "computer monitor", "computer-mouse", "couch", "cow", "crab", "crane (machine)", "crocodile", "crown", "cup", "diamond", "dog", "dolphin", "donut", "door", "door handle", "dragon", "duck", "ear", "elephant", "envelope", "eye", "eyeglasses", "face", "fan", "feather", "fire hydrant", "fish", "flashlight", "floor lamp", "flower with stem", "flying bird", "flying saucer", "foot", "fork", "frog", "frying-pan", "giraffe", "grapes", "grenade", "guitar", "hamburger", "hammer", "hand", "harp", "hat", "head", "head-phones", "hedgehog", "helicopter", "helmet", "horse", "hot air balloon", "hot-dog", "hourglass", "house", "human-skeleton", "ice-cream-cone", "ipod", "kangaroo", "key", "keyboard", "knife", "ladder", "laptop", "leaf", "lightbulb", "lighter", "lion", "lobster", "loudspeaker", "mailbox", "megaphone", "mermaid", "microphone", "microscope", "monkey", "moon", "mosquito", "motorbike", "mouse (animal)", "mouth", "mug", "mushroom", "nose", "octopus", "owl", "palm tree", "panda", "paper clip", "parachute", "parking meter", "parrot", "pear", "pen", "penguin", "person sitting", "person walking", "piano", "pickup truck", "pig", "pigeon", "pineapple", "pipe (for smoking)", "pizza", "potted plant", "power outlet", "present", "pretzel", "pumpkin", "purse", "rabbit", "race car", "radio", "rainbow", "revolver", "rifle", "rollerblades", "rooster", "sailboat", "santa claus", "satellite", "satellite dish", "saxophone", "scissors", "scorpion", "screwdriver", "sea turtle", "seagull", "shark", "sheep", "ship", "shoe", "shovel", "skateboard", "skull", "skyscraper", "snail", "snake", "snowboard", "snowman", "socks", "space shuttle", "speed-boat", "spider", "sponge bob", "spoon", "squirrel", "standing bird", "stapler", "strawberry", "streetlight", "submarine", "suitcase", "sun", "suv", "swan", "sword", "syringe", "t-shirt", "table", "tablelamp", "teacup", "teapot", "teddy-bear", "telephone", "tennis-racket", "tent", "tiger", "tire", "toilet", "tomato", "tooth", "toothbrush", "tractor", "traffic light", "train", "tree", "trombone", "trousers", "truck", "trumpet", "tv", "umbrella", "van", "vase", "violin", "walkie talkie", "wheel", "wheelbarrow", "windmill", "zebra"]
+label_map = {str(i): label for i, label in enumerate(LABELS)}
+# Indexed by class id so top-k ids map to names in one vectorized lookup
+label_array = np.array(LABELS + ["Unknown"] * max(config.NUM_CLASSES - len(LABELS), 0), dtype=object)
+
+
+def _check_input(image_data):
     if not isinstance(image_data, bytes):
         raise HTTPException(
             status_code=422,
@@ -26,26 +160,163 @@ def sketch_classify(image_data: bytes):
             }
         )
 
-    try:
-        image_tensor = preprocess_image(image_data).to(device)
 
-        with torch.no_grad():
-            output = model(image_tensor)
-            probabilities = torch.nn.functional.softmax(output, dim=1)[0]
-            confidence, predicted_idx = torch.max(probabilities, dim=0)
+def _top_k(logits, k):
+    # logits is (N, num_classes); returns (N, k) label and probability arrays
+    probabilities = torch.nn.functional.softmax(logits, dim=1)
+    confidences, indices = torch.topk(probabilities, min(k, probabilities.shape[1]), dim=1)
+    return label_array[indices.numpy()], confidences.numpy()
+
 
-            predicted_label = label_map.get(str(predicted_idx.item()), "Unknown")
+def _to_prediction(result, preprocess_ms):
+    labels, confidences = _top_k(result.output, 1)
 
-        return {
-            "prediction": predicted_label,
-            "confidence": confidence.item()
+    return {
+        "prediction": labels[0, 0],
+        "confidence": float(confidences[0, 0]),
+        "timings": {
+            "preprocess_ms": preprocess_ms,
+            "model_ms": result.model_ms,
+            "batch_size": result.batch_size
         }
+    }
 
-    except Exception as e:
+
+def _cache_key(image_data):
+    # Results depend on the weights, the input transform and the engine (quantized engines
+    # can disagree with eager); the disk tier outlives restarts with a new checkpoint
+    return content_key("classify", checkpoint_sha256, config.INPUT_TRANSFORM, config.INFERENCE_ENGINE, image_data)
+
+
+def _cached_prediction(key):
+    cached = classify_cache.get(key)
+    record_cache("classify", cached is not None)
+    if cached is None:
+        return None
+    prediction = json.loads(cached)
+    prediction["timings"] = {"cached": True}
+    return prediction
+
+
+def _store_prediction(key, prediction):
+    value = {"prediction": prediction["prediction"], "confidence": prediction["confidence"]}
+    classify_cache.set(key, json.dumps(value).encode("utf-8"))
+
+
+def _check_ready():
+    if scheduler is None:
         raise HTTPException(
-            status_code=500,
+            status_code=503,
             detail={
-                "error": "Classification error",
-                "message": f"An error occurred during image classification: {str(e)}"
+                "error": "Classifier not ready",
+                "message": "The model is still loading."
             }
-        )
\ No newline at end of file
+        )
+
+
+def _observe(timings, submitted_s, result):
+    # Queue wait is everything between submit and result that wasn't the forward pass
+    model_s = result.model_ms / 1000.0
+    observe_stage("preprocess", sum(timings) / 1000.0)
+    observe_stage("queue_wait", max(submitted_s - model_s, 0.0))
+    observe_stage("model", model_s)
+
+
+def _classification_error(e):
+    STAGE_ERRORS.labels("classify").inc()
+    if isinstance(e, SingleFlightTimeout):
+        return HTTPException(
+            status_code=504,
+            detail={
+                "error": "Classification timed out",
+                "message": str(e)
+            }
+        )
+    if isinstance(e, QueueFullError):
+        return HTTPException(
+            status_code=503,
+            detail={
+                "error": "Classifier overloaded",
+                "message": str(e)
+            }
+        )
+    return HTTPException(
+        status_code=500,
+        detail={
+            "error": "Classification error",
+            "message": f"An error occurred during image classification: {str(e)}"
+        }
+    )
+
+
+async def sketch_classify_async(image_data: bytes):
+    _check_input(image_data)
+    _check_ready()
+
+    key = _cache_key(image_data)
+    cached = _cached_prediction(key)
+    if cached is not None:
+        return cached
+
+    # The cache key is the image hash, so concurrent duplicates share one classification
+    try:
+        prediction = await classify_flight.do(key, lambda: _classify_uncached(image_data, key))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _classification_error(e)
+    # Each caller gets its own copy of the shared result
+    return dict(prediction)
+
+
+async def _classify_uncached(image_data: bytes, key: str):
+    try:
+        # Decoding runs on the bounded CPU pool, the forward pass on the batch scheduler
+        loop = asyncio.get_running_loop()
+        image_tensor, timings = await loop.run_in_executor(cpu_executor, preprocessor.preprocess_batch, [image_data])
+        start = time.perf_counter()
+        result = await asyncio.wrap_future(scheduler.submit(image_tensor))
+        _observe(timings, time.perf_counter() - start, result)
+        prediction = _to_prediction(result, timings[0])
+
+    except Exception as e:
+        raise _classification_error(e)
+
+    _store_prediction(key, prediction)
+    return prediction
+
+
+async def sketch_classify_batch_async(images: list, top_k: int = 5):
+    # The whole upload is preprocessed into one tensor and submitted to the scheduler as a
+    # single request, so it shares one forward pass (and may share it with other requests)
+    for image_data in images:
+        _check_input(image_data)
+    _check_ready()
+
+    try:
+        loop = asyncio.get_running_loop()
+        image_tensor, timings = await loop.run_in_executor(cpu_executor, preprocessor.preprocess_batch, images)
+        start = time.perf_counter()
+        result = await asyncio.wrap_future(scheduler.submit(image_tensor))
+        _observe(timings, time.perf_counter() - start, result)
+        labels, confidences = _top_k(result.output, top_k)
+
+    except Exception as e:
+        raise _classification_error(e)
+
+    return {
+        "results": [
+            {
+                "predictions": [
+                    {"label": label, "confidence": confidence}
+                    for label, confidence in zip(image_labels, image_confidences)
+                ]
+            }
+            for image_labels, image_confidences in zip(labels.tolist(), confidences.tolist())
+        ],
+        "timings": {
+            "preprocess_ms": sum(timings),
+            "model_ms": result.model_ms,
+            "batch_size": result.batch_size
+        }
+    }
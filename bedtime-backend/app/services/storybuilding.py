@@ -1,9 +1,16 @@
+import asyncio
 import base64
-import requests
 import json
-from openai import OpenAI
 import os
+import re
 from dotenv import load_dotenv
+from app.config import Config
+from app.services.cache import LRUCache, DiskCache, TieredCache, content_key
+from app.services.audio import AUDIO_FORMATS, WAV_HEADER_SIZE, concat_wavs, finalize_streamed_wav, open_ended_wav_header
+from app.services.metrics import STAGE_ERRORS, record_cache, request_headers, timed
+from app.services.upstream import llm_upstream, openai_client, tts_client, tts_upstream, upstream_stats
+from app.services.archive import file_sha256, open_archive
+from app.services.singleflight import SingleFlight
 
 # Load environment variables
 load_dotenv()
@@ -11,50 +18,539 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 TTS_API_URL = os.getenv("TTS_API_URL")
 AUDIO_FILE_PATH = os.getenv("AUDIO_FILE_PATH")
-def generate_story(sketch_classify_result: dict) -> str:
+# Voice registration endpoint on the voice cloner, next to /tts by default
+TTS_VOICES_URL = os.getenv("TTS_VOICES_URL") or (TTS_API_URL or "").rsplit("/", 1)[0] + "/voices"
+
+config = Config()
+
+# Bump STORY_PROMPT_VERSION whenever these change so cached stories are not reused
+SYSTEM_PROMPT = "You are a creative storyteller."
+STORY_PROMPT = "Tell a bedtime story about: '{prediction}'. Keep it very short under 100 words for kids."
+
+# Sentence boundary in streamed LLM text: punctuation followed by whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _tiered_cache(name, max_items, max_bytes, ttl, directory, disk_max_bytes):
+    return TieredCache(
+        LRUCache(max_items=max_items, max_bytes=max_bytes, ttl=ttl, name=name),
+        DiskCache(directory, max_bytes=disk_max_bytes, ttl=ttl) if directory else None,
+    )
+
+
+story_cache = _tiered_cache(
+    "story",
+    config.STORY_CACHE_MAX_ITEMS,
+    config.STORY_CACHE_MAX_BYTES,
+    config.STORY_CACHE_TTL_S,
+    config.STORY_CACHE_DIR,
+    config.STORY_CACHE_DISK_MAX_BYTES,
+)
+audio_cache = _tiered_cache(
+    "audio",
+    config.AUDIO_CACHE_MAX_ITEMS,
+    config.AUDIO_CACHE_MAX_BYTES,
+    config.AUDIO_CACHE_TTL_S,
+    config.AUDIO_CACHE_DIR,
+    config.AUDIO_CACHE_DISK_MAX_BYTES,
+)
+
+# Pregenerated narrations (python -m app.pregenerate); only used for the voice it was built with
+narration_archive = open_archive(config.NARRATION_ARCHIVE_PATH)
+_archive_voice_sha256 = file_sha256(AUDIO_FILE_PATH) if narration_archive and AUDIO_FILE_PATH else None
+if narration_archive and narration_archive.metadata.get("voice_sha256") != _archive_voice_sha256:
+    print("Narration archive was built for a different voice; serving live narrations only.")
+
+story_counters = {"generated": 0, "reused": 0, "archived": 0}
+
+# Concurrent requests for the same label share one LLM call (story_flight, pipelined or
+# not) and, on the non-streaming path, one story + narration per (label, voice, format)
+# (narration_flight). A cold burst registers the narration voice once (voice_flight).
+story_flight = SingleFlight("story", timeout=config.STORY_FLIGHT_TIMEOUT_S)
+narration_flight = SingleFlight("narration", timeout=config.STORY_FLIGHT_TIMEOUT_S)
+voice_flight = SingleFlight("voice", timeout=config.STORY_FLIGHT_TIMEOUT_S)
+
+_rotation = {}
+_voice_ids = {}
+
+
+async def generate_story(sketch_classify_result: dict, audio_format=("wav", 0)) -> bytes:
     try:
         # Access prediction directly from the dictionary
         prediction = sketch_classify_result.get("prediction", "unknown")
         confidence = sketch_classify_result.get("confidence", "unknown")
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Call the ChatGPT API to expand on this story
-        response = client.chat.completions.create(            
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a creative storyteller."},
-                {"role": "user", "content": f"Tell a bedtime story about: '{prediction}'. Keep it very short under 100 words for kids."}
-            ]
-        )
-
-        # Extract the generated story from the API response
-        generated_story = response.choices[0].message.content  
-        print(f"Generated Story: {generated_story}")
+        archived = _archived_narration(prediction, audio_format)
+        if archived is not None:
+            return archived
 
-        # Read audio file as Base64
-        base64_voice = read_audio_file_as_base64(AUDIO_FILE_PATH)
-        # Use the narration function to generate narrated audio
-        narrated_audio_base64 = narrate_story(generated_story, base64_voice)
-        print("Narration completed successfully.")
-        return narrated_audio_base64
+        voice_id = await get_voice_id(AUDIO_FILE_PATH)
+        return await narration_flight.do(
+            (prediction, voice_id, audio_format),
+            lambda: _narrate_label(prediction, voice_id, audio_format),
+        )
 
     except Exception as e:
+        STAGE_ERRORS.labels("story").inc()
         print(f"Error while generating story or narration: {e}")
-        return ""
+        return b""
+
+
+async def _narrate_label(prediction: str, voice_id: str, audio_format) -> bytes:
+    generated_story = None
+    if _pipeline_enabled(audio_format):
+        sentences, story = _join_pipelined_story(prediction)
+        if sentences is not None:
+            return await _generate_pipelined(sentences, story, voice_id, audio_format)
+        if story is not None:
+            # Another request is already writing this label's story; narrate it once it's done
+            generated_story = await story
+
+    if generated_story is None:
+        generated_story = await next_story(prediction)
+    print(f"Generated Story: {generated_story}")
+
+    audio_key = _audio_key(voice_id, generated_story, audio_format)
+    cached_audio = await asyncio.to_thread(audio_cache.get, audio_key)
+    record_cache("audio", cached_audio is not None)
+    if cached_audio is not None:
+        print("Narration served from cache.")
+        return cached_audio
+
+    # Use the narration function to generate narrated audio
+    with timed("tts"):
+        narrated_audio = await narrate_story(generated_story, voice_id, audio_format)
+    await asyncio.to_thread(audio_cache.set, audio_key, narrated_audio)
+    print("Narration completed successfully.")
+    return narrated_audio
+
+
+def _archived_narration(prediction: str, audio_format):
+    # Rotates through the label's pregenerated variants; None falls back to live generation
+    if narration_archive is None or not narration_archive.matches(
+        audio_format, _archive_voice_sha256, config.STORY_PROMPT_VERSION
+    ):
+        return None
+    key = ("archive", prediction)
+    turn = _rotation.get(key, 0)
+    _rotation[key] = turn + 1
+    for offset in range(narration_archive.variants):
+        entry = narration_archive.get(prediction, (turn + offset) % narration_archive.variants)
+        if entry is not None:
+            record_cache("archive", True)
+            story_counters["archived"] += 1
+            print(f"Narration served from archive: {entry[0]}")
+            return bytes(entry[1])
+    record_cache("archive", False)
+    return None
+
+
+def _audio_key(voice_id: str, story: str, audio_format=("wav", 0)) -> str:
+    # Values are raw encoded audio bytes
+    name, sample_rate = audio_format
+    return content_key("audio", name, str(sample_rate), voice_id, story)
+
+
+async def stream_story(sketch_classify_result: dict):
+    # Returns an async iterator of WAV bytes. Everything that can fail cleanly (LLM call,
+    # voice lookup, the upstream status) happens before it is returned, so callers can
+    # still answer with an error status.
+    # Returns (chunks, close). close releases the upstream resources the stream holds and
+    # must run even if the chunks are never iterated (e.g. the client left first); it is
+    # safe to call more than once.
+    prediction = sketch_classify_result.get("prediction", "unknown")
+    archived = _archived_narration(prediction, ("wav", 0))
+    if archived is not None:
+        return _single_chunk(archived), _nothing_to_close
+
+    voice_id = await get_voice_id(AUDIO_FILE_PATH)
+    generated_story = None
+    if _pipeline_enabled(("wav", 0)):
+        sentences, story = _join_pipelined_story(prediction)
+        if sentences is not None:
+            return await _stream_pipelined(sentences, story, voice_id)
+        if story is not None:
+            # Another request is already writing this label's story; narrate it once it's done
+            generated_story = await story
+
+    if generated_story is None:
+        generated_story = await next_story(prediction)
+    print(f"Generated Story: {generated_story}")
+
+    audio_key = _audio_key(voice_id, generated_story)
+    cached_audio = await asyncio.to_thread(audio_cache.get, audio_key)
+    record_cache("audio", cached_audio is not None)
+    if cached_audio is not None:
+        print("Narration served from cache.")
+        return _single_chunk(cached_audio), _nothing_to_close
+
+    payload = {"voice_id": voice_id, "text": generated_story, "stream": True}
+
+    async def open_stream():
+        request = tts_client.build_request("POST", TTS_API_URL, json=payload, headers=request_headers())
+        return await tts_client.send(request, stream=True)
+
+    # Time to the upstream's first response (headers), i.e. until audio can start flowing.
+    # The TTS concurrency slot stays held until the relay finishes.
+    with timed("tts_first_byte"):
+        response = await tts_upstream.call(open_stream, hold=True)
+        if response.status_code == 404:
+            await response.aclose()
+            tts_upstream.release()
+            payload["voice_id"] = await get_voice_id(AUDIO_FILE_PATH, refresh=True)
+            response = await tts_upstream.call(open_stream, hold=True)
+        if response.status_code != 200:
+            try:
+                body = await response.aread()
+            finally:
+                await response.aclose()
+                tts_upstream.release()
+            raise Exception(f"Failed to stream audio. Status code: {response.status_code}, Response: {body[:200]!r}")
+
+    close = _close_once(response.aclose, tts_upstream.release)
+    return _relay_stream(response, audio_key, close), close
+
+
+async def _single_chunk(data: bytes):
+    yield data
+
+
+async def _nothing_to_close():
+    pass
+
+
+def _close_once(aclose, release=None):
+    # Whichever of the relay's finally and the response's background task runs first
+    # closes the upstream stream and frees the TTS slot; the other call does nothing
+    closed = False
+
+    async def close():
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        try:
+            await aclose()
+        finally:
+            if release is not None:
+                release()
+
+    return close
+
+
+async def _relay_stream(response, audio_key, close):
+    chunks = []
+    try:
+        async for chunk in response.aiter_raw():
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        await close()
+
+    # Only reached when the upstream stream ended cleanly
+    audio = finalize_streamed_wav(b"".join(chunks))
+    await asyncio.to_thread(audio_cache.set, audio_key, audio)
+    print("Streamed narration completed successfully.")
+
+
+def _story_key(prediction: str) -> str:
+    return content_key("story", config.STORY_PROMPT_VERSION, prediction)
+
+
+def _story_variants(key: str) -> list:
+    cached = story_cache.get(key)
+    return json.loads(cached) if cached is not None else []
+
+
+def _remember_story(key: str, story: str):
+    # Re-read: other variants may have been added while this one was written. A label
+    # keeps at most STORY_VARIANTS stories; a newer one replaces the oldest.
+    variants = _story_variants(key)
+    variants.append(story)
+    story_cache.set(key, json.dumps(variants[-config.STORY_VARIANTS:]).encode("utf-8"))
+    story_counters["generated"] += 1
+
+
+async def next_story(prediction: str) -> str:
+    # Fill up to STORY_VARIANTS stories per label, then rotate through them
+    key = _story_key(prediction)
+    variants = _story_variants(key)
+
+    record_cache("story", len(variants) >= config.STORY_VARIANTS)
+    if len(variants) < config.STORY_VARIANTS:
+        return await story_flight.do(key, lambda: _new_story(prediction, key))
 
+    turn = _rotation.get(key, 0)
+    _rotation[key] = turn + 1
+    story_counters["reused"] += 1
+    return variants[turn % len(variants)]
 
-def narrate_story(story: str, base64_voice: str) -> str:
+
+async def _new_story(prediction: str, key: str) -> str:
+    with timed("llm"):
+        story = await write_story(prediction)
+    _remember_story(key, story)
+    return story
+
+
+def _story_messages(prediction: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": STORY_PROMPT.format(prediction=prediction)}
+    ]
+
+
+async def write_story(prediction: str) -> str:
+    # Call the ChatGPT API to expand on this story
+    response = await llm_upstream.call(lambda: openai_client().chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=_story_messages(prediction)
+    ))
+
+    # Extract the generated story from the API response
+    return response.choices[0].message.content
+
+
+def _pipeline_enabled(audio_format) -> bool:
+    # Segments are joined as PCM, so the pipelined mode only produces WAV
+    return config.STORY_PIPELINE and audio_format[0] == "wav"
+
+
+async def _story_deltas(prediction: str):
+    # Text deltas of a streamed chat completion; holds an LLM slot until the stream ends
+    stream = await llm_upstream.call(lambda: openai_client().chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=_story_messages(prediction),
+        stream=True
+    ), hold=True)
+    try:
+        with timed("llm"):
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+        llm_upstream.release()
+
+
+async def _sentences(deltas, min_chars: int):
+    # Cuts streamed text after sentence punctuation; fragments shorter than min_chars are
+    # folded into the next sentence so the TTS isn't called for a lone "The end."
+    buffer = ""
+    pending = ""
+    async for delta in deltas:
+        buffer += delta
+        *complete, buffer = SENTENCE_END.split(buffer)
+        for part in complete:
+            pending = f"{pending} {part}" if pending else part
+            if len(pending) >= min_chars:
+                yield pending
+                pending = ""
+    tail = f"{pending} {buffer.strip()}".strip()
+    if tail:
+        yield tail
+
+
+def _join_pipelined_story(prediction: str):
+    # Returns (sentences, story). While the label still needs new variants, the LLM stream
+    # runs under story_flight keyed like next_story, so concurrent misses share it:
+    # sentences is the leader's queue of finished sentences (None for the others), and
+    # story is a task resolving to the whole story. (None, None) means reuse a cached one.
+    key = _story_key(prediction)
+    if len(_story_variants(key)) >= config.STORY_VARIANTS:
+        return None, None
+    record_cache("story", False)
+    sentences = asyncio.Queue()
+    leader, story = story_flight.join(key, lambda: _pipelined_story(prediction, key, sentences))
+    return (sentences if leader else None), story
+
+
+async def _pipelined_story(prediction: str, key: str, sentences: asyncio.Queue) -> str:
+    # Hands each sentence to the leader's narration as soon as the LLM finishes it; None
+    # marks the end of the story, or an LLM failure that the story task then raises
+    parts = []
+    try:
+        async for sentence in _sentences(_story_deltas(prediction), config.STORY_PIPELINE_MIN_CHARS):
+            parts.append(sentence)
+            sentences.put_nowait(sentence)
+    finally:
+        sentences.put_nowait(None)
+    if not parts:
+        raise Exception("The story came back empty.")
+    story = " ".join(parts)
+    _remember_story(key, story)
+    return story
+
+
+async def _narrate_pipelined(sentences: asyncio.Queue, story, voice_id: str, audio_format):
+    # Yields one WAV segment per sentence, in story order. Each sentence goes to the TTS
+    # service as soon as the LLM finishes it, so narration overlaps generation; the number
+    # of sentences narrated at once is bounded by the TTS upstream's concurrency cap.
+    pending = asyncio.Queue()
+    tasks = []
+
+    async def produce():
+        try:
+            while True:
+                sentence = await sentences.get()
+                if sentence is None:
+                    break
+                task = asyncio.create_task(narrate_story(sentence, voice_id, audio_format))
+                tasks.append(task)
+                await pending.put(task)
+        finally:
+            await pending.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            yield await task
+        # Surfaces an LLM failure that ended the story early
+        await story
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+        # Leaves story_flight; the LLM stream is only cancelled if no one else waits for it
+        story.cancel()
+
+
+async def _generate_pipelined(sentences: asyncio.Queue, story, voice_id: str, audio_format) -> bytes:
+    with timed("story_pipeline"):
+        segments = [segment async for segment in _narrate_pipelined(sentences, story, voice_id, audio_format)]
+
+    story = story.result()
+    print(f"Generated Story: {story}")
+    narrated_audio = concat_wavs(segments)
+    await asyncio.to_thread(audio_cache.set, _audio_key(voice_id, story, audio_format), narrated_audio)
+    print("Pipelined narration completed successfully.")
+    return narrated_audio
+
+
+async def _stream_pipelined(sentences: asyncio.Queue, story, voice_id: str):
+    # Waits for the first sentence's audio before returning, so LLM and TTS failures can
+    # still be answered with an error status
+    segments = _narrate_pipelined(sentences, story, voice_id, ("wav", 0))
+    with timed("tts_first_byte"):
+        try:
+            first = await segments.__anext__()
+        except StopAsyncIteration:
+            raise Exception("The story came back empty.")
+        except BaseException:
+            await segments.aclose()
+            raise
+    close = _close_once(segments.aclose)
+    return _relay_segments(first, segments, story, voice_id, close), close
+
+
+async def _relay_segments(first: bytes, segments, story, voice_id: str, close):
+    pcm = [first[WAV_HEADER_SIZE:]]
+    try:
+        yield open_ended_wav_header(first)
+        yield pcm[0]
+        async for segment in segments:
+            pcm.append(segment[WAV_HEADER_SIZE:])
+            yield pcm[-1]
+    finally:
+        await close()
+
+    # Only reached when every sentence was narrated
+    story = story.result()
+    print(f"Generated Story: {story}")
+    audio = finalize_streamed_wav(first[:WAV_HEADER_SIZE] + b"".join(pcm))
+    await asyncio.to_thread(audio_cache.set, _audio_key(voice_id, story), audio)
+    print("Pipelined streamed narration completed successfully.")
+
+
+async def narrate_story(story: str, voice_id: str, audio_format=("wav", 0)) -> bytes:
+    name, sample_rate = audio_format
     payload = {
-        "input_audio": base64_voice,
+        "voice_id": voice_id,
         "text": story,
+        "format": name,
     }
-    response = requests.post(TTS_API_URL, json=payload)
+    if sample_rate:
+        payload["sample_rate"] = sample_rate
+    # Ask for a raw audio body; TTS_BINARY=false falls back to base64 inside JSON
+    headers = {"Accept": AUDIO_FORMATS[name]} if config.TTS_BINARY else {}
+    headers.update(request_headers())
+
+    async def post():
+        return await tts_client.post(TTS_API_URL, json=payload, headers=headers)
+
+    response = await tts_upstream.call(post)
+    if response.status_code == 404:
+        # The voice cloner restarted or evicted the voice; register it again and retry once
+        payload["voice_id"] = await get_voice_id(AUDIO_FILE_PATH, refresh=True)
+        response = await tts_upstream.call(post)
     if response.status_code == 200:
-        return response.json()["output_audio"]
+        if response.headers.get("content-type", "").startswith("audio/"):
+            return response.content
+        return base64.b64decode(response.json()["output_audio"])
     else:
         raise Exception(f"Failed to generate audio. Status code: {response.status_code}, Response: {response.text}")
 
+
+async def get_voice_id(file_path: str, refresh: bool = False) -> str:
+    # The reference clip is uploaded once per (path, mtime); /tts then only needs the id
+    stat = await asyncio.to_thread(os.stat, file_path)
+    memo_key = (file_path, stat.st_mtime_ns)
+    if refresh or memo_key not in _voice_ids:
+        # Refreshes after a 404 coalesce too: they all need the same new registration
+        return await voice_flight.do(memo_key, lambda: _register_voice(memo_key, file_path))
+    return _voice_ids[memo_key]
+
+
+async def _register_voice(memo_key, file_path: str) -> str:
+    with timed("voice_register"):
+        _voice_ids[memo_key] = await register_voice(file_path)
+    return _voice_ids[memo_key]
+
+
+async def register_voice(file_path: str) -> str:
+    if config.TTS_BINARY:
+        audio_bytes = await asyncio.to_thread(read_audio_file, file_path)
+        body = {"files": {"audio": ("voice.wav", audio_bytes, "audio/wav")}}
+    else:
+        base64_voice = await asyncio.to_thread(read_audio_file_as_base64, file_path)
+        body = {"json": {"input_audio": base64_voice}}
+
+    async def post():
+        return await tts_client.post(TTS_VOICES_URL, headers=request_headers(), **body)
+
+    response = await tts_upstream.call(post)
+    if response.status_code == 200:
+        voice_id = response.json()["voice_id"]
+        print(f"Registered narration voice: {voice_id}")
+        return voice_id
+    else:
+        raise Exception(f"Failed to register voice. Status code: {response.status_code}, Response: {response.text}")
+
+
+def story_stats():
+    return {
+        "stories": dict(story_counters, variants_per_label=config.STORY_VARIANTS),
+        "story_cache": story_cache.stats(),
+        "audio_cache": audio_cache.stats(),
+        "upstreams": upstream_stats(),
+        "single_flight": {
+            "story": story_flight.stats(),
+            "narration": narration_flight.stats(),
+            "voice": voice_flight.stats(),
+        },
+        "archive": {"path": narration_archive.path, "entries": len(narration_archive), **narration_archive.metadata}
+        if narration_archive else None,
+    }
+
+
+def read_audio_file(file_path: str) -> bytes:
+    with open(file_path, "rb") as audio_file:
+        return audio_file.read()
+
+
 def read_audio_file_as_base64(file_path: str) -> str:
     with open(file_path, "rb") as audio_file:
         encoded_audio = base64.b64encode(audio_file.read()).decode("utf-8")
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import random
+import time
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from app.config import Config
+from app.services.metrics import UPSTREAM_EVENTS
+
+load_dotenv()
+
+config = Config()
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures and rejects calls for reset_timeout
+    # seconds; then lets a single trial call through (half-open) to decide whether to close.
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = "closed"
+
+    def check(self):
+        if self.state == "closed":
+            return
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return
+        UPSTREAM_EVENTS.labels(self.name, "rejected").inc()
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open), failing fast.")
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                UPSTREAM_EVENTS.labels(self.name, "opened").inc()
+                print(f"Circuit for {self.name} opened after {self.failures} failures.")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"Upstream returned {response.status_code}")
+        self.response = response
+
+
+class Upstream:
+    # Guards calls to one upstream service: at most max_concurrency in flight, up to
+    # `retries` retries with full-jitter backoff on transient failures, and a circuit
+    # breaker so an outage costs callers nothing instead of a timeout each.
+    def __init__(self, name, max_concurrency, retries, retry_on=(), retry_statuses=(502, 503, 504),
+                 backoff=0.2, backoff_max=2.0, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.retries = retries
+        self.retry_on = tuple(retry_on) + (RetryableStatus,)
+        self.retry_statuses = retry_statuses
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+    async def call(self, fn, hold=False):
+        # fn is a zero-argument coroutine function, called once per attempt. If it returns
+        # an httpx.Response with a retryable status, that counts as a failed attempt.
+        # hold=True keeps the concurrency slot after returning (e.g. for a response that is
+        # still streaming); the caller must then call release().
+        self.breaker.check()
+        await self._slots.acquire()
+        self.in_flight += 1
+        try:
+            result = await self._attempts(fn)
+        except BaseException:
+            if self.breaker.state == "half_open":
+                # The trial call was cancelled; stay open rather than stuck half-open
+                self.breaker.record_failure()
+            self.release()
+            raise
+        if not hold:
+            self.release()
+        return result
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def _attempts(self, fn):
+        attempt = 0
+        while True:
+            try:
+                result = await fn()
+                if isinstance(result, httpx.Response) and result.status_code in self.retry_statuses:
+                    raise RetryableStatus(result)
+                self.breaker.record_success()
+                return result
+            except self.retry_on as e:
+                if attempt >= self.retries:
+                    self.breaker.record_failure()
+                    if isinstance(e, RetryableStatus):
+                        # Let the caller report the upstream's own error response
+                        return e.response
+                    raise
+                delay = self._delay(attempt, e)
+                attempt += 1
+                UPSTREAM_EVENTS.labels(self.name, "retry").inc()
+                print(f"Retrying {self.name} call in {delay:.2f}s after: {e}")
+                if isinstance(e, RetryableStatus):
+                    await e.response.aclose()
+                await asyncio.sleep(delay)
+            except Exception:
+                # Anything else (bad request, unknown voice, ...) means the upstream answered
+                self.breaker.record_success()
+                raise
+
+    def _delay(self, attempt, error):
+        # Honour the upstream's Retry-After (the voice cloner sends one when it sheds load)
+        if isinstance(error, RetryableStatus):
+            retry_after = error.response.headers.get("retry-after", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0.0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+# One keep-alive pool per upstream, shared by every request in this process
+tts_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(config.TTS_TIMEOUT_S, connect=config.UPSTREAM_CONNECT_TIMEOUT_S),
+    limits=httpx.Limits(
+        max_connections=config.TTS_MAX_CONCURRENCY * 2,
+        max_keepalive_connections=config.TTS_MAX_CONCURRENCY,
+    ),
+)
+_openai_client = None
+
+
+def openai_client():
+    # Created on first use so a missing OPENAI_API_KEY fails the story call, not startup
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=config.LLM_TIMEOUT_S,
+            max_retries=0,  # retries happen in llm_upstream so they share its backoff and breaker
+            http_client=httpx.AsyncClient(
+                timeout=httpx.Timeout(config.LLM_TIMEOUT_S, connect=config.UPSTREAM_CONNECT_TIMEOUT_S),
+                limits=httpx.Limits(
+                    max_connections=config.LLM_MAX_CONCURRENCY * 2,
+                    max_keepalive_connections=config.LLM_MAX_CONCURRENCY,
+                ),
+            ),
+        )
+    return _openai_client
+
+
+tts_upstream = Upstream(
+    "tts",
+    max_concurrency=config.TTS_MAX_CONCURRENCY,
+    retries=config.TTS_RETRIES,
+    retry_on=(httpx.TransportError,),
+    backoff=config.RETRY_BACKOFF_S,
+    backoff_max=config.RETRY_BACKOFF_MAX_S,
+    failure_threshold=config.BREAKER_FAILURES,
+    reset_timeout=config.BREAKER_RESET_S,
+)
+llm_upstream = Upstream(
+    "llm",
+    max_concurrency=config.LLM_MAX_CONCURRENCY,
+    retries=config.LLM_RETRIES,
+    retry_on=(openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError),
+    backoff=config.RETRY_BACKOFF_S,
+    backoff_max=config.RETRY_BACKOFF_MAX_S,
+    failure_threshold=config.BREAKER_FAILURES,
+    reset_timeout=config.BREAKER_RESET_S,
+)
+
+
+def upstream_stats():
+    return {"tts": tts_upstream.stats(), "llm": llm_upstream.stats()}
+
+
+async def close_clients():
+    await tts_client.aclose()
+    if _openai_client is not None:
+        await _openai_client.close()
@@ -1,12 +1,84 @@
+import time
+import numpy as np
+import torch
 from PIL import Image
 from io import BytesIO
-from torchvision import transforms
+
+from app.config import Config
+
+# There is no Normalize in training: SketchDataset is used without a transform, so the
+# model sees ToTensor output. What ToTensor receives depends on the checkpoint:
+#
+#   "binary"  The shipped model.pth. Training stored images as float pixel/255 and
+#             SketchDataset cast them back with astype('uint8'), which floors everything
+#             but pure white (255) to 0. After ToTensor the input is 1/255 on pure white
+#             pixels and 0 everywhere else.
+#   "scaled"  Plain ToTensor on the 0-255 pixels, i.e. pixel/255 in [0, 1]. Only for
+#             checkpoints trained on unaltered pixels.
+#
+# Training resizes with skimage and serving with PIL, so "binary" reproduces the
+# checkpoint's input closely but not bit for bit.
+INPUT_TRANSFORMS = ("binary", "scaled")
+INPUT_SIZE = (224, 224)
+NORMALIZE_MEAN = 0.0
+NORMALIZE_STD = 1.0
+
+
+def input_pixels(pixels, transform):
+    # uint8 pixels -> the values ToTensor saw during training, still on the 0-255 scale
+    if transform == "binary":
+        return pixels == 255
+    return pixels
+
+
+class ImagePreprocessor:
+    # Built once and reused; decodes a list of images straight into one batch tensor
+    def __init__(self, size=INPUT_SIZE, mean=NORMALIZE_MEAN, std=NORMALIZE_STD, transform="binary"):
+        if transform not in INPUT_TRANSFORMS:
+            raise ValueError(f"Unknown input transform '{transform}'. Choose one of: {', '.join(INPUT_TRANSFORMS)}")
+        self.size = size
+        self.transform = transform
+        self.mean = mean
+        self.std = std
+        self.scale = 1.0 / (255.0 * std)
+        self.offset = -mean / std
+
+    def _decode(self, image_data: bytes):
+        image = Image.open(BytesIO(image_data))
+        # JPEG can decode at a reduced scale (and straight to grayscale); PNG ignores this
+        image.draft("L", self.size)
+        if image.mode != "L":
+            image = image.convert("L")
+        if image.size != self.size:
+            # reducing_gap lets large images shrink with a cheap box reduce first
+            image = image.resize(self.size, Image.BILINEAR, reducing_gap=3.0)
+        return image
+
+    def preprocess_batch(self, images, out=None):
+        # Returns a (N, 1, H, W) float tensor and the per-image preprocessing time in ms
+        height, width = self.size[1], self.size[0]
+        if out is None:
+            out = torch.empty((len(images), 1, height, width), dtype=torch.float32)
+        out_array = out.numpy()
+
+        timings = []
+        for i, image_data in enumerate(images):
+            start = time.perf_counter()
+            # Pixels are cast to float32 while being copied into the batch slot
+            out_array[i, 0] = input_pixels(np.asarray(self._decode(image_data)), self.transform)
+            timings.append((time.perf_counter() - start) * 1000.0)
+
+        start = time.perf_counter()
+        out.mul_(self.scale)
+        if self.offset:
+            out.add_(self.offset)
+        per_image_scale = (time.perf_counter() - start) * 1000.0 / max(len(images), 1)
+        return out, [t + per_image_scale for t in timings]
+
+
+preprocessor = ImagePreprocessor(transform=Config().INPUT_TRANSFORM)
+
 
 def preprocess_image(image_data: bytes):
-    image = Image.open(BytesIO(image_data)).convert("L")  
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor()
-    ])
-    image = transform(image).unsqueeze(0)  
+    image, _ = preprocessor.preprocess_batch([image_data])
     return image
@@ -0,0 +1,56 @@
+import io
+import json
+import platform
+import subprocess
+
+import numpy as np
+from PIL import Image
+
+
+def percentiles(timings_ms):
+    # Latency summary shared by every benchmark so reports line up between runs
+    if not timings_ms:
+        return {"count": 0}
+    values = np.asarray(timings_ms, dtype=np.float64)
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def run_info():
+    # Enough context to tell which commit and host a report came from
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "machine": platform.machine()}
+
+
+def sketch_png(seed=0, size=(256, 256)):
+    # A synthetic line drawing; different seeds give different bytes (and cache keys)
+    rng = np.random.default_rng(seed)
+    image = np.full((size[1], size[0]), 255, dtype=np.uint8)
+    for _ in range(12):
+        x0, y0, x1, y1 = rng.integers(0, min(size), 4)
+        steps = max(abs(x1 - x0), abs(y1 - y0), 1)
+        xs = np.linspace(x0, x1, steps).astype(int)
+        ys = np.linspace(y0, y1, steps).astype(int)
+        image[ys, xs] = 0
+    buffer = io.BytesIO()
+    Image.fromarray(image, mode="L").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write_report(report, path=None):
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    print(text)
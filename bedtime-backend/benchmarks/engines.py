@@ -0,0 +1,148 @@
+# Accuracy parity and latency benchmark for the classifier inference engines.
+#
+#   python -m benchmarks.engines --images data/processed/shards/test
+#
+# --images is a SketchClassifier shard directory (labels are read from it too) or, for
+# older runs, an npz with an "images" array plus --labels with a "labels" array.
+#
+# Every engine is compared against the eager fp32 model on the same held-out images,
+# then timed at each batch size. Results are printed as JSON. int8_static is calibrated
+# on --calibration, which must not overlap --images; for a shard directory it defaults
+# to the sibling val split.
+import argparse
+import copy
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from app.config import Config
+from app.models.efficient_b0 import load_model
+from app.models.engines import ENGINES, build_engine, load_array, load_calibration_batches, load_images
+
+
+def run_in_batches(model, images, batch_size=64):
+    outputs = []
+    with torch.no_grad():
+        for batch in torch.split(images, batch_size):
+            outputs.append(model(batch))
+    return torch.cat(outputs)
+
+
+def check_parity(engine, images, reference_logits, labels=None):
+    logits = run_in_batches(engine, images)
+    predictions = logits.argmax(dim=1)
+    reference = reference_logits.argmax(dim=1)
+    result = {
+        "top1_agreement": (predictions == reference).float().mean().item(),
+        "max_abs_logit_diff": (logits - reference_logits).abs().max().item(),
+    }
+    if labels is not None:
+        result["accuracy"] = (predictions == labels).float().mean().item()
+    return result
+
+
+def benchmark(engine, batch_size, iterations=20, warmup=3):
+    inputs = torch.rand(batch_size, 1, 224, 224)
+    timings = []
+    with torch.no_grad():
+        for _ in range(warmup):
+            engine(inputs)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            engine(inputs)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    return {
+        "batch_size": batch_size,
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[int(0.95 * (len(timings) - 1))],
+        "images_per_sec": batch_size * 1000.0 / statistics.mean(timings),
+    }
+
+
+def default_calibration_path(images_path):
+    # .../shards/test -> .../shards/val, if it exists
+    path = os.path.normpath(images_path)
+    if path.endswith(".json"):
+        path = os.path.dirname(path)
+    if os.path.basename(path) == "val" or not os.path.isdir(path):
+        return None
+    val_dir = os.path.join(os.path.dirname(path), "val")
+    return val_dir if os.path.isdir(val_dir) else None
+
+
+def main():
+    config = Config()
+    parser = argparse.ArgumentParser(description="Compare classifier inference engines against eager fp32")
+    parser.add_argument("--images", required=True, help="shard directory or npz of held-out sketches")
+    parser.add_argument("--labels", help="npz with the matching 'labels' array (default: from the shard directory)")
+    parser.add_argument("--calibration", help="sketches for int8_static calibration (default: QUANT_CALIBRATION_PATH, "
+                        "else the val shards next to --images)")
+    parser.add_argument("--model-path", default=config.MODEL_PATH)
+    parser.add_argument("--input-transform", default=config.INPUT_TRANSFORM, help="see app.utils.INPUT_TRANSFORMS")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--output", help="also write the JSON report to this path")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    images = load_images(args.images, limit=args.limit, transform=args.input_transform)
+    labels = None
+    labels_path = args.labels or (args.images if os.path.isdir(args.images) or args.images.endswith(".json") else None)
+    if labels_path:
+        labels = torch.from_numpy(np.asarray(load_array(labels_path, "labels", args.limit))).long()
+
+    eager = load_model(config.NUM_CLASSES, model_path=args.model_path, device=torch.device("cpu"))
+    reference_logits = run_in_batches(eager, images)
+    calibration_path = args.calibration or config.QUANT_CALIBRATION_PATH or default_calibration_path(args.images)
+    calibration_batches = None
+    if calibration_path and "int8_static" in args.engines.split(","):
+        calibration_batches = load_calibration_batches(calibration_path, transform=args.input_transform)
+
+    report = {
+        "num_images": len(images),
+        "input_transform": args.input_transform,
+        "calibration": calibration_path,
+        "torch_threads": torch.get_num_threads(),
+        "engines": {},
+    }
+    # Fresh ONNX exports every run, so a previous run's graph is never measured
+    with tempfile.TemporaryDirectory(prefix="sketchclassifier-engines-") as export_dir:
+        for name in args.engines.split(","):
+            try:
+                engine = build_engine(
+                    name,
+                    copy.deepcopy(eager),
+                    calibration_batches=calibration_batches,
+                    onnx_path=os.path.join(export_dir, f"{name}.onnx"),
+                    num_threads=args.threads,
+                )
+                parity = check_parity(engine, images, reference_logits, labels)
+                parity["passed"] = parity["top1_agreement"] >= args.min_agreement
+                report["engines"][name] = {
+                    "parity": parity,
+                    "latency": [benchmark(engine, int(b), args.iterations) for b in args.batch_sizes.split(",")],
+                }
+            except Exception as e:
+                report["engines"][name] = {"error": str(e)}
+            print(f"{name}: {json.dumps(report['engines'][name])}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
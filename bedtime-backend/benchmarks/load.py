@@ -0,0 +1,174 @@
+# Closed-loop load generator for the backend and the voice cloner.
+#
+#   python -m benchmarks.load --target sketchclassify --concurrency 1,4,16 --requests 200
+#   python -m benchmarks.load --target update --concurrency 1,8 --duration 30
+#   python -m benchmarks.load --target tts --url http://127.0.0.1:5000 --concurrency 1,2
+#
+# Each concurrency level runs that many clients back to back, each sending its next request
+# as soon as the previous one finishes. Reports p50/p95/p99 latency, requests/sec and the
+# error count per level as JSON; compare the files from two commits to spot regressions.
+#
+# For the full pipeline without GPUs or API keys, point the backend at benchmarks.stubs.
+# Identical images and labels are answered from the caches. Pass --unique to send a
+# different drawing every time, and set CLASSIFY_CACHE_MAX_ITEMS=0 / AUDIO_CACHE_MAX_ITEMS=0
+# on the backend to measure the uncached path.
+import argparse
+import asyncio
+import itertools
+import time
+
+import httpx
+
+from benchmarks.common import percentiles, run_info, sketch_png, write_report
+
+TARGETS = {
+    "sketchclassify": "/infer/sketchclassify",
+    "batch": "/infer/sketchclassify/batch",
+    "update": "/infer/update",
+    "tts": "/tts",
+}
+
+
+class RequestFactory:
+    def __init__(self, target, image_bytes, unique, batch_size, label, text, voice_id, accept):
+        self.target = target
+        self.image_bytes = image_bytes
+        self.unique = unique
+        self.batch_size = batch_size
+        self.label = label
+        self.text = text
+        self.voice_id = voice_id
+        self.accept = accept
+        self.counter = itertools.count(1)
+
+    def _image(self):
+        if self.image_bytes is not None and not self.unique:
+            return self.image_bytes
+        return sketch_png(seed=next(self.counter) if self.unique else 0)
+
+    def build(self):
+        # Returns (path, request kwargs)
+        headers = {"Accept": self.accept} if self.accept else {}
+        if self.target == "sketchclassify":
+            headers["Content-Type"] = "image/png"
+            return TARGETS[self.target], {"content": self._image(), "headers": headers}
+        if self.target == "batch":
+            files = [("file", (f"sketch{i}.png", self._image(), "image/png")) for i in range(self.batch_size)]
+            return TARGETS[self.target], {"files": files, "headers": headers}
+        if self.target == "update":
+            return TARGETS[self.target], {"json": {"prediction": self.label, "confidence": 1.0}, "headers": headers}
+        return TARGETS[self.target], {"json": {"voice_id": self.voice_id, "text": self.text}, "headers": headers}
+
+
+async def register_voice(client, path):
+    with open(path, "rb") as f:
+        response = await client.post("/voices", files={"audio": ("voice.wav", f.read(), "audio/wav")})
+    response.raise_for_status()
+    return response.json()["voice_id"]
+
+
+async def run_level(client, factory, concurrency, total_requests, duration):
+    latencies = []
+    statuses = {}
+    issued = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif next(issued) >= total_requests:
+                return
+            path, kwargs = factory.build()
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, **kwargs)
+                await response.aread()
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    summary = percentiles(latencies)
+    summary.update({
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "errors": errors,
+        "statuses": statuses,
+    })
+    return summary
+
+
+async def run(args):
+    image_bytes = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_bytes = f.read()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        voice_id = args.voice_id
+        if args.target == "tts" and not voice_id:
+            if not args.voice_file:
+                raise SystemExit("--target tts needs --voice-id or --voice-file")
+            voice_id = await register_voice(client, args.voice_file)
+
+        factory = RequestFactory(
+            args.target, image_bytes, args.unique, args.batch_size, args.label, args.text, voice_id, args.accept
+        )
+        # Untimed requests first so connection setup and lazy initialisation are not measured
+        for _ in range(args.warmup):
+            path, kwargs = factory.build()
+            await client.post(path, **kwargs)
+
+        results = []
+        for concurrency in levels:
+            result = await run_level(client, factory, concurrency, args.requests, args.duration)
+            print(f"concurrency={concurrency}: p50={result.get('p50_ms', 0):.1f}ms "
+                  f"p99={result.get('p99_ms', 0):.1f}ms rps={result['requests_per_sec']:.2f} errors={result['errors']}")
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the backend or the voice cloner")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--target", choices=list(TARGETS), default="sketchclassify")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds per level (overrides --requests)")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--image", help="sketch to upload (default: a synthetic PNG)")
+    parser.add_argument("--unique", action="store_true", help="send a different drawing with every request")
+    parser.add_argument("--batch-size", type=int, default=8, help="images per request for --target batch")
+    parser.add_argument("--label", default="cat", help="prediction sent to /infer/update")
+    parser.add_argument("--text", default="Once upon a time a sleepy bear curled up under the stars and dreamed.")
+    parser.add_argument("--voice-id", help="registered voice for --target tts")
+    parser.add_argument("--voice-file", help="reference clip to register for --target tts")
+    parser.add_argument("--accept", default="", help="Accept header, e.g. audio/wav for raw audio bodies")
+    parser.add_argument("--output", help="also write the JSON report to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {
+        "run": run_info(),
+        "url": args.url,
+        "target": args.target,
+        "unique": args.unique,
+        "levels": results,
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
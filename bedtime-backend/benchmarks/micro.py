@@ -0,0 +1,96 @@
+# Micro-benchmarks for the classification hot path: image preprocessing and the
+# classifier forward pass at several batch sizes.
+#
+#   python -m benchmarks.micro --output micro.json
+#   python -m benchmarks.micro --image drawing.png --model-path app/artifacts/model.pth
+#
+# Without --model-path the forward pass runs on randomly initialised weights, which
+# times the same kernels. Results are printed as JSON.
+import argparse
+import time
+
+import torch
+
+from app.config import Config
+from app.models.efficient_b0 import build_model, load_model
+from app.utils import preprocess_image, preprocessor
+from benchmarks.common import percentiles, run_info, sketch_png, write_report
+
+
+def time_calls(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return timings
+
+
+def bench_preprocess(image_bytes, batch_sizes, iterations, warmup):
+    results = {"preprocess_image": percentiles(time_calls(lambda: preprocess_image(image_bytes), iterations, warmup))}
+    batches = []
+    for batch_size in batch_sizes:
+        images = [image_bytes] * batch_size
+        # Reuse one output buffer, as a long-running worker would
+        out = torch.empty((batch_size, 1, 224, 224), dtype=torch.float32)
+        summary = percentiles(time_calls(lambda: preprocessor.preprocess_batch(images, out=out), iterations, warmup))
+        summary["batch_size"] = batch_size
+        summary["images_per_sec"] = batch_size * 1000.0 / summary["mean_ms"]
+        batches.append(summary)
+    results["preprocess_batch"] = batches
+    return results
+
+
+def bench_forward(model, batch_sizes, iterations, warmup):
+    results = []
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            inputs = torch.rand(batch_size, 1, 224, 224)
+            summary = percentiles(time_calls(lambda: model(inputs), iterations, warmup))
+            summary["batch_size"] = batch_size
+            summary["images_per_sec"] = batch_size * 1000.0 / summary["mean_ms"]
+            results.append(summary)
+    return results
+
+
+def main():
+    config = Config()
+    parser = argparse.ArgumentParser(description="Micro-benchmark preprocessing and the classifier forward pass")
+    parser.add_argument("--image", help="sketch to preprocess (default: a synthetic 256x256 PNG)")
+    parser.add_argument("--model-path", help="classifier weights (default: random weights)")
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this path")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_bytes = f.read()
+    else:
+        image_bytes = sketch_png()
+
+    if args.model_path:
+        model = load_model(config.NUM_CLASSES, model_path=args.model_path, device=torch.device("cpu"))
+    else:
+        model = build_model(config.NUM_CLASSES).eval()
+
+    report = {
+        "run": run_info(),
+        "torch_threads": torch.get_num_threads(),
+        "image_bytes": len(image_bytes),
+        "preprocess": bench_preprocess(image_bytes, batch_sizes, args.iterations, args.warmup),
+        "forward": bench_forward(model, batch_sizes, args.iterations, args.warmup),
+    }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# Local stand-ins for the OpenAI chat API and the voice cloner, with configurable latency,
+# so the backend can be load tested without GPUs or API keys.
+#
+#   python -m benchmarks.stubs --llm-latency-ms 800 --tts-latency-ms 1500
+#
+# Then start the backend against them:
+#
+#   OPENAI_BASE_URL=http://127.0.0.1:9001/v1 OPENAI_API_KEY=stub \
+#   TTS_API_URL=http://127.0.0.1:9002/tts AUDIO_FILE_PATH=app/services/audio1.wav \
+#   uvicorn app.main:app --port 8080
+#
+# Latency is base + per-character time, with uniform jitter of +/- --jitter (fraction).
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import random
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+SAMPLE_RATE = 24000
+
+
+def wav_header(sample_rate, num_samples):
+    data_size = num_samples * 2
+    return b"".join([
+        b"RIFF", (36 + data_size).to_bytes(4, "little"), b"WAVE",
+        b"fmt ", (16).to_bytes(4, "little"), (1).to_bytes(2, "little"), (1).to_bytes(2, "little"),
+        sample_rate.to_bytes(4, "little"), (sample_rate * 2).to_bytes(4, "little"),
+        (2).to_bytes(2, "little"), (16).to_bytes(2, "little"),
+        b"data", data_size.to_bytes(4, "little"),
+    ])
+
+
+class Latency:
+    def __init__(self, base_ms, per_char_ms, jitter):
+        self.base_ms = base_ms
+        self.per_char_ms = per_char_ms
+        self.jitter = jitter
+
+    async def wait(self, chars=0):
+        ms = self.base_ms + self.per_char_ms * chars
+        ms *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(ms, 0.0) / 1000.0)
+
+
+def openai_app(latency, story_words, token_ms):
+    app = FastAPI()
+    counter = itertools.count()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await latency.wait()
+        # A different story every call, so narration isn't served from the audio cache
+        n = next(counter)
+        story = f"Story {n}. " + " ".join(["Once upon a time a sleepy bear went to bed."] * max(story_words // 10, 1))
+
+        if body.get("stream"):
+            # Server-sent events, one word per chunk, token_ms apart
+            async def events():
+                for i, word in enumerate(story.split(" ")):
+                    await asyncio.sleep(token_ms / 1000.0)
+                    chunk = {
+                        "id": f"chatcmpl-stub-{n}",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stub"),
+                        "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return {
+            "id": f"chatcmpl-stub-{n}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": story}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def tts_app(latency, seconds_per_char):
+    app = FastAPI()
+
+    @app.post("/voices")
+    async def register_voice(request: Request):
+        await request.body()
+        return {"voice_id": "stub-voice"}
+
+    @app.get("/voices/{voice_id}")
+    async def get_voice(voice_id: str):
+        return {"voice_id": voice_id}
+
+    @app.post("/tts")
+    async def tts(request: Request):
+        data = await request.json()
+        text = data.get("text", "")
+        num_samples = int(len(text) * seconds_per_char * SAMPLE_RATE)
+        pcm = np.zeros(num_samples, dtype=np.int16).tobytes()
+
+        if data.get("stream"):
+            # Header first, then the samples in a few sentence-sized pieces
+            async def chunks():
+                # Unknown length up front, like the voice cloner's streaming header
+                yield wav_header(SAMPLE_RATE, 0x7FFFFFFF // 2)
+                pieces = 4
+                step = max(len(pcm) // pieces, 2) & ~1
+                for start in range(0, len(pcm), step):
+                    await latency.wait(len(text) // pieces)
+                    yield pcm[start:start + step]
+            return StreamingResponse(chunks(), media_type="audio/wav")
+
+        await latency.wait(len(text))
+        audio = wav_header(SAMPLE_RATE, num_samples) + pcm
+        if "audio/" in request.headers.get("accept", ""):
+            return Response(content=audio, media_type="audio/wav")
+        return JSONResponse({
+            "output_audio": base64.b64encode(audio).decode("ascii"),
+            "voice_id": data.get("voice_id", "stub-voice"),
+            "format": "wav",
+            "mime_type": "audio/wav",
+        })
+
+    return app
+
+
+async def serve(apps):
+    servers = [uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning")) for app, host, port in apps]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI and TTS servers for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=9001)
+    parser.add_argument("--tts-port", type=int, default=9002)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-ms-per-token", type=float, default=10.0, help="delay between streamed words")
+    parser.add_argument("--tts-latency-ms", type=float, default=500.0)
+    parser.add_argument("--tts-ms-per-char", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--story-words", type=int, default=90)
+    parser.add_argument("--audio-seconds-per-char", type=float, default=0.06)
+    args = parser.parse_args()
+
+    print(f"OpenAI stub on http://{args.host}:{args.openai_port}/v1, TTS stub on http://{args.host}:{args.tts_port}/tts")
+    asyncio.run(serve([
+        (openai_app(Latency(args.llm_latency_ms, 0.0, args.jitter), args.story_words, args.llm_ms_per_token), args.host, args.openai_port),
+        (tts_app(Latency(args.tts_latency_ms, args.tts_ms_per_char, args.jitter), args.audio_seconds_per_char), args.host, args.tts_port),
+    ]))
+
+
+if __name__ == "__main__":
+    main()
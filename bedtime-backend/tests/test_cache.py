@@ -0,0 +1,73 @@
+import os
+import time
+
+from app.services.cache import DiskCache, LRUCache, TieredCache, content_key
+
+
+def test_content_key_separates_parts():
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key("a", b"b") == content_key("a", "b")
+
+
+def test_lru_evicts_least_recently_used_item():
+    cache = LRUCache(max_items=2)
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    cache.get("a")
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_evicts_over_byte_budget():
+    cache = LRUCache(max_items=10, max_bytes=10)
+    cache.set("a", b"x" * 6)
+    cache.set("b", b"x" * 6)
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 6
+    # Larger than the whole budget: not stored at all
+    cache.set("c", b"x" * 11)
+    assert cache.get("c") is None
+    assert cache.get("b") == b"x" * 6
+
+
+def test_lru_expires_after_ttl():
+    cache = LRUCache(ttl=0.01)
+    cache.set("a", b"1")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats()["items"] == 0
+
+
+def test_disk_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    key = content_key("story", "house")
+    cache.set(key, b"once upon a time")
+    assert DiskCache(str(tmp_path)).get(key) == b"once upon a time"
+    assert cache.get(content_key("story", "cat")) is None
+    assert not any(name.startswith(".tmp-") for _, _, names in os.walk(tmp_path) for name in names)
+
+
+def test_disk_prune_removes_oldest_files(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10)
+    for i, key in enumerate(("a1", "b2", "c3")):
+        cache.set(key, b"x" * 4)
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    cache.prune()
+    assert cache.get("a1") is None
+    assert cache.get("b2") == b"x" * 4
+    assert cache.get("c3") == b"x" * 4
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.set("k1", b"value")
+    cache = TieredCache(LRUCache(), disk)
+    assert cache.memory.get("k1") is None
+    assert cache.get("k1") == b"value"
+    assert cache.memory.get("k1") == b"value"
+
+    cache.set("k2", b"other")
+    assert disk.get("k2") == b"other"
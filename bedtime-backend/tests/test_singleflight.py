@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from app.services.singleflight import SingleFlight, SingleFlightTimeout
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "story"
+
+    async def main():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*[flight.do("house", compute) for _ in range(8)])
+        return flight, results
+
+    flight, results = asyncio.run(main())
+    assert results == ["story"] * 8
+    assert len(calls) == 1
+    assert flight.stats()["leaders"] == 1
+    assert flight.stats()["coalesced"] == 7
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    calls = []
+
+    async def compute(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        flight = SingleFlight("test")
+        return await asyncio.gather(*[flight.do(key, lambda key=key: compute(key)) for key in ("cat", "dog", "cat")])
+
+    assert asyncio.run(main()) == ["cat", "dog", "cat"]
+    assert sorted(calls) == ["cat", "dog"]
+
+
+def test_every_waiter_gets_the_exception():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("LLM down")
+
+    async def main():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*[flight.do("house", fail) for _ in range(3)], return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["errors"] == 1
+
+
+def test_timeout_does_not_cancel_the_call_for_others():
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        flight = SingleFlight("test")
+        patient = asyncio.ensure_future(flight.do("house", slow))
+        with pytest.raises(SingleFlightTimeout):
+            await flight.do("house", slow, timeout=0.01)
+        return flight, await patient
+
+    flight, result = asyncio.run(main())
+    assert result == "done"
+    assert flight.stats()["timeouts"] == 1
+    assert flight.stats()["abandoned"] == 0
+
+
+def test_call_is_cancelled_once_every_waiter_left():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        flight = SingleFlight("test")
+        waiters = [asyncio.ensure_future(flight.do("house", slow)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled
+        waiters[1].cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return flight
+
+    flight = asyncio.run(main())
+    assert cancelled == [True]
+    assert flight.stats()["abandoned"] == 1
+
+
+def test_join_tells_the_leader_apart():
+    async def compute(out):
+        out.append("sentence")
+        return "story"
+
+    async def main():
+        flight = SingleFlight("test")
+        leader_out, follower_out = [], []
+        leader, leader_result = flight.join("house", lambda: compute(leader_out))
+        follower, follower_result = flight.join("house", lambda: compute(follower_out))
+        story = await flight.do("house", lambda: compute([]))
+        return leader, follower, await leader_result, await follower_result, story, leader_out, follower_out
+
+    leader, follower, leader_story, follower_story, story, leader_out, follower_out = asyncio.run(main())
+    assert (leader, follower) == (True, False)
+    assert leader_story == follower_story == story == "story"
+    assert leader_out == ["sentence"] and follower_out == []
+
+
+def test_join_task_cancelled_before_it_runs_leaves_the_flight():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        flight = SingleFlight("test")
+        _, result = flight.join("house", slow)
+        result.cancel()
+        await asyncio.sleep(0.01)
+        return flight
+
+    flight = asyncio.run(main())
+    assert cancelled == [True]
+    assert flight.stats()["in_flight"] == 0
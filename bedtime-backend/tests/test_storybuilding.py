@@ -0,0 +1,115 @@
+import asyncio
+import io
+import json
+import wave
+
+import httpx
+import pytest
+
+from app.services import storybuilding
+from app.services.cache import LRUCache, TieredCache
+from app.services.singleflight import SingleFlight
+from app.services.upstream import Upstream
+
+
+def wav_segment(frames=240):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(24000)
+        f.writeframes(b"\0\0" * frames)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def services(monkeypatch, tmp_path):
+    # A voice cloner behind httpx.MockTransport and a fake LLM stream, with fresh caches
+    # and flights so every test starts cold
+    calls = {"llm": 0, "tts": 0, "voices": 0}
+
+    def voice_cloner(request):
+        if request.url.path == "/voices":
+            calls["voices"] += 1
+            return httpx.Response(200, json={"voice_id": "voice-1"})
+        calls["tts"] += 1
+        return httpx.Response(200, content=wav_segment(), headers={"content-type": "audio/wav"})
+
+    async def story_deltas(prediction):
+        calls["llm"] += 1
+        for delta in ("Once upon a time there was a ", f"{prediction}. ", "It fell asleep under the stars. ", "The end."):
+            await asyncio.sleep(0.005)
+            yield delta
+
+    voice = tmp_path / "voice.wav"
+    voice.write_bytes(wav_segment())
+    monkeypatch.setattr(storybuilding, "tts_client", httpx.AsyncClient(transport=httpx.MockTransport(voice_cloner)))
+    monkeypatch.setattr(storybuilding, "tts_upstream", Upstream("tts", max_concurrency=4, retries=0))
+    monkeypatch.setattr(storybuilding, "TTS_API_URL", "http://voicecloner/tts")
+    monkeypatch.setattr(storybuilding, "TTS_VOICES_URL", "http://voicecloner/voices")
+    monkeypatch.setattr(storybuilding, "AUDIO_FILE_PATH", str(voice))
+    monkeypatch.setattr(storybuilding, "_story_deltas", story_deltas)
+    monkeypatch.setattr(storybuilding, "narration_archive", None)
+    monkeypatch.setattr(storybuilding, "story_cache", TieredCache(LRUCache()))
+    monkeypatch.setattr(storybuilding, "audio_cache", TieredCache(LRUCache()))
+    monkeypatch.setattr(storybuilding, "_voice_ids", {})
+    monkeypatch.setattr(storybuilding, "_rotation", {})
+    for name in ("story_flight", "narration_flight", "voice_flight"):
+        monkeypatch.setattr(storybuilding, name, SingleFlight(name))
+    monkeypatch.setattr(storybuilding.config, "STORY_PIPELINE", True)
+    monkeypatch.setattr(storybuilding.config, "STORY_VARIANTS", 3)
+    monkeypatch.setattr(storybuilding.config, "STORY_PIPELINE_MIN_CHARS", 10)
+    return calls
+
+
+def variants(prediction):
+    return storybuilding._story_variants(storybuilding._story_key(prediction))
+
+
+async def streamed(prediction):
+    chunks, close = await storybuilding.stream_story({"prediction": prediction})
+    try:
+        return b"".join([chunk async for chunk in chunks])
+    finally:
+        await close()
+
+
+def test_concurrent_pipelined_streams_share_one_story(services):
+    async def main():
+        return await asyncio.gather(*[streamed("house") for _ in range(8)])
+
+    audio = asyncio.run(main())
+    assert all(body.startswith(b"RIFF") for body in audio)
+    assert services["llm"] == 1
+    assert services["voices"] == 1
+    assert len(variants("house")) == 1
+    assert storybuilding.story_flight.stats()["leaders"] == 1
+    assert storybuilding.story_flight.stats()["coalesced"] == 7
+
+
+def test_pipelined_stories_stop_at_the_variant_cap(services):
+    async def main():
+        for _ in range(6):
+            await streamed("house")
+
+    asyncio.run(main())
+    assert services["llm"] == 3
+    assert len(variants("house")) == 3
+
+
+def test_concurrent_pipelined_narrations_share_one_story(services):
+    async def main():
+        return await asyncio.gather(*[storybuilding.generate_story({"prediction": "cat"}) for _ in range(4)])
+
+    audio = asyncio.run(main())
+    assert len(set(audio)) == 1 and audio[0].startswith(b"RIFF")
+    assert services["llm"] == 1
+    assert services["voices"] == 1
+    assert len(variants("cat")) == 1
+
+
+def test_remember_story_keeps_the_newest_variants(services):
+    key = storybuilding._story_key("dog")
+    for i in range(5):
+        storybuilding._remember_story(key, f"story {i}")
+    assert json.loads(storybuilding.story_cache.get(key)) == ["story 2", "story 3", "story 4"]
@@ -0,0 +1,111 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import upstream
+from app.services.upstream import CircuitBreaker, CircuitOpenError, Upstream
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30.0)
+    for _ in range(2):
+        breaker.record_failure()
+        breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_trial_closes_on_success(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+    clock.now += 29.0
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.now += 1.0
+    breaker.check()
+    assert breaker.state == "half_open"
+    # Only the trial call goes through while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_half_open_trial_reopens_on_failure(clock):
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=30.0)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30.0
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock.now
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_upstream_retries_transient_errors_then_opens():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        raise httpx.ConnectError("refused")
+
+    async def main():
+        service = Upstream("test", max_concurrency=2, retries=2, retry_on=(httpx.TransportError,),
+                           backoff=0.0, failure_threshold=1)
+        with pytest.raises(httpx.ConnectError):
+            await service.call(flaky)
+        with pytest.raises(CircuitOpenError):
+            await service.call(flaky)
+        return service
+
+    service = asyncio.run(main())
+    assert len(attempts) == 3
+    assert service.stats()["state"] == "open"
+    assert service.stats()["in_flight"] == 0
+
+
+def test_upstream_hold_keeps_the_slot_until_release():
+    async def ok():
+        return "response"
+
+    async def main():
+        service = Upstream("test", max_concurrency=1, retries=0)
+        assert await service.call(ok, hold=True) == "response"
+        blocked = asyncio.ensure_future(service.call(ok))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        service.release()
+        return await blocked, service
+
+    result, service = asyncio.run(main())
+    assert result == "response"
+    assert service.stats()["in_flight"] == 0
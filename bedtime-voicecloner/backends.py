@@ -0,0 +1,348 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+
+import torch
+
+from batching import SynthesisBatcher
+from formats import encode
+from voices import (
+    VoiceStore,
+    configure_threads,
+    load_xtts,
+    stream_pcm16,
+    streaming_wav_header,
+    synthesize,
+    to_pcm16,
+    voice_path,
+)
+
+
+class Busy(Exception):
+    pass
+
+
+class UnknownVoice(Exception):
+    pass
+
+
+class ClosingStream:
+    # Iterable over a chunk generator that runs on_close exactly once: when iteration ends,
+    # or when the WSGI server closes the response, even if it was never iterated. A plain
+    # generator's finally never runs if the generator never started.
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            yield from self._chunks
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._chunks.close()
+        finally:
+            self._on_close()
+
+
+class LocalBackend:
+    # One in-process model. Synthesis is serialized on a lock and at most
+    # max_pending requests may be admitted (running or waiting) at a time. With
+    # batch_size > 1, sentences of concurrent requests share batched generate() calls.
+    def __init__(self, max_pending=8, voice_cache_size=32, voice_dir="", batch_size=1, batch_wait_ms=20.0,
+                 profile="default", threads=0, interop_threads=0):
+        print(f"Initializing TTS model ({profile} profile)...")
+        configure_threads(threads, interop_threads)
+        self.model, self.sample_rate = load_xtts(gpu=torch.cuda.is_available(), profile=profile)
+        device = "GPU" if torch.cuda.is_available() else f"CPU ({torch.get_num_threads()} threads)"
+        print(f"TTS model initialized. Processing will occur on: {device}")
+        self.profile = profile
+
+        self.voices = VoiceStore(self.model, max_voices=voice_cache_size, directory=voice_dir)
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._model_lock = threading.Lock()
+        self.batcher = None
+        if batch_size > 1:
+            self.batcher = SynthesisBatcher(self.model, self._model_lock, batch_size, batch_wait_ms)
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            raise Busy(f"TTS queue is full ({self.max_pending} pending requests).")
+
+    def _conditioning(self, voice_id):
+        conditioning = self.voices.get(voice_id)
+        if conditioning is None:
+            raise UnknownVoice(voice_id)
+        return conditioning
+
+    def register(self, audio_bytes):
+        self._admit()
+        try:
+            with self._model_lock:
+                return self.voices.register(audio_bytes)
+        finally:
+            self._slots.release()
+
+    def has_voice(self, voice_id):
+        return voice_id in self.voices
+
+    def synthesize(self, voice_id, text, audio_format):
+        conditioning = self._conditioning(voice_id)
+        self._admit()
+        try:
+            if self.batcher is not None:
+                wav = self.batcher.synthesize(text, conditioning)
+            else:
+                with self._model_lock:
+                    wav = synthesize(self.model, text, conditioning)
+            return encode(wav, self.sample_rate, audio_format)
+        finally:
+            self._slots.release()
+
+    def stream(self, voice_id, text):
+        conditioning = self._conditioning(voice_id)
+        self._admit()
+        return ClosingStream(self._stream(text, conditioning), self._slots.release)
+
+    def _stream(self, text, conditioning):
+        yield streaming_wav_header(self.sample_rate)
+        if self.batcher is not None:
+            yield from stream_batched(self.batcher, text, conditioning)
+            return
+        chunks = stream_pcm16(self.model, text, conditioning)
+        while True:
+            # Take the lock per sentence so concurrent streams interleave
+            with self._model_lock:
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    def stats(self):
+        stats = {"mode": "single", "profile": self.profile, "max_pending": self.max_pending}
+        if self.batcher is not None:
+            stats["batching"] = self.batcher.stats()
+        return stats
+
+
+def stream_batched(batcher, text, conditioning):
+    # All sentences are queued up front (so they batch with each other) and sent in order
+    futures = batcher.submit(text, conditioning)
+    try:
+        for future in futures:
+            yield to_pcm16(future.result(), normalize=False).tobytes()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def run_job(job, model, sample_rate, voices, results, model_lock, batcher):
+    job_id, kind, payload = job
+    try:
+        if kind == "register":
+            with model_lock:
+                voice_id = voices.register(payload["audio"])
+            results.put(("result", job_id, voice_id))
+            return
+
+        conditioning = voices.get(payload["voice_id"])
+        if conditioning is None:
+            results.put(("error", job_id, (404, "Unknown voice_id")))
+            return
+
+        if payload["stream"]:
+            results.put(("start", job_id, sample_rate))
+            if batcher is not None:
+                chunks = stream_batched(batcher, payload["text"], conditioning)
+            else:
+                chunks = stream_pcm16(model, payload["text"], conditioning)
+            for chunk in chunks:
+                results.put(("chunk", job_id, chunk))
+            results.put(("done", job_id, None))
+        else:
+            if batcher is not None:
+                wav = batcher.synthesize(payload["text"], conditioning)
+            else:
+                wav = synthesize(model, payload["text"], conditioning)
+            # Encoding happens here too so it scales with the worker count
+            results.put(("result", job_id, encode(wav, sample_rate, payload["format"])))
+    except Exception as e:
+        print(f"TTS worker {os.getpid()} failed job {job_id}: {e}")
+        results.put(("error", job_id, (500, str(e))))
+
+
+def worker_main(worker_index, jobs, results, settings):
+    # Runs in a spawned process with its own model; talks to the front end only via queues
+    configure_threads(settings["threads"], settings["interop_threads"])
+    model, sample_rate = load_xtts(gpu=settings["gpu"], profile=settings["profile"])
+    voices = VoiceStore(model, max_voices=settings["voice_cache_size"], directory=settings["voice_dir"])
+    model_lock = threading.Lock()
+    batcher = None
+    if settings["batch_size"] > 1:
+        batcher = SynthesisBatcher(model, model_lock, settings["batch_size"], settings["batch_wait_ms"])
+    results.put(("ready", None, worker_index))
+    print(f"TTS worker {worker_index} ready (pid {os.getpid()}).")
+
+    if batcher is None:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            run_job(job, model, sample_rate, voices, results, model_lock, None)
+        return
+
+    # Batching needs several jobs in flight at once: each runs on its own thread, and the
+    # worker only takes a new job while it has fewer than batch_size, leaving the rest of
+    # the queue to the other workers.
+    slots = threading.BoundedSemaphore(settings["batch_size"])
+
+    def run_and_release(job):
+        try:
+            run_job(job, model, sample_rate, voices, results, model_lock, batcher)
+        finally:
+            slots.release()
+
+    while True:
+        slots.acquire()
+        job = jobs.get()
+        if job is None:
+            break
+        threading.Thread(target=run_and_release, args=(job,), daemon=True).start()
+
+
+class PoolBackend:
+    # A pool of worker processes, each holding its own XTTS model, fed from one bounded
+    # job queue. Voices are shared between workers through the on-disk voice directory.
+    def __init__(self, num_workers=2, queue_size=8, voice_cache_size=32, voice_dir="", threads_per_worker=0, job_timeout=300.0,
+                 batch_size=1, batch_wait_ms=20.0, profile="default", interop_threads=0):
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.voice_dir = voice_dir
+        os.makedirs(voice_dir, exist_ok=True)
+
+        ctx = mp.get_context("spawn")
+        self._jobs = ctx.Queue(maxsize=queue_size)
+        self._results = ctx.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self.ready_workers = 0
+
+        settings = {
+            "gpu": torch.cuda.is_available(),
+            "threads": threads_per_worker,
+            "interop_threads": interop_threads,
+            "profile": profile,
+            "voice_cache_size": voice_cache_size,
+            "voice_dir": voice_dir,
+            "batch_size": batch_size,
+            "batch_wait_ms": batch_wait_ms,
+        }
+        self.batch_size = batch_size
+        self.profile = profile
+        self._workers = [
+            ctx.Process(target=worker_main, args=(i, self._jobs, self._results, settings), daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._dispatcher = threading.Thread(target=self._dispatch, name="tts-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch(self):
+        # Routes worker messages to the inbox of the request that owns the job
+        while True:
+            kind, job_id, value = self._results.get()
+            if kind == "ready":
+                self.ready_workers += 1
+                continue
+            with self._lock:
+                inbox = self._pending.get(job_id)
+                if kind in ("result", "error", "done"):
+                    self._pending.pop(job_id, None)
+            if inbox is not None:
+                inbox.put((kind, value))
+
+    def _submit(self, kind, payload):
+        job_id = next(self._ids)
+        inbox = queue.Queue()
+        with self._lock:
+            self._pending[job_id] = inbox
+        try:
+            self._jobs.put_nowait((job_id, kind, payload))
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(job_id, None)
+            raise Busy(f"TTS queue is full ({self.queue_size} queued requests).")
+        return job_id, inbox
+
+    def _receive(self, job_id, inbox):
+        try:
+            kind, value = inbox.get(timeout=self.job_timeout)
+        except queue.Empty:
+            with self._lock:
+                self._pending.pop(job_id, None)
+            raise TimeoutError(f"TTS job {job_id} timed out after {self.job_timeout}s.")
+        if kind == "error":
+            status, message = value
+            if status == 404:
+                raise UnknownVoice(message)
+            raise RuntimeError(message)
+        return kind, value
+
+    def register(self, audio_bytes):
+        job_id, inbox = self._submit("register", {"audio": audio_bytes})
+        return self._receive(job_id, inbox)[1]
+
+    def has_voice(self, voice_id):
+        return os.path.exists(voice_path(self.voice_dir, voice_id))
+
+    def synthesize(self, voice_id, text, audio_format):
+        job_id, inbox = self._submit("tts", {"voice_id": voice_id, "text": text, "stream": False, "format": audio_format})
+        return self._receive(job_id, inbox)[1]
+
+    def stream(self, voice_id, text):
+        job_id, inbox = self._submit("tts", {"voice_id": voice_id, "text": text, "stream": True})
+        # Wait for the worker to accept the job so voice errors surface before streaming
+        _, sample_rate = self._receive(job_id, inbox)
+        return ClosingStream(self._stream(job_id, inbox, sample_rate), lambda: self._forget(job_id))
+
+    def _stream(self, job_id, inbox, sample_rate):
+        yield streaming_wav_header(sample_rate)
+        while True:
+            kind, value = self._receive(job_id, inbox)
+            if kind == "done":
+                break
+            yield value
+
+    def _forget(self, job_id):
+        # Client gone or finished: stop routing this job's remaining chunks
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._pending)
+        return {
+            "mode": "pool",
+            "profile": self.profile,
+            "workers": self.num_workers,
+            "ready_workers": self.ready_workers,
+            "queue_size": self.queue_size,
+            "queue_depth": self._jobs.qsize(),
+            "in_flight": in_flight,
+            "batch_size": self.batch_size,
+        }
@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Xtts.inference defaults, so batched and unbatched synthesis sample the same way
+SAMPLING = {
+    "temperature": 0.75,
+    "length_penalty": 1.0,
+    "repetition_penalty": 10.0,
+    "top_k": 50,
+    "top_p": 0.85,
+}
+
+
+def split_text(model, text, language="en"):
+    # The same sentence splitting Xtts.inference does with enable_text_splitting=True
+    from TTS.tts.layers.xtts.tokenizer import split_sentence
+
+    return [s for s in split_sentence(text, language, model.tokenizer.char_limits[language]) if s.strip()]
+
+
+def text_tokens(model, sentence, language="en"):
+    tokens = torch.IntTensor(model.tokenizer.encode(sentence.strip().lower(), lang=language)).unsqueeze(0).to(model.device)
+    if tokens.shape[-1] >= model.args.gpt_max_text_tokens:
+        raise ValueError("Sentence is too long for XTTS; split the text into shorter sentences.")
+    return tokens
+
+
+def codes_to_wav(model, tokens, codes, gpt_cond_latent, speaker_embedding):
+    # GPT forward pass over the generated audio codes, then the HiFi-GAN vocoder, as in
+    # Xtts.inference; call under torch.inference_mode()
+    gpt = model.gpt
+    device = model.device
+    latents = gpt(
+        tokens,
+        torch.tensor([tokens.shape[-1]], device=device),
+        codes,
+        torch.tensor([codes.shape[-1] * gpt.code_stride_len], device=device),
+        cond_latents=gpt_cond_latent.to(device),
+        return_attentions=False,
+        return_latent=True,
+    )
+    wav = model.hifigan_decoder(latents, g=speaker_embedding.to(device)).cpu().squeeze()
+    return np.asarray(wav.numpy(), dtype=np.float32)
+
+
+def generate_batch(model, items, language="en"):
+    # items: list of (sentence, conditioning). Runs one GPT generate() for all sentences and
+    # returns one float32 wav per item.
+    #
+    # Xtts.inference feeds the GPT [conditioning latents | text] as a prefix embedding. Here
+    # each item's prefix is built exactly like that and left-padded to the longest one, with
+    # an attention mask hiding the padding, so every row generates as if it were alone. The
+    # audio codes are then turned into latents and decoded per row.
+    gpt = model.gpt
+    device = model.device
+    rows = []
+    with torch.inference_mode():
+        for sentence, (gpt_cond_latent, speaker_embedding) in items:
+            tokens = text_tokens(model, sentence, language)
+            cond = gpt_cond_latent.to(device)
+            padded = F.pad(F.pad(tokens, (0, 1), value=gpt.stop_text_token), (1, 0), value=gpt.start_text_token)
+            emb = gpt.text_embedding(padded) + gpt.text_pos_embedding(padded)
+            rows.append((tokens, cond, speaker_embedding, torch.cat([cond, emb], dim=1)))
+
+        length = max(prefix.shape[1] for *_, prefix in rows)
+        prefix_emb = torch.zeros(len(rows), length, rows[0][3].shape[-1], dtype=rows[0][3].dtype, device=device)
+        attention_mask = torch.zeros(len(rows), length + 1, dtype=torch.long, device=device)
+        for i, (*_, prefix) in enumerate(rows):
+            prefix_emb[i, length - prefix.shape[1]:] = prefix[0]
+            attention_mask[i, length - prefix.shape[1]:] = 1
+
+        # Same placeholder inputs GPT.compute_embeddings builds: the real prefix is the stored embedding
+        inputs = torch.full((len(rows), length + 1), 1, dtype=torch.long, device=device)
+        inputs[:, -1] = gpt.start_audio_token
+        gpt.gpt_inference.store_prefix_emb(prefix_emb)
+        codes = gpt.gpt_inference.generate(
+            inputs,
+            attention_mask=attention_mask,
+            bos_token_id=gpt.start_audio_token,
+            pad_token_id=gpt.stop_audio_token,
+            eos_token_id=gpt.stop_audio_token,
+            max_length=gpt.max_gen_mel_tokens + inputs.shape[-1],
+            do_sample=True,
+            num_return_sequences=1,
+            num_beams=1,
+            output_attentions=False,
+            **SAMPLING,
+        )[:, inputs.shape[-1]:]
+
+        wavs = []
+        for i, (tokens, cond, speaker_embedding, _) in enumerate(rows):
+            # Rows that finished early are padded with stop tokens; keep up to the first one
+            row = codes[i:i + 1]
+            stops = (row[0] == gpt.stop_audio_token).nonzero()
+            if len(stops):
+                row = row[:, :int(stops[0]) + 1]
+            wavs.append(codes_to_wav(model, tokens, row, cond, speaker_embedding))
+    return wavs
+
+
+class SynthesisBatcher:
+    # Gathers sentences from concurrent requests into batched generate() calls on one model.
+    # A batch is cut at max_batch_size sentences or max_wait_ms after its first sentence.
+    # model_lock is shared with everything else that uses the model (voice registration).
+    def __init__(self, model, model_lock, max_batch_size=4, max_wait_ms=20.0, language="en"):
+        self.model = model
+        self.model_lock = model_lock
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.language = language
+        self.counters = {"batches": 0, "sentences": 0, "failed_batches": 0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="tts-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, conditioning):
+        # One future per sentence, in order; cancel the rest if the caller goes away
+        futures = []
+        for sentence in split_text(self.model, text, self.language):
+            future = Future()
+            self._queue.put((sentence, conditioning, future))
+            futures.append(future)
+        if not futures:
+            raise ValueError("Text has nothing to synthesize.")
+        return futures
+
+    def synthesize(self, text, conditioning):
+        futures = self.submit(text, conditioning)
+        try:
+            return np.concatenate([future.result() for future in futures])
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            # Sentences of abandoned requests are dropped before they reach the model
+            items = [item for item in self._collect() if item[2].set_running_or_notify_cancel()]
+            if not items:
+                continue
+            try:
+                with self.model_lock:
+                    wavs = generate_batch(self.model, [(sentence, cond) for sentence, cond, _ in items], self.language)
+            except Exception as e:
+                print(f"TTS batch of {len(items)} sentences failed: {e}")
+                self.counters["failed_batches"] += 1
+                for *_, future in items:
+                    future.set_exception(e)
+                continue
+            self.counters["batches"] += 1
+            self.counters["sentences"] += len(items)
+            for (*_, future), wav in zip(items, wavs):
+                future.set_result(wav)
+
+    def stats(self):
+        batches = self.counters["batches"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000.0,
+            "queue_depth": self._queue.qsize(),
+            "avg_batch_size": self.counters["sentences"] / batches if batches else 0.0,
+            **self.counters,
+        }
@@ -0,0 +1,96 @@
+# Synthesis throughput with and without sentence batching on one XTTS model.
+#
+#   python bench_batching.py reference_voice.wav --requests 8 --batch-sizes 1,2,4,8
+#
+# Runs the same set of concurrent story requests once unbatched (one inference() call per
+# request under a lock, as SERVE_MODE=single does with TTS_BATCH_SIZE=1) and once per batch
+# size through SynthesisBatcher. Prints a markdown table; --output also writes JSON.
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from batching import SynthesisBatcher
+from voices import VoiceStore, load_xtts, synthesize
+
+STORIES = [
+    "Once upon a time, a little cat found a glowing moon in the garden. "
+    "She carried it home in her paws. That night, the whole house shone softly while everyone slept.",
+    "A tiny airplane wanted to fly above the clouds. Every morning it practised with the birds. "
+    "At last it soared so high that it could see the stars waking up.",
+    "The old tree by the river told stories to the fish. They listened every evening. "
+    "When winter came, the tree dreamed of them under the ice until spring.",
+    "A brave little snail set off to visit the sea. The journey took a whole summer. "
+    "When he finally arrived, the waves sang him a lullaby.",
+]
+
+
+def run(synthesize_one, texts, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        wavs = list(pool.map(synthesize_one, texts))
+    return time.perf_counter() - start, sum(len(wav) for wav in wavs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched XTTS synthesis")
+    parser.add_argument("voice", help="reference WAV to clone")
+    parser.add_argument("--requests", type=int, default=8, help="concurrent requests per run")
+    parser.add_argument("--batch-sizes", default="2,4,8")
+    parser.add_argument("--wait-ms", type=float, default=20.0)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = default)")
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, sample_rate = load_xtts(gpu=torch.cuda.is_available())
+    voices = VoiceStore(model)
+    with open(args.voice, "rb") as f:
+        conditioning = voices.get(voices.register(f.read()))
+    texts = [STORIES[i % len(STORIES)] for i in range(args.requests)]
+
+    # One warm-up call so the first run doesn't pay for lazy initialisation
+    synthesize(model, STORIES[0], conditioning)
+
+    lock = threading.Lock()
+
+    def unbatched(text):
+        with lock:
+            return synthesize(model, text, conditioning)
+
+    results = []
+    elapsed, samples = run(unbatched, texts, args.requests)
+    results.append({"mode": "unbatched", "batch_size": 1, "seconds": elapsed, "audio_s": samples / sample_rate})
+
+    for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+        batcher = SynthesisBatcher(model, lock, batch_size, args.wait_ms)
+        elapsed, samples = run(lambda text: batcher.synthesize(text, conditioning), texts, args.requests)
+        results.append({
+            "mode": "batched",
+            "batch_size": batch_size,
+            "seconds": elapsed,
+            "audio_s": samples / sample_rate,
+            "avg_batch_size": batcher.stats()["avg_batch_size"],
+        })
+
+    device = "GPU" if torch.cuda.is_available() else f"CPU ({torch.get_num_threads()} threads, {os.cpu_count()} cores)"
+    print(f"{args.requests} concurrent requests on {device}\n")
+    print("| mode | max batch | avg batch | wall (s) | requests/s | audio s per wall s | speedup |")
+    print("|---|---|---|---|---|---|---|")
+    baseline = results[0]["seconds"]
+    for r in results:
+        print(f"| {r['mode']} | {r['batch_size']} | {r.get('avg_batch_size', 1.0):.1f} | {r['seconds']:.1f} "
+              f"| {args.requests / r['seconds']:.2f} | {r['audio_s'] / r['seconds']:.2f} | {baseline / r['seconds']:.2f}x |")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"requests": args.requests, "device": device, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
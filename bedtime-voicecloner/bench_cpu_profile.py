@@ -0,0 +1,147 @@
+# Real-time factor and output quality of the CPU profile (TTS_PROFILE=cpu) against fp32.
+#
+#   python bench_cpu_profile.py reference_voice.wav --threads 8 --interop-threads 1
+#
+# Real-time factor (RTF) is synthesis time divided by the duration of the audio; below 1.0
+# is faster than real time. Quality is checked on identical audio codes: the fp32 GPT
+# samples the codes once (seeded), and both models turn them into audio. This isolates
+# the quantization error from sampling noise, which would make two runs of the same fp32
+# model differ. The script exits with status 1 when the spectral similarity falls below
+# --min-similarity.
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+from scipy.signal import stft
+
+from batching import SAMPLING, codes_to_wav, split_text, text_tokens
+from formats import resample
+from voices import VoiceStore, configure_threads, load_xtts, synthesize
+
+STORIES = [
+    "Once upon a time, a little cat found a glowing moon in the garden. "
+    "She carried it home in her paws. That night, the whole house shone softly while everyone slept.",
+    "A tiny airplane wanted to fly above the clouds. Every morning it practised with the birds. "
+    "At last it soared so high that it could see the stars waking up.",
+    "The old tree by the river told stories to the fish. They listened every evening. "
+    "When winter came, the tree dreamed of them under the ice until spring.",
+]
+
+
+def log_spectrogram(wav, sample_rate):
+    # 50 ms windows with a 12.5 ms hop, magnitude in dB
+    nperseg = int(sample_rate * 0.05)
+    _, _, spec = stft(wav, fs=sample_rate, nperseg=nperseg, noverlap=nperseg - nperseg // 4)
+    return 20.0 * np.log10(np.abs(spec) + 1e-5)
+
+
+def compare(reference, candidate, sample_rate):
+    length = min(len(reference), len(candidate))
+    reference, candidate = reference[:length], candidate[:length]
+    ref_spec, cand_spec = log_spectrogram(reference, sample_rate), log_spectrogram(candidate, sample_rate)
+    ref_mag, cand_mag = 10.0 ** (ref_spec / 20.0), 10.0 ** (cand_spec / 20.0)
+    noise = np.sum((reference - candidate) ** 2)
+    return {
+        # Cosine similarity of the magnitude spectrograms (1.0 = identical)
+        "spectral_similarity": float(np.sum(ref_mag * cand_mag) / (np.linalg.norm(ref_mag) * np.linalg.norm(cand_mag))),
+        # Root-mean-square difference of the dB spectrograms per frame, averaged
+        "log_spectral_distance_db": float(np.mean(np.sqrt(np.mean((ref_spec - cand_spec) ** 2, axis=0)))),
+        "waveform_snr_db": float(10.0 * np.log10(np.sum(reference ** 2) / max(noise, 1e-12))),
+    }
+
+
+def real_time_factor(model, sample_rate, conditioning, repeats):
+    factors = []
+    for _ in range(repeats):
+        for story in STORIES:
+            start = time.perf_counter()
+            wav = synthesize(model, story, conditioning)
+            factors.append((time.perf_counter() - start) / (len(wav) / sample_rate))
+    return statistics.median(factors)
+
+
+def quality(reference_model, candidate_model, sample_rate, conditioning, output_rate, seed):
+    gpt_cond_latent, speaker_embedding = conditioning
+    scores = []
+    for story in STORIES:
+        for sentence in split_text(reference_model, story):
+            torch.manual_seed(seed)
+            with torch.inference_mode():
+                tokens = text_tokens(reference_model, sentence)
+                codes = reference_model.gpt.generate(
+                    cond_latents=gpt_cond_latent,
+                    text_inputs=tokens,
+                    do_sample=True,
+                    num_return_sequences=1,
+                    num_beams=1,
+                    output_attentions=False,
+                    **SAMPLING,
+                )
+                wavs = [codes_to_wav(m, tokens, codes, gpt_cond_latent, speaker_embedding)
+                        for m in (reference_model, candidate_model)]
+            wavs = [resample(wav, sample_rate, output_rate) for wav in wavs]
+            scores.append(compare(*wavs, output_rate or sample_rate))
+    return {name: statistics.mean(score[name] for score in scores) for name in scores[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CPU TTS profile against fp32")
+    parser.add_argument("voice", help="reference WAV to clone")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = torch default)")
+    parser.add_argument("--interop-threads", type=int, default=1)
+    parser.add_argument("--output-rate", type=int, default=0, help="also compare after resampling to this rate")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-similarity", type=float, default=0.95)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    configure_threads(args.threads, args.interop_threads)
+    reference, sample_rate = load_xtts(gpu=False, profile="default")
+    candidate, _ = load_xtts(gpu=False, profile="cpu")
+    voices = VoiceStore(reference)
+    with open(args.voice, "rb") as f:
+        conditioning = voices.get(voices.register(f.read()))
+
+    # Warm both models up so lazy initialisation isn't timed
+    for model in (reference, candidate):
+        synthesize(model, STORIES[0], conditioning)
+
+    results = {
+        "threads": torch.get_num_threads(),
+        "interop_threads": args.interop_threads,
+        "rtf": {
+            "default": real_time_factor(reference, sample_rate, conditioning, args.repeats),
+            "cpu": real_time_factor(candidate, sample_rate, conditioning, args.repeats),
+        },
+        "quality": quality(reference, candidate, sample_rate, conditioning, args.output_rate, args.seed),
+        "output_rate": args.output_rate or sample_rate,
+    }
+
+    print(f"CPU, {results['threads']} intra-op / {args.interop_threads} inter-op threads\n")
+    print("| profile | median RTF | speedup |")
+    print("|---|---|---|")
+    for profile, rtf in results["rtf"].items():
+        print(f"| {profile} | {rtf:.2f} | {results['rtf']['default'] / rtf:.2f}x |")
+    q = results["quality"]
+    print(f"\nQuality vs fp32 at {results['output_rate']} Hz, same audio codes: "
+          f"spectral similarity {q['spectral_similarity']:.4f}, "
+          f"log-spectral distance {q['log_spectral_distance_db']:.2f} dB, "
+          f"waveform SNR {q['waveform_snr_db']:.1f} dB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if q["spectral_similarity"] < args.min_similarity:
+        print(f"FAIL: spectral similarity below {args.min_similarity}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Size and encode latency for every output format the voice cloner offers.
+#
+#   python bench_formats.py narrated_story.wav
+#
+# Feed it a narration produced by /tts (24 kHz XTTS output). Prints a markdown table for
+# the docs and, with --output, writes the same numbers as JSON.
+#
+# Results for a 12.5 s speech clip (the backend's reference voice, app/services/audio1.wav,
+# resampled to XTTS's 24 kHz), median of 9 encodes on one Xeon vCPU:
+#
+# | format | rate (Hz) | size (KiB) | kbps | as base64 (KiB) | encode (ms) |
+# |---|---|---|---|---|---|
+# | wav | 24000 | 587.3 | 384 | 783.1 | 0.5 |
+# | wav | 22050 | 539.6 | 353 | 719.4 | 9.3 |
+# | wav | 16000 | 391.5 | 256 | 522.1 | 7.9 |
+# | flac | 24000 | 235.8 | 154 | 314.4 | 6.7 |
+# | flac | 22050 | 223.2 | 146 | 297.7 | 12.8 |
+# | flac | 16000 | 186.7 | 122 | 248.9 | 10.3 |
+# | opus | 24000 | 54.2 | 35 | 72.3 | 633.8 |
+# | opus | 16000 | 40.6 | 27 | 54.1 | 593.9 |
+#
+# Opus is under a tenth of the 24 kHz WAV size but costs about 0.6 s of CPU per 12.5 s of
+# audio; FLAC is 40% of the WAV size for a few milliseconds.
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+import soundfile as sf
+
+from formats import FORMATS, encode, parse_format
+
+CANDIDATES = [
+    ("wav", None),
+    ("wav", 22050),
+    ("wav", 16000),
+    ("flac", None),
+    ("flac", 22050),
+    ("flac", 16000),
+    ("opus", None),
+    ("opus", 16000),
+]
+
+
+def measure(wav, sample_rate, audio_format, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encoded = encode(wav, sample_rate, audio_format)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return len(encoded), statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark voice cloner output formats")
+    parser.add_argument("input", help="mono WAV narration to re-encode")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    wav, sample_rate = sf.read(args.input, dtype="float32", always_2d=False)
+    if wav.ndim > 1:
+        wav = wav.mean(axis=1).astype(np.float32)
+    duration = len(wav) / sample_rate
+
+    results = []
+    for name, rate in CANDIDATES:
+        audio_format = parse_format(name, rate)
+        size, encode_ms = measure(wav, sample_rate, audio_format, args.repeats)
+        results.append({
+            "format": name,
+            "mime_type": FORMATS[name][2],
+            "sample_rate": audio_format.sample_rate or sample_rate,
+            "bytes": size,
+            "kbps": size * 8 / 1000.0 / duration,
+            "base64_bytes": 4 * ((size + 2) // 3),
+            "encode_ms": encode_ms,
+        })
+
+    print(f"Input: {args.input} ({duration:.1f}s at {sample_rate} Hz)\n")
+    print("| format | rate (Hz) | size (KiB) | kbps | as base64 (KiB) | encode (ms) |")
+    print("|---|---|---|---|---|---|")
+    for r in results:
+        print(f"| {r['format']} | {r['sample_rate']} | {r['bytes'] / 1024:.1f} | {r['kbps']:.0f} "
+              f"| {r['base64_bytes'] / 1024:.1f} | {r['encode_ms']:.1f} |")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"input": args.input, "duration_s": duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import io
+from collections import namedtuple
+from math import gcd
+
+import numpy as np
+
+from voices import wav_bytes
+
+# name -> (libsndfile container, subtype, mime type)
+FORMATS = {
+    "wav": ("WAV", "PCM_16", "audio/wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg"),
+}
+MIME_TYPES = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/flac": "flac",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+}
+# Opus only runs at these rates; anything else is rounded up to the next one
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+AudioFormat = namedtuple("AudioFormat", ["name", "sample_rate"])
+
+
+def parse_format(name=None, sample_rate=None):
+    # name is a format name or one of MIME_TYPES; sample_rate=None keeps the model's rate
+    name = (name or "wav").lower()
+    if name in MIME_TYPES:
+        name = MIME_TYPES[name]
+    if name not in FORMATS:
+        raise ValueError(f"Unsupported audio format '{name}'. Choose one of: {', '.join(FORMATS)}")
+
+    if sample_rate is not None:
+        sample_rate = int(sample_rate)
+        if not 8000 <= sample_rate <= 48000:
+            raise ValueError("sample_rate must be between 8000 and 48000 Hz.")
+        if name == "opus" and sample_rate not in OPUS_RATES:
+            sample_rate = next(rate for rate in OPUS_RATES if rate >= sample_rate)
+    return AudioFormat(name, sample_rate)
+
+
+def mime_type(audio_format):
+    return FORMATS[audio_format.name][2]
+
+
+def resample(wav, source_rate, target_rate):
+    if not target_rate or target_rate == source_rate:
+        return wav
+    from scipy.signal import resample_poly
+
+    divisor = gcd(source_rate, target_rate)
+    return resample_poly(wav, target_rate // divisor, source_rate // divisor).astype(np.float32)
+
+
+def encode(wav, source_rate, audio_format):
+    # wav is mono float32 at source_rate; output is mono at audio_format.sample_rate
+    wav = resample(wav, source_rate, audio_format.sample_rate)
+    sample_rate = audio_format.sample_rate or source_rate
+    if audio_format.name == "wav":
+        return wav_bytes(wav, sample_rate)
+
+    import soundfile as sf
+
+    container, subtype, _ = FORMATS[audio_format.name]
+    # Same peak normalization as the WAV path, kept in float for the encoder
+    wav = wav * (0.9999 / max(0.01, float(np.max(np.abs(wav)))))
+    buffer = io.BytesIO()
+    sf.write(buffer, wav, sample_rate, format=container, subtype=subtype)
+    return buffer.getvalue()
@@ -1,65 +1,287 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import base64
+import json
 import os
-import torch
-from TTS.api import TTS
+import tempfile
+import time
+import uuid
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from backends import Busy, UnknownVoice, LocalBackend, PoolBackend
+from formats import MIME_TYPES, mime_type, parse_format
 
 app = Flask(__name__)
 
-# Set environment variable to confirm Coqui TOS agreement
-os.environ["COQUI_TOS_AGREED"] = "1"
+# "single" keeps one in-process model; "pool" runs TTS_WORKERS model processes behind waitress
+SERVE_MODE = os.getenv("SERVE_MODE", "single")
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))
+TTS_THREADS_PER_WORKER = int(os.getenv("TTS_THREADS_PER_WORKER", "0"))
+# "cpu" quantizes the model to int8 for CPU-only nodes; see voices.quantize_for_cpu
+TTS_PROFILE = os.getenv("TTS_PROFILE", "default")
+# Intra-op threads for SERVE_MODE=single and inter-op threads per model (0 = torch default)
+TTS_THREADS = int(os.getenv("TTS_THREADS", "0"))
+TTS_INTEROP_THREADS = int(os.getenv("TTS_INTEROP_THREADS", "0"))
+# Output rate used when a request doesn't ask for one (0 = the model's 24 kHz)
+TTS_OUTPUT_SAMPLE_RATE = int(os.getenv("TTS_OUTPUT_SAMPLE_RATE", "0"))
+TTS_QUEUE_SIZE = int(os.getenv("TTS_QUEUE_SIZE", "8"))
+TTS_JOB_TIMEOUT_S = float(os.getenv("TTS_JOB_TIMEOUT_S", "300"))
+# Sentences of concurrent requests batched into one generate() call per model; 1 disables
+TTS_BATCH_SIZE = int(os.getenv("TTS_BATCH_SIZE", "1"))
+TTS_BATCH_WAIT_MS = float(os.getenv("TTS_BATCH_WAIT_MS", "20"))
+TTS_RETRY_AFTER_S = int(os.getenv("TTS_RETRY_AFTER_S", "2"))
+HTTP_THREADS = int(os.getenv("HTTP_THREADS", "16"))
+VOICE_CACHE_SIZE = int(os.getenv("VOICE_CACHE_SIZE", "32"))
+VOICE_CACHE_DIR = os.getenv("VOICE_CACHE_DIR", "")
+
+backend = None
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+REQUEST_SECONDS = Histogram(
+    "voicecloner_request_seconds", "End-to-end HTTP request latency", ["endpoint", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram("voicecloner_stage_seconds", "Latency of each /tts stage", ["stage"], buckets=LATENCY_BUCKETS)
+ERRORS = Counter("voicecloner_errors_total", "Failed requests by cause", ["reason"])
+QUEUE_DEPTH = Gauge("voicecloner_queue_depth", "TTS jobs waiting for a worker")
+IN_FLIGHT = Gauge("voicecloner_in_flight", "TTS jobs submitted and not finished")
+
+
+def thread_settings():
+    # The CPU profile splits the cores between models and keeps inter-op parallelism off:
+    # XTTS is one sequential chain of ops, so extra inter-op threads only add contention
+    workers = TTS_WORKERS if SERVE_MODE == "pool" else 1
+    threads = TTS_THREADS_PER_WORKER if SERVE_MODE == "pool" else TTS_THREADS
+    interop = TTS_INTEROP_THREADS
+    if TTS_PROFILE == "cpu":
+        threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        interop = interop or 1
+    return threads, interop
+
+
+def create_backend():
+    threads, interop_threads = thread_settings()
+    if SERVE_MODE == "pool":
+        # Workers share registered voices through disk, so the pool always needs a directory
+        voice_dir = VOICE_CACHE_DIR or tempfile.mkdtemp(prefix="voices-")
+        print(f"Starting {TTS_WORKERS} TTS worker processes (queue size {TTS_QUEUE_SIZE}).")
+        return PoolBackend(
+            num_workers=TTS_WORKERS,
+            queue_size=TTS_QUEUE_SIZE,
+            voice_cache_size=VOICE_CACHE_SIZE,
+            voice_dir=voice_dir,
+            threads_per_worker=threads,
+            interop_threads=interop_threads,
+            profile=TTS_PROFILE,
+            job_timeout=TTS_JOB_TIMEOUT_S,
+            batch_size=TTS_BATCH_SIZE,
+            batch_wait_ms=TTS_BATCH_WAIT_MS,
+        )
+    try:
+        return LocalBackend(
+            max_pending=TTS_QUEUE_SIZE,
+            voice_cache_size=VOICE_CACHE_SIZE,
+            voice_dir=VOICE_CACHE_DIR,
+            batch_size=TTS_BATCH_SIZE,
+            batch_wait_ms=TTS_BATCH_WAIT_MS,
+            profile=TTS_PROFILE,
+            threads=threads,
+            interop_threads=interop_threads,
+        )
+    except Exception as e:
+        print(f"Failed to initialize TTS model: {e}")
+        raise
+
+
+class timed:
+    # Records a stage in the histogram and in this request's log line
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.labels(self.stage).observe(elapsed)
+        g.stages[self.stage] = round(elapsed * 1000.0, 2)
+
+
+@app.before_request
+def start_trace():
+    # The backend forwards its X-Request-ID so one request can be followed across services
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.stages = {}
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def finish_trace(response):
+    # Streamed responses are timed up to the first byte
+    elapsed = time.perf_counter() - g.start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.labels(endpoint, str(response.status_code)).observe(elapsed)
+    response.headers['X-Request-ID'] = g.request_id
+    if endpoint != '/metrics':
+        print(json.dumps({
+            'request_id': g.request_id,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'total_ms': round(elapsed * 1000.0, 2),
+            'stages_ms': g.stages,
+        }))
+    return response
+
+
+def busy_response(e):
+    # Shed load quickly instead of queueing without bound
+    ERRORS.labels('busy').inc()
+    print(f"Rejecting request: {e}")
+    return jsonify({'error': str(e)}), 503, {'Retry-After': str(TTS_RETRY_AFTER_S)}
+
+
+def read_reference_audio():
+    # Reference clip as a raw audio/* body, a multipart "audio" file or base64 "input_audio" in JSON
+    if request.mimetype.startswith("audio/"):
+        return request.get_data()
+    if "audio" in request.files:
+        return request.files["audio"].read()
+    data = request.get_json(silent=True) or {}
+    if data.get("input_audio"):
+        return base64.b64decode(data["input_audio"])
+    return None
+
+
+@app.route('/voices', methods=['POST'])
+def register_voice():
+    print("Received a voice registration request.")
+    audio_bytes = read_reference_audio()
+    if not audio_bytes:
+        return jsonify({'error': 'Missing reference audio'}), 400
+
+    try:
+        with timed('register'):
+            voice_id = backend.register(audio_bytes)
+        print(f"Voice registered: {voice_id}")
+        return jsonify({'voice_id': voice_id})
+    except Busy as e:
+        return busy_response(e)
+    except Exception as e:
+        ERRORS.labels('register').inc()
+        print(f"Error during voice registration: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/voices/<voice_id>', methods=['GET'])
+def get_voice(voice_id):
+    if not backend.has_voice(voice_id):
+        return jsonify({'error': 'Unknown voice_id'}), 404
+    return jsonify({'voice_id': voice_id})
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(backend.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    stats = backend.stats()
+    QUEUE_DEPTH.set(stats.get('queue_depth', 0))
+    IN_FLIGHT.set(stats.get('in_flight', 0))
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
-# Initialize TTS model and log device info
-try:
-    print("Initializing TTS model...")
-    tts = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", gpu=torch.cuda.is_available())
-    device = "GPU" if torch.cuda.is_available() else "CPU"
-    print(f"TTS model initialized. Processing will occur on: {device}")
-except Exception as e:
-    print(f"Failed to initialize TTS model: {e}")
-    raise
 
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
     print("Received a request for text-to-speech conversion.")
     data = request.json
+    voice_id = data.get('voice_id')
     input_audio = data.get('input_audio')
     text = data.get('text')
 
-    if not input_audio or not text:
-        print("Missing input_audio or text in the request.")
-        return jsonify({'error': 'Missing input_audio or text'}), 400
+    if not (voice_id or input_audio) or not text:
+        print("Missing voice_id/input_audio or text in the request.")
+        return jsonify({'error': 'Missing voice_id/input_audio or text'}), 400
 
+    # Output format from the "format"/"sample_rate" fields or the Accept header
+    accepted = request.accept_mimetypes.best_match(['application/json', *MIME_TYPES])
+    binary = accepted is not None and accepted != 'application/json'
     try:
-        # Decode the input audio from Base64
-        input_audio_path = "/tmp/input_audio.wav"
-        print("Decoding input_audio from Base64.")
-        with open(input_audio_path, "wb") as f:
-            f.write(base64.b64decode(input_audio))
-        print(f"Input audio saved at: {input_audio_path}")
-
-        # Generate speech using the input voice as `speaker_wav`
-        output_path = "/tmp/output_audio.wav"
-        print("Generating speech from text using the TTS model.")
-        tts.tts_to_file(
-            text=text,
-            file_path=output_path,
-            speaker_wav=input_audio_path,
-            language="en"
+        audio_format = parse_format(
+            data.get('format') or (accepted if binary else None),
+            data.get('sample_rate') or TTS_OUTPUT_SAMPLE_RATE or None,
         )
-        print(f"Output audio generated and saved at: {output_path}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Legacy clients still send the clip; registering it reuses cached latents next time
+        if not voice_id:
+            print("Registering inline input_audio.")
+            with timed('register'):
+                voice_id = backend.register(base64.b64decode(input_audio))
+
+        if data.get('stream'):
+            # Streams are always PCM WAV at the model rate; sentences are sent as raw samples
+            print("Streaming speech sentence by sentence.")
+            chunks = backend.stream(voice_id, text)
+            response = Response(
+                stream_with_context(log_stream(chunks)),
+                mimetype='audio/wav',
+                headers={'X-Voice-Id': voice_id},
+            )
+            # Frees the TTS slot even if the client leaves before the body is iterated
+            response.call_on_close(chunks.close)
+            return response
+
+        print("Generating speech from text using the TTS model.")
+        # Includes waiting for a free worker and encoding to the requested format
+        with timed('synthesize'):
+            audio = backend.synthesize(voice_id, text, audio_format)
+
+        # Clients that accept audio get the encoded bytes as the body, without base64
+        if binary:
+            print("Request processed successfully.")
+            return Response(audio, mimetype=mime_type(audio_format), headers={'X-Voice-Id': voice_id})
 
         # Encode the output audio to Base64 for the response
         print("Encoding output audio to Base64.")
-        with open(output_path, "rb") as f:
-            output_audio = base64.b64encode(f.read()).decode('utf-8')
+        with timed('base64_encode'):
+            output_audio = base64.b64encode(audio).decode('utf-8')
 
         print("Request processed successfully.")
-        return jsonify({'output_audio': output_audio})
+        return jsonify({
+            'output_audio': output_audio,
+            'voice_id': voice_id,
+            'format': audio_format.name,
+            'mime_type': mime_type(audio_format),
+        })
+    except Busy as e:
+        return busy_response(e)
+    except UnknownVoice:
+        ERRORS.labels('unknown_voice').inc()
+        print(f"Unknown voice_id: {voice_id}")
+        return jsonify({'error': 'Unknown voice_id'}), 404
     except Exception as e:
+        ERRORS.labels('tts').inc()
         print(f"Error during text-to-speech processing: {e}")
         return jsonify({'error': str(e)}), 500
 
+def log_stream(chunks):
+    try:
+        yield from chunks
+        print("Streamed request processed successfully.")
+    except Exception as e:
+        # Headers are already sent; aborting the response tells the client the audio is incomplete
+        ERRORS.labels('stream').inc()
+        print(f"Error during streamed text-to-speech processing: {e}")
+        raise
+
 if __name__ == '__main__':
-    print("Starting Flask app...")
-    app.run(host='0.0.0.0', port=5000)
+    backend = create_backend()
+    if SERVE_MODE == "pool":
+        from waitress import serve
+
+        print(f"Starting waitress with {HTTP_THREADS} threads...")
+        serve(app, host='0.0.0.0', port=5000, threads=HTTP_THREADS)
+    else:
+        print("Starting Flask app...")
+        app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,216 @@
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+
+
+# "default" runs the model as shipped; "cpu" quantizes it for CPU-only nodes (see quantize_for_cpu)
+PROFILES = ("default", "cpu")
+
+
+def load_xtts(gpu=False, profile="default"):
+    from TTS.api import TTS
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown TTS profile '{profile}'. Choose one of: {', '.join(PROFILES)}")
+    # Set environment variable to confirm Coqui TOS agreement
+    os.environ["COQUI_TOS_AGREED"] = "1"
+    tts = TTS(model_name=MODEL_NAME, gpu=gpu)
+    model = tts.synthesizer.tts_model
+    if profile == "cpu" and not gpu:
+        quantize_for_cpu(model)
+    model.eval()
+    return model, model.config.audio.output_sample_rate
+
+
+def configure_threads(intra_op=0, inter_op=0):
+    # Must run before any parallel torch work in the process (model loading included):
+    # torch refuses to resize the inter-op pool once it has started
+    if inter_op:
+        torch.set_num_interop_threads(inter_op)
+    if intra_op:
+        torch.set_num_threads(intra_op)
+
+
+def _conv1d_to_linear(module):
+    # HF GPT-2 blocks use transformers' Conv1D (a Linear with a transposed weight), which
+    # quantize_dynamic doesn't recognise. The GPT and its inference wrapper share these
+    # blocks, so converting in place covers both.
+    for name, child in module.named_children():
+        if type(child).__name__ == "Conv1D":
+            linear = torch.nn.Linear(child.weight.shape[0], child.nf)
+            linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def quantize_for_cpu(model):
+    # int8 dynamic quantization (weights int8, activations quantized per call) of every
+    # Linear layer in the GPT, where nearly all CPU time goes, and in the HiFi-GAN decoder.
+    # The decoder is mostly convolutions, which dynamic quantization leaves in fp32.
+    from torch.ao.quantization import quantize_dynamic
+
+    _conv1d_to_linear(model.gpt)
+    quantize_dynamic(model.gpt, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    quantize_dynamic(model.hifigan_decoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def voice_path(directory, voice_id):
+    return os.path.join(directory, f"{voice_id}.pt")
+
+
+def voice_id_for(audio_bytes: bytes) -> str:
+    # Same clip, same id, so re-registering is free
+    return hashlib.sha256(audio_bytes).hexdigest()[:16]
+
+
+class VoiceStore:
+    # Speaker conditioning (GPT conditioning latents + speaker embedding) per voice id,
+    # kept in a bounded LRU with an optional on-disk copy that survives restarts.
+    def __init__(self, model, max_voices=32, directory=""):
+        self.model = model
+        self.max_voices = max_voices
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._voices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, voice_id):
+        return voice_path(self.directory, voice_id)
+
+    def _remember(self, voice_id, conditioning):
+        with self._lock:
+            self._voices[voice_id] = conditioning
+            self._voices.move_to_end(voice_id)
+            while len(self._voices) > self.max_voices:
+                self._voices.popitem(last=False)
+
+    def register(self, audio_bytes: bytes) -> str:
+        voice_id = voice_id_for(audio_bytes)
+        if self.get(voice_id) is not None:
+            return voice_id
+
+        # XTTS loads reference audio from a path; use a private file per request
+        with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+            f.write(audio_bytes)
+            f.flush()
+            with torch.inference_mode():
+                gpt_cond_latent, speaker_embedding = self.model.get_conditioning_latents(audio_path=[f.name])
+
+        conditioning = (gpt_cond_latent, speaker_embedding)
+        if self.directory:
+            # Written under a temp name so other worker processes never load a partial file
+            tmp_path = f"{self._path(voice_id)}.{os.getpid()}.tmp"
+            torch.save({"gpt_cond_latent": gpt_cond_latent, "speaker_embedding": speaker_embedding}, tmp_path)
+            os.replace(tmp_path, self._path(voice_id))
+        self._remember(voice_id, conditioning)
+        return voice_id
+
+    def get(self, voice_id):
+        with self._lock:
+            conditioning = self._voices.get(voice_id)
+            if conditioning is not None:
+                self._voices.move_to_end(voice_id)
+                return conditioning
+
+        if self.directory and os.path.exists(self._path(voice_id)):
+            saved = torch.load(self._path(voice_id), map_location="cpu", weights_only=True)
+            conditioning = (saved["gpt_cond_latent"], saved["speaker_embedding"])
+            self._remember(voice_id, conditioning)
+            return conditioning
+        return None
+
+    def __contains__(self, voice_id):
+        return self.get(voice_id) is not None
+
+
+def synthesize(model, text, conditioning, language="en"):
+    gpt_cond_latent, speaker_embedding = conditioning
+    with torch.inference_mode():
+        out = model.inference(
+            text,
+            language,
+            gpt_cond_latent,
+            speaker_embedding,
+            enable_text_splitting=True,
+        )
+    wav = out["wav"]
+    if torch.is_tensor(wav):
+        wav = wav.cpu().numpy()
+    return np.asarray(wav, dtype=np.float32)
+
+
+def to_pcm16(wav, normalize=True):
+    if normalize:
+        # Same peak normalization TTS.utils.audio.numpy_transforms.save_wav applies
+        wav = wav * (32767 / max(0.01, float(np.max(np.abs(wav)))))
+    else:
+        # Streamed sentences can't know the story's peak, so keep a fixed scale
+        wav = np.clip(wav, -1.0, 1.0) * 32767
+    return wav.astype(np.int16)
+
+
+def split_sentences(text, min_chars=20):
+    # Split after sentence punctuation, folding very short fragments into the next sentence
+    sentences = []
+    pending = ""
+    for part in re.split(r"(?<=[.!?])\s+", text.strip()):
+        pending = f"{pending} {part}".strip() if pending else part
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+def streaming_wav_header(sample_rate):
+    # RIFF and data sizes are unknown up front; 0xFFFFFFFF is what most players accept
+    # for a WAV stream of indefinite length.
+    return b"".join([
+        b"RIFF", struct.pack("<I", 0xFFFFFFFF), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16),
+        b"data", struct.pack("<I", 0xFFFFFFFF),
+    ])
+
+
+def stream_pcm16(model, text, conditioning, language="en"):
+    # Yields one chunk of 16-bit PCM per sentence as soon as it is synthesized
+    for sentence in split_sentences(text):
+        wav = synthesize(model, sentence, conditioning, language)
+        yield to_pcm16(wav, normalize=False).tobytes()
+
+
+def wav_header(sample_rate, num_samples):
+    data_size = num_samples * 2
+    return b"".join([
+        b"RIFF", struct.pack("<I", 36 + data_size), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16),
+        b"data", struct.pack("<I", data_size),
+    ])
+
+
+def wav_bytes(wav, sample_rate):
+    # Header and samples share one buffer, so the only copy is the final tobytes()
+    header = wav_header(sample_rate, len(wav))
+    out = np.empty(len(header) // 2 + len(wav), dtype=np.int16)
+    out[:len(header) // 2] = np.frombuffer(header, dtype=np.int16)
+    out[len(header) // 2:] = to_pcm16(wav)
+    return out.tobytes()